@@ -34,7 +34,7 @@ def validate_sample(sampling):
     return True
 
 
-def checkout(entity, tag, sampling=None, retries=2, force=False, dataset=False, labels=False, version=-1):
+def checkout(entity, tag, sampling=None, retries=2, force=False, dataset=False, labels=False, version=-1, paranoid=False):
     """This command allows retrieving the data of a specific version of an ML entity.
 
     Example:
@@ -55,6 +55,7 @@ def checkout(entity, tag, sampling=None, retries=2, force=False, dataset=False,
         force (bool, optional): Force checkout command to delete untracked/uncommitted files from the local repository [default: False].
         dataset (bool, optional): If exist a dataset related with the model or labels, this one must be downloaded [default: False].
         labels (bool, optional): If exist labels related with the model, they must be downloaded [default: False].
+        paranoid (bool, optional): Verify the content of every chunk again, even the ones verified before [default: False].
 
     Returns:
         str: Return the path where the data was checked out.
@@ -72,6 +73,7 @@ def checkout(entity, tag, sampling=None, retries=2, force=False, dataset=False,
     options['force'] = force
     options['bare'] = False
     options['version'] = version
+    options['paranoid'] = paranoid
     repo.checkout(tag, sampling, options)
 
     data_path = os.path.join(entity, *tag.split('__')[:-1])
@@ -152,7 +154,7 @@ def commit(entity, ml_entity_name, commit_message=None, related_dataset=None, re
     repo.commit(ml_entity_name, specs, msg=commit_message)
 
 
-def push(entity, entity_name,  retries=2, clear_on_fail=False):
+def push(entity, entity_name,  retries=2, clear_on_fail=False, no_head=False):
     """This command allows pushing the data of a specific version of an ML entity.
 
         Example:
@@ -163,10 +165,11 @@ def push(entity, entity_name,  retries=2, clear_on_fail=False):
             entity_name (str): An ml-git entity name to identify a ML entity.
             retries (int, optional): Number of retries to upload the files to the storage [default: 2].
             clear_on_fail (bool, optional): Remove the files from the store in case of failure during the push operation [default: False].
+            no_head (bool, optional): Only skip the objects pushed before from this repository, without checking the store [default: False].
     """
 
     repo = Repository(config_load(), entity)
-    repo.push(entity_name, retries, clear_on_fail)
+    repo.push(entity_name, retries, clear_on_fail, no_head)
 
 
 def create(entity, entity_name, categories, mutability, **kwargs):
@@ -255,3 +258,39 @@ def remote_add(entity, remote_url, global_configuration=False):
 
     repo = Repository(config_load(), entity)
     repo.repo_remote_add(entity, remote_url, global_configuration)
+
+
+def pin(entity, tag):
+    """This command keeps the objects of a version of an ML entity in the local objects and cache until it is unpinned.
+
+        Example:
+            pin('dataset', 'computer-vision__images__dataset-ex__1')
+
+        Args:
+            entity (str): The type of an ML entity. (dataset, labels or model).
+            tag (str): A tag of the ML entity.
+
+        Returns:
+            bool: Whether the objects were pinned.
+    """
+
+    repo = Repository(config_load(), entity)
+    return repo.pin(tag)
+
+
+def unpin(entity, tag):
+    """This command lets gc and cache eviction remove the objects of a version of an ML entity pinned before.
+
+        Example:
+            unpin('dataset', 'computer-vision__images__dataset-ex__1')
+
+        Args:
+            entity (str): The type of an ML entity. (dataset, labels or model).
+            tag (str): A tag of the ML entity.
+
+        Returns:
+            bool: Whether the tag was pinned.
+    """
+
+    repo = Repository(config_load(), entity)
+    return repo.unpin(tag)
@@ -57,6 +57,7 @@ commands = [
         'options': {
             '--retry': {'default': 2, 'help': help_msg.RETRY_OPTION},
             '--clearonfail': {'is_flag': True, 'help': help_msg.CLEAR_ON_FAIL},
+            '--no-head': {'is_flag': True, 'help': help_msg.NO_HEAD},
         },
 
         'help': 'Push local commits from ML_ENTITY_NAME to remote ml-git repository & store.'
@@ -78,7 +79,8 @@ commands = [
 
             '--force': {'default': False, 'is_flag': True, 'help': help_msg.FORCE_CHECKOUT},
             '--bare': {'default': False, 'is_flag': True, 'help': help_msg.BARE_OPTION},
-            '--version': {'default': -1, 'help': help_msg.ARTIFACT_VERSION}
+            '--version': {'default': -1, 'help': help_msg.ARTIFACT_VERSION},
+            '--paranoid': {'default': False, 'is_flag': True, 'help': help_msg.PARANOID_CHECKOUT}
         },
 
         'arguments': {
@@ -106,7 +108,8 @@ commands = [
 
             '--force': {'is_flag': True, 'default': False, 'help': help_msg.FORCE_CHECKOUT},
             '--bare': {'default': False, 'is_flag': True, 'help': help_msg.BARE_OPTION},
-            '--version': {'default': -1, 'help': help_msg.ARTIFACT_VERSION}
+            '--version': {'default': -1, 'help': help_msg.ARTIFACT_VERSION},
+            '--paranoid': {'default': False, 'is_flag': True, 'help': help_msg.PARANOID_CHECKOUT}
         },
 
         'help': 'Checkout the ML_ENTITY_TAG|ML_ENTITY of a label set into user workspace.'
@@ -124,7 +127,8 @@ commands = [
 
             '--force': {'default': False, 'is_flag': True, 'help': help_msg.FORCE_CHECKOUT},
             '--bare': {'default': False, 'is_flag': True, 'help': help_msg.BARE_OPTION},
-            '--version': {'default': -1, 'help': help_msg.ARTIFACT_VERSION}
+            '--version': {'default': -1, 'help': help_msg.ARTIFACT_VERSION},
+            '--paranoid': {'default': False, 'is_flag': True, 'help': help_msg.PARANOID_CHECKOUT}
         },
 
         'arguments': {
@@ -488,6 +492,25 @@ commands = [
         'help': 'This command add read and write permissions to file or directory.'
                 ' Note: You should only use this command for the flexible mutability option.'
 
+    },
+    {
+        'name': 'watch',
+
+        'callback': entity.watch,
+
+        'groups': [entity.dataset, entity.model, entity.labels],
+
+        'arguments': {
+            'ml-entity-name': {},
+        },
+
+        'options': {
+            '--stop': {'is_flag': True, 'default': False, 'help': help_msg.WATCH_STOP_OPTION},
+        },
+
+        'help': 'Start a background process that records the files changed in the workspace of the entity,'
+                ' so status and add only check those files (Linux only).'
+
     },
     {
         'name': 'log',
@@ -72,7 +72,8 @@ def push(context, **kwargs):
     clear_on_fail = kwargs['clearonfail']
     entity = kwargs['ml_entity_name']
     retry = kwargs['retry']
-    repositories[repo_type].push(entity, retry, clear_on_fail)
+    no_head = kwargs['no_head']
+    repositories[repo_type].push(entity, retry, clear_on_fail, no_head)
 
 
 def checkout(context, **kwargs):
@@ -89,6 +90,7 @@ def checkout(context, **kwargs):
     options['force'] = kwargs['force']
     options['bare'] = kwargs['bare']
     options['version'] = kwargs['version']
+    options['paranoid'] = kwargs['paranoid']
     repo.checkout(kwargs['ml_entity_tag'], sample, options)
 
 
@@ -228,6 +230,13 @@ def export_tag(context, **kwargs):
     repositories[type].export(bucket, tag, retry)
 
 
+def watch(context, **kwargs):
+    repo_type = context.parent.command.name
+    entity_name = kwargs['ml_entity_name']
+    stop = kwargs['stop']
+    repositories[repo_type].watch(entity_name, stop)
+
+
 def unlock(context, **kwargs):
     repo_type = context.parent.command.name
     entity_name = kwargs['ml_entity_name']
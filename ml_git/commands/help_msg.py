@@ -6,11 +6,13 @@ SPDX-License-Identifier: GPL-2.0-only
 RETRY_OPTION = 'Number of retries to download the files from the storage [default: 2].'
 FORCE_CHECKOUT = 'Force checkout command to delete untracked/uncommitted files from local repository.'
 BARE_OPTION = 'Ability to add/commit/push without having the ml-entity checked out.'
+PARANOID_CHECKOUT = 'Verify the content of every chunk again, even the ones verified before and not changed since.'
 FSCK_OPTION = 'Run fsck after command execution.'
 TAG_OPTION = 'Ml-git tag to identify a specific version of a ML entity.'
 COMMIT_MSG = 'Use the provided <msg> as the commit message.'
 NOT_IMPLEMENTED = 'Not implemented yet'
 CLEAR_ON_FAIL = 'Remove the files from the store in case of failure during the push operation.'
+NO_HEAD = 'Do not check if the objects already exist in the store, only skip the ones pushed before from this repository.'
 SAMPLING_OPTION = 'group: <amount>:<group> The group sample option consists of '\
                   'amount and group used to download a sample.\n'\
                   'range: <start:stop:step> The range sample option consists of '\
@@ -63,3 +65,4 @@ STORAGE_CREDENTIALS = 'Profile name for storage credentials'
 STORAGE_REGION = 'Aws region name for S3 bucket'
 STORAGE_TYPE = 'Storage type (s3h, s3, azureblobh, gdriveh ...) [default: s3h]'
 GLOBAL_OPTION = 'Use this option to set configuration at global level'
+WATCH_STOP_OPTION = 'Stop the watcher of the entity.'
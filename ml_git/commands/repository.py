@@ -49,6 +49,15 @@ def update():
 
 @repository.command('gc', help='Cleanup unnecessary files and optimize the use of the disk space.')
 @click.help_option(hidden=True)
+@click.option('--dry-run', is_flag=True, default=False, help='Only report the number of files and the space that would be reclaimed.')
+@click.option('--full', is_flag=True, default=False, help='Check all the objects, not only the ones unused since the last gc.')
 @click.option('--verbose', is_flag=True, expose_value=False, callback=set_verbose_mode, help='Debug mode')
-def gc():
-    repositories[PROJECT].garbage_collector()
+def gc(dry_run, full):
+    repositories[PROJECT].garbage_collector(dry_run, full)
+
+
+@repository.command('repack', help='Move the loose objects to packfiles and reclaim the space of removed packed objects.')
+@click.help_option(hidden=True)
+@click.option('--verbose', is_flag=True, expose_value=False, callback=set_verbose_mode, help='Debug mode')
+def repack():
+    repositories[PROJECT].repack()
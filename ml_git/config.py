@@ -11,7 +11,9 @@ from halo import Halo
 
 from ml_git import spec
 from ml_git.constants import FAKE_STORE, BATCH_SIZE_VALUE, BATCH_SIZE, StoreType, GLOBAL_ML_GIT_CONFIG, \
-    PUSH_THREADS_COUNT, SPEC_EXTENSION
+    PUSH_THREADS_COUNT, SPEC_EXTENSION, INDEX_ENGINE, IndexEngine, HASH_WORKERS_COUNT, \
+    ADAPTIVE_CONCURRENCY, LISTING_THRESHOLD, OBJECTS_LAYOUT, ObjectsLayout, REMOTE_PACKS, WALK_WORKERS_COUNT, \
+    WALK_WORKERS_COUNT_VALUE, REFLINK, REFCOUNTS_FILE, CACHE_MAX_BYTES
 from ml_git.utils import getOrElse, yaml_load, yaml_save, get_root_path, yaml_load_str
 
 push_threads = os.cpu_count()*5
@@ -49,7 +51,25 @@ mlgit_config = {
     'cache_path': '',
     'metadata_path': '',
 
-    PUSH_THREADS_COUNT: push_threads
+    PUSH_THREADS_COUNT: push_threads,
+
+    INDEX_ENGINE: IndexEngine.YAML.value,
+
+    HASH_WORKERS_COUNT: os.cpu_count(),
+
+    WALK_WORKERS_COUNT: WALK_WORKERS_COUNT_VALUE,
+
+    ADAPTIVE_CONCURRENCY: False,
+
+    LISTING_THRESHOLD: 10000,
+
+    OBJECTS_LAYOUT: ObjectsLayout.LOOSE.value,
+
+    REMOTE_PACKS: False,
+
+    REFLINK: True,
+
+    CACHE_MAX_BYTES: 0
 
 }
 
@@ -205,6 +225,10 @@ def get_metadata_path(config, type='dataset'):
     return getOrElse(config[type], 'metadata_path', default)
 
 
+def get_refcounts_path(config):
+    return os.path.join(get_root_path(), config['mlgit_path'], REFCOUNTS_FILE)
+
+
 def get_refs_path(config, type='dataset'):
     root_path = get_root_path()
     default = os.path.join(root_path, config['mlgit_path'], type, 'refs')
@@ -444,3 +468,88 @@ def get_push_threads_count(config):
                            'This is should be a integer number greater than 0.' % PUSH_THREADS_COUNT)
 
     return push_threads_count
+
+
+def get_index_engine(config):
+    index_engine = config.get(INDEX_ENGINE, IndexEngine.YAML.value)
+    if index_engine not in IndexEngine.list():
+        raise RuntimeError('Invalid value in config file for the [%s] key. '
+                           'This should be one of %s.' % (INDEX_ENGINE, IndexEngine.list()))
+    return index_engine
+
+
+def get_hash_workers_count(config):
+    try:
+        hash_workers_count = int(config.get(HASH_WORKERS_COUNT, os.cpu_count()))
+        if hash_workers_count < 1:
+            raise ValueError()
+    except Exception:
+        raise RuntimeError('Invalid value in config file for the [%s] key. '
+                           'This is should be a integer number greater than 0.' % HASH_WORKERS_COUNT)
+
+    return hash_workers_count
+
+
+def get_walk_workers_count(config):
+    try:
+        walk_workers_count = int(config.get(WALK_WORKERS_COUNT, WALK_WORKERS_COUNT_VALUE))
+        if walk_workers_count < 1:
+            raise ValueError()
+    except Exception:
+        raise RuntimeError('Invalid value in config file for the [%s] key. '
+                           'This is should be a integer number greater than 0.' % WALK_WORKERS_COUNT)
+
+    return walk_workers_count
+
+
+def __get_bool(config, key, default):
+    # values overridden from the environment are strings
+    value = config.get(key, default)
+    if isinstance(value, str):
+        value = {'true': True, '1': True, 'false': False, '0': False}.get(value.strip().lower(), value)
+    if not isinstance(value, bool):
+        raise RuntimeError('Invalid value in config file for the [%s] key. '
+                           'This should be true or false.' % key)
+    return value
+
+
+def get_adaptive_concurrency(config):
+    return __get_bool(config, ADAPTIVE_CONCURRENCY, False)
+
+
+def get_listing_threshold(config):
+    try:
+        listing_threshold = int(config.get(LISTING_THRESHOLD, 10000))
+    except Exception:
+        raise RuntimeError('Invalid value in config file for the [%s] key. '
+                           'This is should be a integer number greater than or equal to 0.' % LISTING_THRESHOLD)
+
+    return listing_threshold
+
+
+def get_objects_layout(config):
+    objects_layout = config.get(OBJECTS_LAYOUT, ObjectsLayout.LOOSE.value)
+    if objects_layout not in ObjectsLayout.list():
+        raise RuntimeError('Invalid value in config file for the [%s] key. '
+                           'This should be one of %s.' % (OBJECTS_LAYOUT, ObjectsLayout.list()))
+    return objects_layout
+
+
+def get_remote_packs(config):
+    return __get_bool(config, REMOTE_PACKS, False)
+
+
+def get_reflink(config):
+    return __get_bool(config, REFLINK, True)
+
+
+def get_cache_max_bytes(config):
+    try:
+        cache_max_bytes = int(config.get(CACHE_MAX_BYTES, 0))
+        if cache_max_bytes < 0:
+            raise ValueError()
+    except Exception:
+        raise RuntimeError('Invalid value in config file for the [%s] key. '
+                           'This is should be a integer number greater than or equal to 0.' % CACHE_MAX_BYTES)
+
+    return cache_max_bytes
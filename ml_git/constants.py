@@ -12,6 +12,7 @@ CONFIG_CLASS_NAME = 'Ml-git Configuration'
 METADATA_MANAGER_CLASS_NAME = 'Metadata Manager'
 ADMIN_CLASS_NAME = 'Admin'
 HASH_FS_CLASS_NAME = 'HashFS'
+CACHE_CLASS_NAME = 'Cache'
 LOCAL_REPOSITORY_CLASS_NAME = 'Local Repository'
 MULTI_HASH_CLASS_NAME = 'Multihash'
 STORE_FACTORY_CLASS_NAME = 'Store Factory'
@@ -24,13 +25,39 @@ S3STORE_NAME = 'S3Store'
 AZURE_STORE_NAME = 'AzureStore'
 S3_MULTI_HASH_STORE_NAME = 'S3MultihashStore'
 MULTI_HASH_STORE_NAME = 'MultihashStore'
+MANIFEST_CLASS_NAME = 'Manifest'
+WATCHER_CLASS_NAME = 'Watcher'
+REFCOUNT_CLASS_NAME = 'RefCounts'
+LOCK_CLASS_NAME = 'LockManager'
 HEAD = 'HEAD'
 HEAD_1 = 'HEAD~1'
 FAKE_STORE = 'fake_store'
 FAKE_TYPE = 's3h'
 BATCH_SIZE = 'batch_size'
 PUSH_THREADS_COUNT = 'push_threads_count'
+INDEX_ENGINE = 'index_engine'
+HASH_WORKERS_COUNT = 'hash_workers_count'
+WALK_WORKERS_COUNT = 'walk_workers_count'
+ADAPTIVE_CONCURRENCY = 'adaptive_concurrency'
+LISTING_THRESHOLD = 'listing_threshold'
+OBJECTS_LAYOUT = 'objects_layout'
+CHUNKING = 'chunking'
+REMOTE_PACKS = 'remote_packs'
+REFLINK = 'reflink'
+CACHE_MAX_BYTES = 'cache_max_bytes'
 BATCH_SIZE_VALUE = 20
+FETCH_MAX_PENDING_BLOBS = 1000
+PACK_MAX_SIZE = 1024 * 1024 * 1024
+REMOTE_PACK_MAX_SIZE = 64 * 1024 * 1024
+# keys are listed from the stores by the prefix of their CID shared by all ('zdj7W') and the two next characters
+LISTING_PREFIX_SIZE = 7
+WALK_WORKERS_COUNT_VALUE = 8
+ADD_PENDING_FILES = 10000
+# files are hashed in the ml-git process until an add has this many files or bytes to hash
+HASH_POOL_MIN_FILES = 1000
+HASH_POOL_MIN_BYTES = 256 * 1024 * 1024
+GC_MAX_SET_KEYS = 1000000
+GC_BLOOM_ERROR_RATE = 0.001
 RGX_ADDED_FILES = r'[+]\s+(.*)[:]\s+null'
 RGX_DELETED_FILES = r'[-]\s+(.*)[:]\s+null'
 RGX_SIZE_FILES = r'[+]\s+size:\s+(\d+(?:[.]\d+)*\s+.+)'
@@ -50,7 +77,22 @@ GLOBAL_ML_GIT_CONFIG = '.mlgitconfig'
 STORE_LOG = 'store.log'
 SPEC_EXTENSION = '.spec'
 MANIFEST_FILE = 'MANIFEST.yaml'
+MANIFEST_BINARY_EXTENSION = '.bin'
+BINARY_MANIFESTS_DIR = 'binary_manifests'
 INDEX_FILE = 'INDEX.yaml'
+INDEX_DB_FILE = 'INDEX.db'
+STAT_CACHE_FILE = 'STAT_CACHE.db'
+WATCH_DIR = 'watch'
+VERIFIED_LEDGER_FILE = 'verified_chunks.db'
+REFCOUNTS_FILE = 'refcounts.db'
+CACHE_LRU_FILE = 'cache_lru.db'
+REMOTE_KEYS_FILE = 'remote_keys.db'
+REMOTE_PACKS_DIR = 'remote_packs'
+LOCKS_DIR = 'locks'
+STORE_LOCK_FILE = 'store.lock'
+KEY_LOCKS_FILE = 'keys.lock'
+KEY_LOCK_SLOTS = 1 << 20
+PINS_DIR = 'pins'
 DEFAULT_BRANCH_FOR_EMPTY_REPOSITORY = 'master'
 
 
@@ -64,6 +106,33 @@ class Mutability(Enum):
         return list(map(lambda c: c.value, Mutability))
 
 
+class IndexEngine(Enum):
+    YAML = 'yaml'
+    SQLITE = 'sqlite'
+
+    @staticmethod
+    def list():
+        return list(map(lambda c: c.value, IndexEngine))
+
+
+class Chunking(Enum):
+    FIXED = 'fixed'
+    CDC = 'cdc'
+
+    @staticmethod
+    def list():
+        return list(map(lambda c: c.value, Chunking))
+
+
+class ObjectsLayout(Enum):
+    LOOSE = 'loose'
+    PACK = 'pack'
+
+    @staticmethod
+    def list():
+        return list(map(lambda c: c.value, ObjectsLayout))
+
+
 @unique
 class StoreType(Enum):
     S3 = 's3'
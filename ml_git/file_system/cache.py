@@ -7,16 +7,56 @@ import os
 import humanize
 
 from ml_git import log
+from ml_git.constants import CACHE_CLASS_NAME, CACHE_LRU_FILE
+from ml_git.file_system.cache_lru import CacheLRU
 from ml_git.file_system.hashfs import HashFS
 from ml_git.ml_git_message import output_messages
 from ml_git.utils import yaml_load, remove_unnecessary_files
 
 
 class Cache(HashFS):
-    def __init__(self, cachepath, datapath='', manifest=''):
+    def __init__(self, cachepath, datapath='', manifest='', max_bytes=0):
         super(Cache, self).__init__(cachepath)
         self.__datapath = datapath
         self.__manifest = manifest
+        # accesses are only recorded when the cache has a size budget
+        self._max_bytes = max_bytes
+        self._lru = CacheLRU(os.path.join(cachepath, CACHE_LRU_FILE), self._path) if max_bytes else None
+
+    def touch(self, key):
+        if self._lru is None:
+            return
+        keypath = self._get_hashpath(key)
+        try:
+            self._lru.touch(keypath, os.stat(keypath).st_size)
+        except FileNotFoundError:
+            pass
+
+    def ilink(self, key, dstfile):
+        super(Cache, self).ilink(key, dstfile)
+        self.touch(key)
+
+    def link(self, key, srcfile, force=True):
+        super(Cache, self).link(key, srcfile, force)
+        self.touch(key)
+
+    def evict(self):
+        '''Removes the least recently used files until the cache fits its size budget, if any, keeping the pinned ones.'''
+        if self._lru is None:
+            return 0, 0
+        # files are only removed while no other process uses the cache, otherwise eviction waits for a later command
+        with self.get_locks().exclusive(blocking=False) as acquired:
+            if not acquired:
+                log.debug('Cache in use by another process, eviction skipped', class_name=CACHE_CLASS_NAME)
+                return 0, 0
+            count, reclaimed_space = self._lru.evict(self._max_bytes, self.get_locks().pinned())
+        if count:
+            log.debug(output_messages['INFO_REMOVED_FILES'] % (humanize.intword(count), self._path))
+        return count, reclaimed_space
+
+    def close(self):
+        if self._lru is not None:
+            self._lru.close()
 
     def update(self):
         objfiles = yaml_load(self.__manifest)
@@ -30,7 +70,9 @@ class Cache(HashFS):
                 except FileNotFoundError:
                     pass
 
-    def garbage_collector(self, blobs_hashes):
-        count_removed_cache, reclaimed_cache_space = remove_unnecessary_files(blobs_hashes, self._path)
-        log.debug(output_messages['INFO_REMOVED_FILES'] % (humanize.intword(count_removed_cache), self._path))
+    def garbage_collector(self, blobs_hashes, dry_run=False):
+        count_removed_cache, reclaimed_cache_space = remove_unnecessary_files(blobs_hashes, self._path, dry_run,
+                                                                              exclude=['log'])
+        if not dry_run:
+            log.debug(output_messages['INFO_REMOVED_FILES'] % (humanize.intword(count_removed_cache), self._path))
         return count_removed_cache, reclaimed_cache_space
@@ -0,0 +1,98 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import os
+import threading
+import time
+
+from ml_git import log
+from ml_git.constants import CACHE_CLASS_NAME
+from ml_git.file_system.db import open_db
+from ml_git.utils import set_write_read
+
+
+class CacheLRU(object):
+    '''Size and last access time of the files of a cache, to keep it under a size budget by evicting the least
+    recently used ones.
+
+    Accesses are kept in memory and written on flush (or evict), the files already in the cache when the database is
+    created are added with their mtime as access time. Files hard linked into a workspace (st_nlink > 1) are never
+    evicted, they would not free any space anyway.'''
+
+    def __init__(self, db_path, cache_path):
+        self._cache_path = cache_path
+        # accesses are recorded without waiting for the database
+        self._lock = threading.Lock()
+        self._accessed = {}
+        self._db = open_db(db_path)
+        with self._db.transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID')
+            db.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, atime_ns INTEGER) '
+                       'WITHOUT ROWID')
+            db.execute('CREATE INDEX IF NOT EXISTS files_atime ON files (atime_ns)')
+            if db.fetchone('SELECT value FROM settings WHERE name = ?', ('scanned',)) is None:
+                self._scan()
+
+    def _scan(self):
+        log.debug('Cache LRU: adding the files of [%s]' % self._cache_path, class_name=CACHE_CLASS_NAME)
+        for root, dirs, files in os.walk(self._cache_path):
+            if root == self._cache_path:
+                dirs[:] = [d for d in dirs if d != 'log']
+            for file in files:
+                st = os.stat(os.path.join(root, file))
+                self._db.execute('INSERT OR REPLACE INTO files (path, size, atime_ns) VALUES (?, ?, ?)',
+                                 (os.path.relpath(os.path.join(root, file), self._cache_path), st.st_size,
+                                  st.st_mtime_ns))
+        self._db.execute('INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)', ('scanned', '1'))
+
+    def touch(self, path, size):
+        '''Records an access to the file at path (a file of the cache).'''
+        with self._lock:
+            self._accessed[os.path.relpath(path, self._cache_path)] = (size, time.time_ns())
+
+    def flush(self):
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+        with self._db.transaction() as db:
+            db.executemany('INSERT OR REPLACE INTO files (path, size, atime_ns) VALUES (?, ?, ?)',
+                           ((path, size, atime_ns) for path, (size, atime_ns) in accessed.items()))
+
+    def evict(self, max_bytes, pinned=()):
+        '''Removes the least recently used files not linked into a workspace nor pinned until the cache takes at most
+        max_bytes. Returns the number of files removed and their size.'''
+        self.flush()
+        with self._db.transaction() as db:
+            total = db.fetchone('SELECT COALESCE(SUM(size), 0) FROM files')[0]
+            if total <= max_bytes:
+                return 0, 0
+            count = 0
+            reclaimed_space = 0
+            removed = []
+            for path, size in db.fetchall('SELECT path, size FROM files ORDER BY atime_ns'):
+                if total <= max_bytes:
+                    break
+                fullpath = os.path.join(self._cache_path, path)
+                try:
+                    st = os.stat(fullpath)
+                except FileNotFoundError:
+                    # removed by gc
+                    removed.append(path)
+                    total -= size
+                    continue
+                if st.st_nlink > 1 or os.path.basename(path) in pinned:
+                    continue
+                set_write_read(fullpath)
+                os.unlink(fullpath)
+                removed.append(path)
+                total -= size
+                count += 1
+                reclaimed_space += st.st_size
+            db.executemany('DELETE FROM files WHERE path = ?', ((path,) for path in removed))
+        log.debug('Cache LRU: %d files evicted from [%s], %d bytes left' % (count, self._cache_path, total),
+                  class_name=CACHE_CLASS_NAME)
+        return count, reclaimed_space
+
+    def close(self):
+        self._db.close()
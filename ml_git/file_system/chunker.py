@@ -0,0 +1,75 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import hashlib
+from operator import length_hint
+
+_MASK_64 = 0xFFFFFFFFFFFFFFFF
+# derived from SHA-256 rather than a random seed, the chunk boundaries must never change between versions
+_GEAR = tuple(int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], 'little') for i in range(256))
+_READ_SIZE = 4 * 1024 * 1024
+
+
+def _mask(bits):
+    # the high bits of the gear hash depend on the most bytes
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+class FastCDC(object):
+    '''Content-defined chunking (FastCDC, Xia et al. 2016).
+
+    Chunks end where a gear hash of the last bytes matches a mask, so inserting or removing bytes in a file only changes
+    the chunks around the edit instead of shifting every chunk after it. Chunks are between avg_size / 4 and
+    avg_size * 4 bytes, with sizes normalized around avg_size (a harder mask before it and an easier one after).'''
+
+    def __init__(self, avg_size=256 * 1024):
+        bits = avg_size.bit_length() - 1
+        self._avg_size = 1 << bits
+        self._min_size = self._avg_size // 4
+        self._max_size = self._avg_size * 4
+        self._mask_s = _mask(bits + 2)
+        self._mask_l = _mask(bits - 2)
+
+    @staticmethod
+    def _scan(data, start, end, mask, fp):
+        # returns the offset after the first byte where the hash matches the mask, or None
+        gear = _GEAR
+        it = iter(data[start:end])
+        for byte in it:
+            fp = ((fp << 1) + gear[byte]) & _MASK_64
+            if not fp & mask:
+                return end - length_hint(it), fp
+        return None, fp
+
+    def cut_point(self, data, start=0, end=None):
+        '''Offset where the chunk of data beginning at start ends.'''
+        end = len(data) if end is None else end
+        size = end - start
+        if size <= self._min_size:
+            return end
+        end = start + min(size, self._max_size)
+        normal = start + min(size, self._avg_size)
+        cut, fp = self._scan(data, start + self._min_size, normal, self._mask_s, 0)
+        if cut is None:
+            cut, fp = self._scan(data, normal, end, self._mask_l, fp)
+        return end if cut is None else cut
+
+    def chunks(self, f):
+        '''Yields the chunks of the binary file f.'''
+        buffer = b''
+        pos = 0
+        eof = False
+        while True:
+            if not eof and len(buffer) - pos < self._max_size:
+                data = f.read(_READ_SIZE)
+                eof = not data
+                buffer = buffer[pos:] + data
+                pos = 0
+                continue
+            if pos >= len(buffer):
+                return
+            cut = self.cut_point(buffer, pos)
+            yield buffer[pos:cut]
+            pos = cut
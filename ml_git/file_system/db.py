@@ -0,0 +1,75 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from ml_git.utils import ensure_path_exists
+
+
+class Database(object):
+    '''SQLite connection shared by the threads of a process, every statement running under its lock.
+
+    The database is in WAL mode, so readers of other processes do not block its writer, with synchronous=NORMAL:
+    a power loss can drop the last transactions but never corrupts it. The lock is reentrant, statements can be run
+    inside a transaction block.'''
+
+    def __init__(self, path, timeout=5.0):
+        directory = os.path.dirname(path)
+        if directory:
+            ensure_path_exists(directory)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+
+    def execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        with self._lock:
+            return self._conn.executemany(sql, seq_of_params)
+
+    def fetchone(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def fetchall(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @contextmanager
+    def locked(self):
+        with self._lock:
+            yield self
+
+    @contextmanager
+    def transaction(self):
+        '''Holds the lock for the block and commits the statements it ran, or rolls them back if it raises.'''
+        with self._lock:
+            try:
+                yield self
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def close(self, commit=False):
+        with self._lock:
+            if commit:
+                self._conn.commit()
+            self._conn.close()
+
+
+def open_db(path, timeout=5.0):
+    '''Opens (creating it if needed) the database at path, waiting up to timeout seconds for the lock of a writer.'''
+    return Database(path, timeout)
@@ -0,0 +1,91 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent import futures
+
+from ml_git import log
+from ml_git.constants import HASH_FS_CLASS_NAME, HASH_POOL_MIN_FILES, HASH_POOL_MIN_BYTES
+from ml_git.file_system.hashfs import MultihashFS
+
+_worker_hfs = {}
+
+
+def _get_worker_hfs(path, blocksize, levels, layout, chunking):
+    # one MultihashFS per worker process, reused across calls
+    key = (path, blocksize, levels, layout, chunking)
+    if key not in _worker_hfs:
+        _worker_hfs[key] = MultihashFS(path, blocksize, levels, layout, chunking)
+    return _worker_hfs[key]
+
+
+def _init_worker(log_level):
+    log.init_logger(log_level)
+
+
+def _put(path, blocksize, levels, layout, chunking, srcfile):
+    return _get_worker_hfs(path, blocksize, levels, layout, chunking).put(srcfile)
+
+
+def _get_scid(path, blocksize, levels, layout, chunking, srcfile):
+    return _get_worker_hfs(path, blocksize, levels, layout, chunking).get_scid(srcfile)
+
+
+class HashEngine(object):
+    '''Computes chunk digests and CIDs of files outside of the calling process.
+
+    put and get_scid have the same semantics as in MultihashFS, but the work is sent to a pool of
+    worker processes, so the threads of a WorkerPool only wait on it instead of competing for the GIL.
+    The pool is only started once HASH_POOL_MIN_FILES files or HASH_POOL_MIN_BYTES bytes were hashed, small adds do
+    not pay for starting the processes. With nworkers <= 1 the calls are always made in the current process.'''
+
+    def __init__(self, hfs, nworkers=os.cpu_count()):
+        self._hfs = hfs
+        self._nworkers = nworkers
+        self._pool = None
+        self._lock = threading.Lock()
+        self._files = 0
+        self._bytes = 0
+        self._args = (os.path.abspath(os.path.dirname(hfs._path)), hfs._blk_size, hfs._levels, hfs._layout,
+                      hfs._chunking)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                log.debug('Create a hashing pool with [%d] processes' % self._nworkers, class_name=HASH_FS_CLASS_NAME)
+                # spawn, since the pool can be started from inside a worker thread
+                self._pool = futures.ProcessPoolExecutor(max_workers=self._nworkers,
+                                                         mp_context=multiprocessing.get_context('spawn'),
+                                                         initializer=_init_worker, initargs=(log.get_level(),))
+            return self._pool
+
+    def _use_pool(self, srcfile):
+        if self._nworkers <= 1:
+            return False
+        with self._lock:
+            if self._pool is not None:
+                return True
+            self._files += 1
+            self._bytes += os.path.getsize(srcfile)
+            return self._files > HASH_POOL_MIN_FILES or self._bytes > HASH_POOL_MIN_BYTES
+
+    def _run(self, fn, local_fn, srcfile):
+        if not self._use_pool(srcfile):
+            return local_fn(srcfile)
+        return self._get_pool().submit(fn, *self._args, os.path.abspath(srcfile)).result()
+
+    def put(self, srcfile):
+        return self._run(_put, self._hfs.put, srcfile)
+
+    def get_scid(self, srcfile):
+        return self._run(_get_scid, self._hfs.get_scid, srcfile)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
@@ -3,17 +3,32 @@
 SPDX-License-Identifier: GPL-2.0-only
 """
 
+import errno
 import hashlib
 import json
 import os
+import tempfile
+import threading
+from contextlib import contextmanager
 
 import multihash
 from cid import CIDv1
 from ml_git import log
-from ml_git.constants import HASH_FS_CLASS_NAME, LOCAL_REPOSITORY_CLASS_NAME, STORE_LOG
-from ml_git.utils import json_load, ensure_path_exists, get_root_path, set_write_read
+from ml_git.config import get_objects_layout, get_reflink, mlgit_config
+from ml_git.constants import HASH_FS_CLASS_NAME, LOCAL_REPOSITORY_CLASS_NAME, STORE_LOG, ObjectsLayout, Chunking
+from ml_git.file_system.chunker import FastCDC
+from ml_git.file_system.lock import LockManager
+from ml_git.file_system.pack import PackFS, PACK_INDEX_FILE
+from ml_git.file_system.reflink import reflink_supported, clone_range, is_unsupported, UNSUPPORTED_ERRORS
+from ml_git.file_system.verified_ledger import VerifiedLedger
+from ml_git.utils import json_load, ensure_path_exists, get_root_path, set_write_read, tmp_file_path, is_tmp_file
 from tqdm import tqdm
 
+COPY_FILE_RANGE = 'copy_file_range'
+SENDFILE = 'sendfile'
+# errors meaning the kernel cannot copy between the pair of files, so the next method is tried
+SPLICE_UNSUPPORTED_ERRORS = UNSUPPORTED_ERRORS | {errno.EINVAL}
+
 '''implementation of a "hashdir" based filesystem
 Lack a few desirable properties of MultihashFS.
 Although good enough for ml-git cache implementation.'''
@@ -38,6 +53,7 @@ class HashFS(object):
         ensure_path_exists(self._path)
         self._logpath = os.path.join(self._path, 'log')
         ensure_path_exists(self._logpath)
+        self._locks = None
 
     def _hash_filename(self, filename):
         m = hashlib.md5()
@@ -49,33 +65,55 @@ class HashFS(object):
         h = os.sep.join(hs)
         return h
 
+    def get_locks(self):
+        if self._locks is None:
+            self._locks = LockManager(os.path.dirname(self._path))
+        return self._locks
+
+    def _replace_with_link(self, srcfile, dstfile):
+        # dstfile is replaced at once: it is never missing for other processes and concurrent links do not fail
+        if os.path.exists(dstfile):
+            if os.path.samefile(srcfile, dstfile):
+                return
+            set_write_read(dstfile)
+        tmp_path = tmp_file_path(dstfile)
+        try:
+            os.link(srcfile, tmp_path)
+        except FileExistsError:
+            # left by a process that died
+            os.unlink(tmp_path)
+            os.link(srcfile, tmp_path)
+        os.replace(tmp_path, dstfile)
+        if os.path.lexists(tmp_path):
+            # dstfile became a link to srcfile in the meantime, rename does nothing
+            os.unlink(tmp_path)
+
     def ilink(self, key, dstfile):
         srckey = self._get_hashpath(key)
         ensure_path_exists(os.path.dirname(dstfile))
 
         log.debug('Link from [%s] to [%s]' % (srckey, dstfile), class_name=HASH_FS_CLASS_NAME)
-        if os.path.exists(dstfile) is True:
-            set_write_read(dstfile)
-            os.unlink(dstfile)
-
-        os.link(srckey, dstfile)
+        self._replace_with_link(srckey, dstfile)
 
     def link(self, key, srcfile, force=True):
         dstkey = self._get_hashpath(key)
         ensure_path_exists(os.path.dirname(dstkey))
         log.debug('Link from [%s] to [%s]' % (srcfile, key), class_name=HASH_FS_CLASS_NAME)
-        if os.path.exists(dstkey) is True:
-            if force is True:
-                try:
-                    set_write_read(srcfile)
-                    os.unlink(srcfile)
-                    os.link(dstkey, srcfile)
-                except FileNotFoundError as e:
-                    log.debug(str(e), class_name=HASH_FS_CLASS_NAME)
-                    raise e
-
-            return
-        os.link(srcfile, dstkey)
+        if os.path.exists(dstkey) is False:
+            try:
+                os.link(srcfile, dstkey)
+                return
+            except FileExistsError:
+                # added by another process in the meantime
+                pass
+        if force is True:
+            try:
+                # srcfile is only replaced if it still exists
+                os.stat(srcfile)
+                self._replace_with_link(dstkey, srcfile)
+            except FileNotFoundError as e:
+                log.debug(str(e), class_name=HASH_FS_CLASS_NAME)
+                raise e
 
     def _get_hashpath(self, filename):
         hfilename = self._hash_filename(filename)
@@ -154,6 +192,7 @@ class HashFS(object):
         for root, dirs, files in os.walk(self._path):
             if STORE_LOG in files:
                 continue
+            files = [file for file in files if not is_tmp_file(file)]
             if len(files) > 0:
                 nfiles.extend(files)
             if len(nfiles) >= page_size:
@@ -167,6 +206,23 @@ class HashFS(object):
     def fsck(self, exclude=[]):
         return None
 
+    def remove_keys(self, keys, dry_run=False):
+        '''Removes the files of keys, returns the number of files removed and their size.'''
+        count = 0
+        reclaimed_space = 0
+        for key in keys:
+            fullpath = self._get_hashpath(key)
+            try:
+                size = os.stat(fullpath).st_size
+            except FileNotFoundError:
+                continue
+            count += 1
+            reclaimed_space += size
+            if not dry_run:
+                set_write_read(fullpath)
+                os.unlink(fullpath)
+        return count, reclaimed_space
+
     def remove_hash(self, hash_to_remove):
         fullpath = os.path.join(self._logpath, STORE_LOG)
         if not os.path.exists(fullpath):
@@ -189,13 +245,46 @@ This filesystem guarantees by design:
 
 
 class MultihashFS(HashFS):
-    def __init__(self, path, blocksize=256 * 1024, levels=2):
+    def __init__(self, path, blocksize=256 * 1024, levels=2, layout=None, chunking=Chunking.FIXED.value, reflink=None,
+                 ledger_path=None):
         super(MultihashFS, self).__init__(path, blocksize, levels)
         self._levels = levels
         if levels < 1:
             self._levels = 1
         if levels > 22:
             self.levels = 22
+        self._layout = layout if layout is not None else get_objects_layout(mlgit_config)
+        self._packs_path = os.path.join(path, 'packs')
+        self._packs = None
+        self._packs_lock = threading.Lock()
+        self._chunking = chunking
+        # content-defined chunks have blocksize as average size, fixed-size IPLDs stay readable as chunks are read by hash
+        self._cdc = FastCDC(self._blk_size) if chunking == Chunking.CDC.value else None
+        # files got from loose chunks share their extents (FICLONERANGE) until it fails as not supported
+        reflink = reflink if reflink is not None else get_reflink(mlgit_config)
+        self._reflink = reflink and reflink_supported()
+        # chunks already checked are copied in the kernel without being read again: the ones checked by this process,
+        # and with a ledger the ones whose file kept its stat since they were checked, unless paranoid
+        self._verified_chunks = set()
+        self._ledger_path = ledger_path
+        self._ledger = None
+        self._ledger_lock = threading.Lock()
+        self._paranoid = False
+        self._splice = COPY_FILE_RANGE if hasattr(os, 'copy_file_range') else SENDFILE if hasattr(os, 'sendfile') else None
+
+    def _get_packs(self, create=False):
+        # packs are only opened if they exist or if new objects go to packs
+        if self._packs is None:
+            with self._packs_lock:
+                if self._packs is None and (create or os.path.exists(os.path.join(self._packs_path, PACK_INDEX_FILE))):
+                    self._packs = PackFS(self._packs_path)
+        return self._packs
+
+    def _read_packed(self, key):
+        packs = self._get_packs()
+        if packs is None:
+            return None
+        return packs.read(key)
 
     def _get_hashpath(self, filename, path=None):
         hpath = self._path
@@ -207,6 +296,14 @@ class MultihashFS(HashFS):
 
     def _store_chunk(self, filename, data):
         fullpath = self._get_hashpath(filename)
+
+        if self._layout == ObjectsLayout.PACK.value:
+            if os.path.isfile(fullpath) is True or not self._get_packs(create=True).write(filename, data):
+                log.debug('Chunk [%s]-[%d] already exists' % (filename, len(data)), class_name=HASH_FS_CLASS_NAME)
+                return False
+            log.debug('Add chunk [%s]-[%d] to pack' % (filename, len(data)), class_name=HASH_FS_CLASS_NAME)
+            return True
+
         ensure_path_exists(os.path.dirname(fullpath))
 
         if os.path.isfile(fullpath) is True:
@@ -215,10 +312,46 @@ class MultihashFS(HashFS):
 
         if data is not None:
             log.debug('Add chunk [%s]-[%d]' % (filename, len(data)), class_name=HASH_FS_CLASS_NAME)
-            with open(fullpath, 'wb') as f:
+            tmp_path = tmp_file_path(fullpath)
+            with open(tmp_path, 'wb') as f:
                 f.write(data)
+            os.replace(tmp_path, fullpath)
+            self._mark_verified(filename)
             return True
 
+    def _get_ledger(self):
+        if self._ledger is None and self._ledger_path is not None:
+            with self._ledger_lock:
+                if self._ledger is None:
+                    self._ledger = VerifiedLedger(self._ledger_path)
+        return self._ledger
+
+    def _mark_verified(self, key, st=None):
+        '''Marks a loose chunk whose content has been checked against its key, e.g. right after being fetched.'''
+        ledger = self._get_ledger()
+        if ledger is not None and st is None:
+            try:
+                st = os.stat(self._get_hashpath(key))
+            except FileNotFoundError:
+                # moved to a pack, packed chunks are always checked
+                return
+        self._verified_chunks.add(key)
+        if ledger is not None:
+            ledger.add(key, st)
+
+    def _flush_verified(self):
+        # the chunks marked verified are written to the ledger once per file or fetch, not once per chunk
+        if self._ledger is not None:
+            self._ledger.flush()
+
+    def _is_verified(self, key, st):
+        if self._paranoid:
+            return False
+        if key in self._verified_chunks:
+            return True
+        ledger = self._get_ledger()
+        return ledger is not None and ledger.is_verified(key, st)
+
     def _check_integrity(self, cid, data):
         cid0 = self._digest(data)
         if cid == cid0:
@@ -235,13 +368,15 @@ class MultihashFS(HashFS):
         cid = CIDv1('dag-pb', mh)
         return str(cid)
 
+    def _chunks(self, f):
+        if self._cdc is not None:
+            return self._cdc.chunks(f)
+        return iter(lambda: f.read(self._blk_size), b'')
+
     def put(self, srcfile):
         links = []
         with open(srcfile, 'rb') as f:
-            while True:
-                d = f.read(self._blk_size)
-                if not d:
-                    break
+            for d in self._chunks(f):
                 scid = self._digest(d)
                 self._store_chunk(scid, d)
                 links.append({'Hash': scid, 'Size': len(d)})
@@ -254,10 +389,7 @@ class MultihashFS(HashFS):
     def get_scid(self, srcfile):
         links = []
         with open(srcfile, 'rb') as f:
-            while True:
-                d = f.read(self._blk_size)
-                if not d:
-                    break
+            for d in self._chunks(f):
                 scid = self._digest(d)
                 links.append({'Hash': scid, 'Size': len(d)})
 
@@ -285,7 +417,7 @@ class MultihashFS(HashFS):
 
     def get(self, object_key, dst_file_path):
         size = 0
-        descriptor = json_load(self._get_hashpath(object_key))
+        descriptor = self.load(object_key)
         json_objects = json.dumps(descriptor).encode()
         is_corrupted = not self._check_integrity(object_key, json_objects)
         if is_corrupted:
@@ -308,26 +440,179 @@ class MultihashFS(HashFS):
                 os.remove(dst_file_path)
             raise e
 
+        self._flush_verified()
         if not successfully_wrote:
             size = 0
             os.unlink(dst_file_path)
         return size
 
     def _write_chunk_in_file(self, chunk_hash, dst_file):
-        with open(self._get_hashpath(chunk_hash), 'rb') as chunk_file:
-            while True:
-                chunk_bytes = chunk_file.read(self._blk_size)
-                if not chunk_bytes:
-                    break
-                if self._check_integrity(chunk_hash, chunk_bytes) is False:
-                    return False
-                dst_file.write(chunk_bytes)
+        chunk_path = self._get_hashpath(chunk_hash)
+        data = None if os.path.exists(chunk_path) else self._read_packed(chunk_hash)
+        if data is not None:
+            if self._check_integrity(chunk_hash, data) is False:
+                return False
+            dst_file.write(data)
+            return True
+        with open(chunk_path, 'rb') as chunk_file:
+            st = os.fstat(chunk_file.fileno())
+            if self._is_verified(chunk_hash, st):
+                size = st.st_size
+                if self._reflink and self._clone_chunk(chunk_file, dst_file, size):
+                    return True
+                copied = self._splice_chunk(chunk_file, dst_file, size)
+                if copied < size:
+                    chunk_file.seek(copied)
+                    dst_file.write(chunk_file.read(size - copied))
+                return True
+            # chunks are checked whole, their size does not depend on the blocksize of this MultihashFS
+            chunk_bytes = chunk_file.read()
+            if self._check_integrity(chunk_hash, chunk_bytes) is False:
+                return False
+            self._mark_verified(chunk_hash, st)
+            if self._reflink and self._clone_chunk(chunk_file, dst_file, len(chunk_bytes)):
+                return True
+        dst_file.write(chunk_bytes)
         return True
 
+    def _clone_chunk(self, chunk_file, dst_file, size):
+        offset = dst_file.tell()
+        block_size = os.fstat(dst_file.fileno()).st_blksize
+        # extents are shared by whole blocks, a chunk ending inside a block can only be the last one
+        if offset % block_size != 0:
+            return False
+        dst_file.flush()
+        try:
+            clone_range(chunk_file.fileno(), 0, size, dst_file.fileno(), offset)
+        except OSError as e:
+            if is_unsupported(e):
+                log.debug('Reflink not supported for [%s]: %s' % (dst_file.name, e), class_name=HASH_FS_CLASS_NAME)
+                self._reflink = False
+            return False
+        dst_file.seek(offset + size)
+        return True
+
+    def _splice_chunk(self, chunk_file, dst_file, size):
+        '''Copies the chunk at the position of dst_file with copy_file_range or sendfile, so the data does not go
+        through userspace buffers. Returns the number of bytes copied, less than size when none of them is supported.'''
+        offset = dst_file.tell()
+        dst_file.flush()
+        src_fd, dst_fd = chunk_file.fileno(), dst_file.fileno()
+        copied = 0
+        while copied < size and self._splice is not None:
+            try:
+                if self._splice == COPY_FILE_RANGE:
+                    n = os.copy_file_range(src_fd, dst_fd, size - copied, copied, offset + copied)
+                else:
+                    os.lseek(dst_fd, offset + copied, os.SEEK_SET)
+                    n = os.sendfile(dst_fd, src_fd, copied, size - copied)
+            except OSError as e:
+                if e.errno not in SPLICE_UNSUPPORTED_ERRORS:
+                    raise
+                log.debug('%s not supported for [%s]: %s' % (self._splice, dst_file.name, e), class_name=HASH_FS_CLASS_NAME)
+                self._splice = SENDFILE if self._splice == COPY_FILE_RANGE and hasattr(os, 'sendfile') else None
+                continue
+            if n == 0:
+                break
+            copied += n
+        dst_file.seek(offset + copied)
+        return copied
+
     def load(self, key):
         srckey = self._get_hashpath(key)
+        data = None if os.path.exists(srckey) else self._read_packed(key)
+        if data is not None:
+            return json.loads(data)
         return json_load(srckey)
 
+    @contextmanager
+    def object_path(self, key):
+        '''Path of a file with the content of key, packed objects are copied to a temporary file.'''
+        keypath = self._get_hashpath(key)
+        data = None if os.path.exists(keypath) else self._read_packed(key)
+        if data is None:
+            yield keypath
+            return
+        fd, tmp_path = tempfile.mkstemp(prefix=key)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            yield tmp_path
+        finally:
+            os.unlink(tmp_path)
+
+    def read_object(self, key):
+        keypath = self._get_hashpath(key)
+        if os.path.exists(keypath):
+            with open(keypath, 'rb') as f:
+                return f.read()
+        return self._read_packed(key)
+
+    def object_size(self, key):
+        keypath = self._get_hashpath(key)
+        if os.path.exists(keypath):
+            return os.path.getsize(keypath)
+        packs = self._get_packs()
+        return packs.size(key) if packs is not None else None
+
+    def remove_keys(self, keys, dry_run=False):
+        count, reclaimed_space = super(MultihashFS, self).remove_keys(keys, dry_run)
+        packs = self._get_packs()
+        if packs is None:
+            return count, reclaimed_space
+        packed = [key for key in keys if packs.exists(key)]
+        count += len(packed)
+        if dry_run:
+            return count, reclaimed_space + sum(packs.size(key) for key in packed)
+        packs.remove(packed)
+        return count, reclaimed_space + packs.compact()
+
+    def pack_object(self, key):
+        '''Moves a loose object to the packs when the pack layout is in use.'''
+        keypath = self._get_hashpath(key)
+        if self._layout != ObjectsLayout.PACK.value or not os.path.exists(keypath):
+            return
+        with open(keypath, 'rb') as f:
+            self._get_packs(create=True).write(key, f.read())
+        os.unlink(keypath)
+
+    def repack(self):
+        '''Moves all the loose objects to packs and compacts the packs with removed objects.
+        Returns the number of objects packed and the number of bytes reclaimed.'''
+        packs = self._get_packs(create=True)
+        count = 0
+        for root, dirs, files in os.walk(self._path):
+            if root == self._path:
+                dirs[:] = [d for d in dirs if d != 'log']
+            for file in files:
+                fullpath = os.path.join(root, file)
+                if is_tmp_file(file):
+                    # repack holds the store exclusive, no process is writing it anymore
+                    log.debug('Removing stale temporary file [%s]' % fullpath, class_name=HASH_FS_CLASS_NAME)
+                    os.unlink(fullpath)
+                    continue
+                with open(fullpath, 'rb') as f:
+                    data = f.read()
+                if self._digest(data) != file:
+                    log.error('Corruption detected for chunk [%s] - not packed' % file, class_name=HASH_FS_CLASS_NAME)
+                    continue
+                packs.write(file, data)
+                set_write_read(fullpath)
+                os.unlink(fullpath)
+                count += 1
+        reclaimed = packs.compact()
+        log.debug('Packed [%d] objects, reclaimed [%d] bytes' % (count, reclaimed), class_name=HASH_FS_CLASS_NAME)
+        return count, reclaimed
+
+    def walk(self, page_size=50):
+        yield from super(MultihashFS, self).walk(page_size)
+        packs = self._get_packs()
+        if packs is None:
+            return
+        keys = packs.keys()
+        for i in range(0, len(keys), page_size):
+            yield keys[i:i + page_size]
+
     def fetch_scid(self, key, log_file=None):
         log.debug('Building the store.log with these added files', class_name=HASH_FS_CLASS_NAME)
         if self._exists(key):
@@ -340,7 +625,10 @@ class MultihashFS(HashFS):
 
     def _exists(self, key):
         keypath = self._get_hashpath(key)
-        return os.path.exists(keypath)
+        if os.path.exists(keypath):
+            return True
+        packs = self._get_packs()
+        return packs is not None and packs.exists(key)
 
     '''test existence of filename in system always returns False.
     no easy way to test if a file exists based on its name only because it's a CAS.'''
@@ -356,8 +644,19 @@ class MultihashFS(HashFS):
         corrupted_files_fullpaths = []
         self._check_files_integrity(corrupted_files, corrupted_files_fullpaths)
         self._remove_corrupted_files(corrupted_files_fullpaths, remove_corrupted)
+        self._check_packs_integrity(corrupted_files, remove_corrupted)
         return corrupted_files
 
+    def _check_packs_integrity(self, corrupted_files, remove_corrupted):
+        packs = self._get_packs()
+        if packs is None:
+            return
+        corrupted_packed = [key for key in packs.keys() if not self._check_integrity(key, packs.read(key))]
+        corrupted_files.extend(corrupted_packed)
+        if remove_corrupted and len(corrupted_packed) > 0:
+            log.info('Removing %s corrupted packed objects' % len(corrupted_packed), class_name=HASH_FS_CLASS_NAME)
+            packs.remove(corrupted_packed)
+
     def _remove_corrupted_files(self, corrupted_files_fullpaths, remove_corrupted):
         if remove_corrupted and len(corrupted_files_fullpaths) > 0:
             log.info('Removing %s corrupted files' % len(corrupted_files_fullpaths), class_name=HASH_FS_CLASS_NAME)
@@ -377,6 +676,8 @@ class MultihashFS(HashFS):
             if 'log' in root:
                 continue
             for file in files:
+                if is_tmp_file(file):
+                    continue
                 fullpath = os.path.join(root, file)
                 with open(fullpath, 'rb') as c:
                     m = hashlib.sha256()
@@ -10,23 +10,33 @@ from builtins import FileNotFoundError
 from enum import Enum
 
 from ml_git import log
+from ml_git.config import get_index_engine, get_hash_workers_count, get_walk_workers_count, mlgit_config
 from ml_git.file_system.cache import Cache
-from ml_git.constants import MULTI_HASH_CLASS_NAME, Mutability, SPEC_EXTENSION, INDEX_FILE
+from ml_git.constants import MULTI_HASH_CLASS_NAME, Mutability, SPEC_EXTENSION, INDEX_FILE, INDEX_DB_FILE, IndexEngine, \
+    Chunking, STAT_CACHE_FILE, WATCH_DIR, ADD_PENDING_FILES
+from ml_git.file_system.hash_engine import HashEngine
 from ml_git.file_system.hashfs import MultihashFS
-from ml_git.manifest import Manifest
+from ml_git.file_system.sqlite_index import SqliteIndex, remove_index_db
+from ml_git.file_system.stat_cache import StatCache
+from ml_git.manifest import Manifest, remove_binary_manifest
 from ml_git.pool import pool_factory
-from ml_git.utils import ensure_path_exists, yaml_load, posix_path, set_read_only, get_file_size, run_function_per_group
+from ml_git.utils import ensure_path_exists, yaml_load, yaml_save, posix_path, set_read_only, get_file_size
 
 
 class MultihashIndex(object):
 
-    def __init__(self, spec, index_path, object_path, mutability=Mutability.STRICT.value, cache_path=None):
+    def __init__(self, spec, index_path, object_path, mutability=Mutability.STRICT.value, cache_path=None,
+                 chunking=Chunking.FIXED.value):
         self._spec = spec
         self._path = index_path
-        self._hfs = MultihashFS(object_path)
+        self._hfs = MultihashFS(object_path, chunking=chunking)
+        self._hash_engine = HashEngine(self._hfs, get_hash_workers_count(mlgit_config))
         self._mf = self._get_index(index_path)
         self._full_idx = FullIndex(spec, index_path, mutability)
         self._cache = cache_path
+        self._stat_cache = None
+        # descriptors added, see get_written
+        self._written = set()
 
     def _get_index(self, idxpath):
         metadatapath = os.path.join(idxpath, 'metadata', self._spec)
@@ -37,21 +47,30 @@ class MultihashIndex(object):
 
     def add(self, path, manifestpath, files=[]):
         self.wp = pool_factory(pb_elts=0, pb_desc='files')
-        if len(files) > 0:
-            single_files = filter(lambda x: os.path.isfile(os.path.join(path, x)), files)
-            self.wp.progress_bar_total_inc(len(list(single_files)))
-            for f in files:
-                fullpath = os.path.join(path, f)
-                if os.path.isdir(fullpath):
-                    self._add_dir(path, manifestpath, f)
-                elif os.path.isfile(fullpath):
-                    self._add_single_file(path, manifestpath, f)
-                else:
-                    log.warn('[%s] Not found!' % fullpath, class_name=MULTI_HASH_CLASS_NAME)
-        else:
-            if os.path.isdir(path):
-                self._add_dir(path, manifestpath)
-        self.wp.progress_bar_close()
+        # files modified since they were added are hashed again only if their stat changed since the last check
+        metadata_path = os.path.join(self._path, 'metadata', self._spec)
+        self._stat_cache = StatCache(os.path.join(metadata_path, STAT_CACHE_FILE), self._hfs._chunking,
+                                     os.path.join(metadata_path, WATCH_DIR))
+        try:
+            if len(files) > 0:
+                single_files = filter(lambda x: os.path.isfile(os.path.join(path, x)), files)
+                self.wp.progress_bar_total_inc(len(list(single_files)))
+                for f in files:
+                    fullpath = os.path.join(path, f)
+                    if os.path.isdir(fullpath):
+                        self._add_dir(path, manifestpath, f)
+                    elif os.path.isfile(fullpath):
+                        self._add_single_file(path, manifestpath, f)
+                    else:
+                        log.warn('[%s] Not found!' % fullpath, class_name=MULTI_HASH_CLASS_NAME)
+            else:
+                if os.path.isdir(path):
+                    self._add_dir(path, manifestpath)
+            self.wp.progress_bar_close()
+        finally:
+            self._hash_engine.shutdown()
+            self._stat_cache.close()
+            self._stat_cache = None
 
     def _adding_dir_work_future_process(self, futures, wp):
         for future in futures:
@@ -60,13 +79,14 @@ class MultihashIndex(object):
         wp.reset_futures()
 
     def _adding_dir_work(self, files, args):
-        for k in files:
-            filepath = args['all_files'][k]
+        for filepath in files:
             if (SPEC_EXTENSION in filepath) or ('README' in filepath):
                 args['wp'].progress_bar_total_inc(-1)
                 self.add_metadata(args['basepath'], filepath)
             else:
                 args['wp'].submit(self._add_file, args['basepath'], filepath, args['f_index_file'])
+
+    def _wait_adding_dir_work(self, args):
         futures = self.wp.wait()
         try:
             self._adding_dir_work_future_process(futures, self.wp)
@@ -80,19 +100,24 @@ class MultihashIndex(object):
     def _add_dir(self, dirpath, manifestpath, file_path='', trust_links=True):
         self.manifestfiles = yaml_load(manifestpath)
         f_index_file = self._full_idx.get_index()
-        all_files = []
-        for root, dirs, files in os.walk(os.path.join(dirpath, file_path)):
+        args = {'wp': self.wp, 'basepath': os.path.join(dirpath, ''), 'f_index_file': f_index_file, 'dirpath': dirpath}
+        pending = 0
+        # the files of each directory are hashed while the next directories are read
+        for rel_dir, files in self._stat_cache.walk(dirpath, posix_path(file_path) if file_path else '',
+                                                    get_walk_workers_count(mlgit_config)):
+            root = os.path.join(dirpath, rel_dir)
             if '.' == root[0]:
                 continue
-            basepath = root[:len(dirpath)+1:]
-            relativepath = root[len(dirpath)+1:]
-            for file in files:
-                all_files.append(os.path.join(relativepath, file))
-            self.wp.progress_bar_total_inc(len(all_files))
-            args = {'wp': self.wp, 'basepath': basepath, 'f_index_file': f_index_file, 'all_files': all_files, 'dirpath': dirpath}
-            result = run_function_per_group(range(len(all_files)), 10000, function=self._adding_dir_work, arguments=args)
-            if not result:
-                return False
+            relativepath = rel_dir.replace('/', os.sep)
+            self.wp.progress_bar_total_inc(len(files))
+            self._adding_dir_work([os.path.join(relativepath, file) for file in files], args)
+            pending += len(files)
+            if pending >= ADD_PENDING_FILES:
+                if not self._wait_adding_dir_work(args):
+                    return False
+                pending = 0
+        if not self._wait_adding_dir_work(args):
+            return False
         self._full_idx.save_manifest_index()
         self._mf.save()
 
@@ -138,13 +163,20 @@ class MultihashIndex(object):
     def update_index(self, objectkey, filename, previous_hash=None):
 
         self._mf.add(objectkey, posix_path(filename), previous_hash)
+        self._written.add(objectkey)
+
+    def get_written(self):
+        '''Descriptors added to the index (and written to the objects) by this instance.'''
+        return self._written
 
     def remove_manifest(self):
         index_metadata_path = os.path.join(self._path, 'metadata', self._spec)
+        manifest_path = os.path.join(index_metadata_path, 'MANIFEST.yaml')
         try:
-            os.unlink(os.path.join(index_metadata_path, 'MANIFEST.yaml'))
+            os.unlink(manifest_path)
         except FileNotFoundError:
             pass
+        remove_binary_manifest(manifest_path)
 
     def _save_index(self):
         self._mf.save()
@@ -161,14 +193,15 @@ class MultihashIndex(object):
         check_file = f_index_file.get(posix_path(filepath))
         previous_hash = None
         if check_file is not None:
-            if self._full_idx.check_and_update(filepath, check_file, self._hfs, posix_path(filepath), fullpath, self._cache):
-                scid = self._hfs.put(fullpath)
+            if self._full_idx.check_and_update(filepath, check_file, self._hash_engine, posix_path(filepath), fullpath, self._cache,
+                                               self._stat_cache):
+                scid = self._hash_engine.put(fullpath)
 
             updated_check = f_index_file.get(posix_path(filepath))
             if 'previous_hash' in updated_check:
                 previous_hash = updated_check['previous_hash']
         else:
-            scid = self._hfs.put(fullpath)
+            scid = self._hash_engine.put(fullpath)
             self._full_idx.update_full_index(posix_path(filepath), fullpath, Status.a.name, scid)
 
         return scid, filepath, previous_hash
@@ -208,15 +241,16 @@ class MultihashIndex(object):
     def get_hashes_list(self):
         idx_yaml = self._full_idx.get_index()
         hashes_list = []
-        for value in idx_yaml:
-            hashes_list.append(idx_yaml[value]['hash'])
+        for _, value in idx_yaml.items():
+            hashes_list.append(value['hash'])
         return hashes_list
 
 
 class FullIndex(object):
-    def __init__(self, spec, index_path, mutability=Mutability.STRICT.value):
+    def __init__(self, spec, index_path, mutability=Mutability.STRICT.value, engine=None):
         self._spec = spec
         self._path = index_path
+        self._engine = engine if engine is not None else get_index_engine(mlgit_config)
         self._fidx = self._get_index(index_path)
         self._mutability = mutability
 
@@ -224,8 +258,24 @@ class FullIndex(object):
         metadatapath = os.path.join(idxpath, 'metadata', self._spec)
         ensure_path_exists(metadatapath)
         fidxpath = os.path.join(metadatapath, INDEX_FILE)
+        dbpath = os.path.join(metadatapath, INDEX_DB_FILE)
+        if self._engine == IndexEngine.SQLITE.value:
+            return SqliteIndex(dbpath, fidxpath)
+        if os.path.exists(dbpath):
+            self._export_db(dbpath, fidxpath)
         return Manifest(fidxpath)
 
+    @staticmethod
+    def _export_db(dbpath, fidxpath):
+        log.debug('Migrating index [%s] to [%s]' % (dbpath, fidxpath), class_name=MULTI_HASH_CLASS_NAME)
+        db = SqliteIndex(dbpath)
+        yaml_save(db.load(), fidxpath)
+        db.close()
+        remove_index_db(dbpath)
+
+    def _is_sqlite(self):
+        return self._engine == IndexEngine.SQLITE.value
+
     def update_full_index(self, filename, fullpath, status, key, previous_hash=None):
         self._fidx.add(filename, self._full_index_format(fullpath, status, key, previous_hash))
 
@@ -242,12 +292,21 @@ class FullIndex(object):
         return obj
 
     def update_index_status(self, filenames, status):
-        findex = self.get_index()
-        for file in filenames:
-            findex[file]['status'] = status
+        if self._is_sqlite():
+            self._fidx.update_field(filenames, 'status', status)
+        else:
+            findex = self.get_index()
+            for file in filenames:
+                findex[file]['status'] = status
         self._fidx.save()
 
     def update_index_unlock(self, filename):
+        if self._is_sqlite():
+            if filename not in self._fidx:
+                log.debug('The file [{}] isn\'t in index'.format(filename), class_name=MULTI_HASH_CLASS_NAME)
+            self._fidx.update_field([filename], 'untime', time.time())
+            self._fidx.save()
+            return
         findex = self.get_index()
         try:
             findex[filename]['untime'] = time.time()
@@ -261,15 +320,15 @@ class FullIndex(object):
         self._fidx.save()
 
     def remove_uncommitted(self):
-        to_be_remove = []
-        for key, value in self._fidx.get_yaml().items():
-            if value['status'] == 'a':
-                to_be_remove.append(key)
-
-        for file in to_be_remove:
+        for file in self.get_files_by_status(Status.a.name):
             self._fidx.rm_key(file)
         self._fidx.save()
 
+    def get_files_by_status(self, status):
+        if self._is_sqlite():
+            return self._fidx.get_files_by_status(status)
+        return [key for key, value in self.get_index().items() if value['status'] == status]
+
     def get_index(self):
         return self._fidx.get_yaml()
 
@@ -284,14 +343,14 @@ class FullIndex(object):
             self._fidx.rm_key(file)
         self._fidx.save()
 
-    def check_and_update(self, key, value, hfs, filepath, fullpath, cache):
-        st = os.stat(fullpath)
+    def check_and_update(self, key, value, hfs, filepath, fullpath, cache, stat_cache=None):
+        st = stat_cache.stat(filepath, fullpath) if stat_cache is not None else os.stat(fullpath)
         if key == filepath and value['ctime'] == st.st_ctime and value['mtime'] == st.st_mtime:
             log.debug('File [%s] already exists in ml-git repository' % filepath, class_name=MULTI_HASH_CLASS_NAME)
             return None
         elif key == filepath and value['ctime'] != st.st_ctime or value['mtime'] != st.st_mtime:
             log.debug('File [%s] was modified' % filepath, class_name=MULTI_HASH_CLASS_NAME)
-            scid = hfs.get_scid(fullpath)
+            scid = stat_cache.get_scid(filepath, fullpath, hfs, st) if stat_cache is not None else hfs.get_scid(fullpath)
             if value['hash'] != scid:
                 scid_ret = self._update_file_status(cache, filepath, fullpath, scid, st, value)
                 return scid_ret
@@ -322,6 +381,8 @@ class FullIndex(object):
         return scid_ret
 
     def get_total_size(self):
+        if self._is_sqlite():
+            return self._fidx.get_total_size()
         total_size = 0
         for k, v in self.get_index().items():
             total_size += v['size']
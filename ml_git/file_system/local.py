@@ -5,10 +5,12 @@ SPDX-License-Identifier: GPL-2.0-only
 
 import bisect
 import filecmp
+import hashlib
 import json
 import os
 import shutil
 import tempfile
+from contextlib import ExitStack
 from pathlib import Path
 
 from botocore.client import ClientError
@@ -16,21 +18,34 @@ from tqdm import tqdm
 
 from ml_git import log
 from ml_git.config import get_index_path, get_objects_path, get_refs_path, get_index_metadata_path, \
-    get_metadata_path, get_batch_size, get_push_threads_count
+    get_metadata_path, get_batch_size, get_push_threads_count, get_adaptive_concurrency, \
+    get_listing_threshold, get_objects_layout, get_remote_packs, get_walk_workers_count, get_reflink, \
+    get_cache_max_bytes
 from ml_git.constants import LOCAL_REPOSITORY_CLASS_NAME, STORE_FACTORY_CLASS_NAME, REPOSITORY_CLASS_NAME, \
-    Mutability, StoreType, SPEC_EXTENSION, MANIFEST_FILE, INDEX_FILE
+    Mutability, StoreType, SPEC_EXTENSION, MANIFEST_FILE, INDEX_FILE, INDEX_DB_FILE, \
+    FETCH_MAX_PENDING_BLOBS, LISTING_PREFIX_SIZE, REMOTE_KEYS_FILE, REMOTE_PACKS_DIR, REMOTE_PACK_MAX_SIZE, Chunking, STAT_CACHE_FILE, \
+    WATCH_DIR, VERIFIED_LEDGER_FILE
 from ml_git.file_system.cache import Cache
 from ml_git.file_system.hashfs import MultihashFS
 from ml_git.file_system.index import MultihashIndex, FullIndex, Status
+from ml_git.file_system.refcount import record_written
+from ml_git.file_system.reflink import clone_file
+from ml_git.file_system.sqlite_index import remove_index_db
+from ml_git.file_system.stat_cache import StatCache
+from ml_git.manifest import Manifest
 from ml_git.metadata import Metadata
 from ml_git.ml_git_message import output_messages
 from ml_git.pool import pool_factory, process_futures
 from ml_git.refs import Refs
 from ml_git.sample import SampleValidate
-from ml_git.spec import spec_parse, search_spec_file
+from ml_git.spec import spec_parse, search_spec_file, get_chunking
+from ml_git.storages.multihash_store import MultihashStore
+from ml_git.storages.remote_key_cache import RemoteKeyCache
+from ml_git.storages.remote_pack import RemotePackIndex, supports_remote_packs, new_pack_key, write_pack, \
+    PACK_SUFFIX, INDEX_SUFFIX
 from ml_git.storages.store_utils import store_factory
 from ml_git.utils import yaml_load, ensure_path_exists, get_path_with_categories, convert_path, \
-    normalize_path, posix_path, set_write_read, change_mask_for_routine, run_function_per_group
+    normalize_path, posix_path, set_write_read, change_mask_for_routine, run_function_per_group, tmp_file_path
 
 
 class LocalRepository(MultihashFS):
@@ -38,22 +53,158 @@ class LocalRepository(MultihashFS):
     def __init__(self, config, objects_path, repo_type='dataset', block_size=256 * 1024, levels=2):
         self.is_shared_objects = repo_type in config and 'objects_path' in config[repo_type]
         with change_mask_for_routine(self.is_shared_objects):
-            super(LocalRepository, self).__init__(objects_path, block_size, levels)
+            super(LocalRepository, self).__init__(objects_path, block_size, levels, get_objects_layout(config),
+                                                  reflink=get_reflink(config),
+                                                  ledger_path=os.path.join(os.path.dirname(os.path.normpath(objects_path)),
+                                                                           VERIFIED_LEDGER_FILE))
         self.__config = config
         self.__repo_type = repo_type
         self.__progress_bar = None
+        self.__objects_path = objects_path
+        self.__remote_packs = {}
+        # descriptors written to the objects or the cache, recorded for gc at the end of the command
+        self._written = set()
 
-    def _pool_push(self, ctx, obj, obj_path):
+    def _pool_push(self, ctx, obj):
         store = ctx
         log.debug('LocalRepository: push blob [%s] to store' % obj, class_name=LOCAL_REPOSITORY_CLASS_NAME)
-        ret = store.file_store(obj, obj_path)
+        with self.object_path(obj) as obj_path:
+            ret = store.file_store(obj, obj_path)
         return ret
 
-    def _create_pool(self, config, store_str, retry, pb_elts=None, pb_desc='blobs', nworkers=os.cpu_count()*5):
-        _store_factory = lambda: store_factory(config, store_str)  # noqa: E731
-        return pool_factory(ctx_factory=_store_factory, retry=retry, pb_elts=pb_elts, pb_desc=pb_desc, nworkers=nworkers)
+    def _read_objects(self, objs):
+        for obj in objs:
+            data = self.read_object(obj)
+            if data is None:
+                raise FileNotFoundError('Blob [%s] not found' % obj)
+            yield obj, data
+
+    def _pool_push_pack(self, ctx, objs, remote_packs):
+        store = ctx
+        pack_key = new_pack_key()
+        log.debug('LocalRepository: push [%d] blobs in pack [%s] to store' % (len(objs), pack_key),
+                  class_name=LOCAL_REPOSITORY_CLASS_NAME)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pack_path = os.path.join(tmp_dir, 'pack')
+            index_path = os.path.join(tmp_dir, 'index')
+            index = write_pack(pack_path, index_path, self._read_objects(objs))
+            ret = store.file_store(pack_key + PACK_SUFFIX, pack_path)
+            # the index goes last, objects are only looked up in packs with an index
+            ret.update(store.file_store(pack_key + INDEX_SUFFIX, index_path))
+            remote_packs.add_pack(pack_key + PACK_SUFFIX, index, index_path)
+        return ret
+
+    @staticmethod
+    def _pool_remote_key_exists(ctx, obj):
+        store = ctx
+        return obj, store.remote_key_exists(obj)
+
+    def _missing_remote_keys(self, wp, objs):
+        missing = set()
+        checked = set()
+        for future in wp.imap_unordered(self._pool_remote_key_exists, ((obj,) for obj in objs)):
+            try:
+                obj, exists = future.result()
+            except Exception as e:
+                # packed again if it could not be checked
+                log.debug('Could not check the existence of an object in the store -- [%s]' % e,
+                          class_name=LOCAL_REPOSITORY_CLASS_NAME)
+                continue
+            checked.add(obj)
+            if not exists:
+                missing.add(obj)
+        wp.progress_bar_close()
+        return [obj for obj in objs if obj in missing or obj not in checked]
+
+    def _group_in_packs(self, objs):
+        packs = []
+        pack = []
+        pack_size = 0
+        for obj in objs:
+            size = self.object_size(obj) or 0
+            if pack and pack_size + size > REMOTE_PACK_MAX_SIZE:
+                packs.append(pack)
+                pack = []
+                pack_size = 0
+            pack.append(obj)
+            pack_size += size
+        if pack:
+            packs.append(pack)
+        return packs
+
+    def _load_remote_packs(self, store, store_str):
+        # loaded once per store, the pools created afterwards read the packed objects with ranged GETs
+        if store_str in self.__remote_packs:
+            return self.__remote_packs[store_str]
+        remote_packs = None
+        if supports_remote_packs(store):
+            # next to the objects directory, e.g. .ml-git/dataset/remote_packs/<md5 of the store uri>
+            cache_path = os.path.join(os.path.dirname(os.path.normpath(self.__objects_path)), REMOTE_PACKS_DIR,
+                                      hashlib.md5(store_str.encode()).hexdigest())
+            try:
+                remote_packs = RemotePackIndex(cache_path).load(store)
+            except Exception as e:
+                log.debug('Could not load the remote packs of the store -- [%s]' % e, class_name=LOCAL_REPOSITORY_CLASS_NAME)
+        self.__remote_packs[store_str] = remote_packs
+        return remote_packs
+
+    def _create_pool(self, config, store_str, retry, pb_elts=None, pb_desc='blobs', nworkers=os.cpu_count()*5,
+                     remote_keys=None, no_head=False, missing_keys=None):
+        remote_packs = self.__remote_packs.get(store_str)
+
+        def _store_factory():
+            store = store_factory(config, store_str, nworkers)
+            if store is not None and (remote_keys is not None or missing_keys is not None):
+                store.set_remote_keys(remote_keys, no_head, missing_keys)
+            if store is not None and remote_packs is not None:
+                store.set_remote_packs(remote_packs)
+            return store
+        return pool_factory(ctx_factory=_store_factory, retry=retry, pb_elts=pb_elts, pb_desc=pb_desc, nworkers=nworkers,
+                            adaptive=get_adaptive_concurrency(config))
+
+    def _list_remote_keys(self, store, keys):
+        '''Checks the existence of keys by listing the prefixes they share in the store, each page of a listing replacing
+        the HEAD requests of the keys of its prefix. Returns the keys found and the keys missing (the others are left to
+        HEAD requests), or None below the listing threshold or if the store does not support listing.'''
+        keys = set(keys)
+        if len(keys) < get_listing_threshold(self.__config):
+            return None
+        prefixes = {}
+        for key in keys:
+            prefixes.setdefault(key[:LISTING_PREFIX_SIZE], set()).add(key)
+        present, missing = set(), set()
+        # pages of the largest listing of a prefix so far, a prefix with no more keys to check is left to HEAD requests
+        pages = 1
+        for prefix, wanted in sorted(prefixes.items(), key=lambda item: len(item[1]), reverse=True):
+            if len(wanted) <= pages:
+                break
+            found = set()
+            count = 0
+            try:
+                listing = store.list_keys(prefix)
+                if listing is None:
+                    break
+                for page in listing:
+                    count += 1
+                    found.update(key for key in page if key in wanted)
+                    if count > len(wanted):
+                        # bigger than estimated, HEAD requests are cheaper
+                        break
+                else:
+                    present.update(found)
+                    missing.update(wanted - found)
+            except Exception as e:
+                log.debug('Could not list the keys of the store -- [%s]' % e, class_name=LOCAL_REPOSITORY_CLASS_NAME)
+                break
+            pages = max(pages, count)
+        if not present and not missing:
+            return None
+        log.debug('Listed the store: [%d] keys found and [%d] missing, [%d] left to check' %
+                  (len(present), len(missing), len(keys) - len(present) - len(missing)),
+                  class_name=LOCAL_REPOSITORY_CLASS_NAME)
+        return present, missing
 
-    def push(self, object_path, spec_file, retry=2, clear_on_fail=False):
+    def push(self, object_path, spec_file, retry=2, clear_on_fail=False, no_head=False):
         repo_type = self.__repo_type
 
         spec = yaml_load(spec_file)
@@ -76,22 +227,45 @@ class LocalRepository(MultihashFS):
 
         nworkers = get_push_threads_count(self.__config)
 
-        wp = self._create_pool(self.__config, manifest['store'], retry, len(objs), 'files', nworkers)
-        for obj in objs:
+        remote_keys = None
+        missing_keys = None
+        if isinstance(store, MultihashStore):
+            # next to the objects directory, e.g. .ml-git/dataset/remote_keys.db
+            remote_keys_path = os.path.join(os.path.dirname(os.path.normpath(object_path)), REMOTE_KEYS_FILE)
+            remote_keys = RemoteKeyCache(remote_keys_path, manifest['store'])
+            listed_keys = None if no_head else self._list_remote_keys(store, objs)
+            if listed_keys is not None:
+                remote_keys.update(*listed_keys)
+                missing_keys = listed_keys[1]
+        remote_packs = self._load_remote_packs(store, manifest['store'])
+        if get_remote_packs(self.__config) and remote_packs is not None:
+            # small objects are sent together in packs, fetch reads each one with a ranged GET of its pack
+            objs = [obj for obj in objs if obj not in remote_packs]
+            # objects already in the store as loose keys (e.g. pushed before packs were enabled) are not packed again
+            wp_check = self._create_pool(self.__config, manifest['store'], retry, len(objs), 'checked', nworkers,
+                                         remote_keys=remote_keys, no_head=no_head, missing_keys=missing_keys)
+            objs = self._missing_remote_keys(wp_check, objs)
+            packs = self._group_in_packs(objs)
+            wp = self._create_pool(self.__config, manifest['store'], retry, len(packs), 'packs', nworkers,
+                                   remote_keys=remote_keys, no_head=no_head, missing_keys=missing_keys)
+            push_function = self._pool_push_pack
+            objs_to_push = ((pack, remote_packs) for pack in packs)
+        else:
+            wp = self._create_pool(self.__config, manifest['store'], retry, len(objs), 'files', nworkers,
+                                   remote_keys=remote_keys, no_head=no_head, missing_keys=missing_keys)
+            push_function = self._pool_push
             # Get obj from filesystem
-            obj_path = self.get_keypath(obj)
-            wp.submit(self._pool_push, obj, obj_path)
+            objs_to_push = ((obj,) for obj in objs)
 
         upload_errors = False
-        futures = wp.wait()
         uploaded_files = []
         files_not_found = 0
-        for future in futures:
+        for future in wp.imap_unordered(push_function, objs_to_push):
             try:
                 success = future.result()
                 # test success w.r.t potential failures
-                # Get the uploaded file's key
-                uploaded_files.append(list(success.values())[0])
+                # Get the uploaded files' keys
+                uploaded_files.extend(success.values())
             except Exception as e:
                 if type(e) is FileNotFoundError:
                     files_not_found += 1
@@ -100,8 +274,13 @@ class LocalRepository(MultihashFS):
 
         if clear_on_fail and len(uploaded_files) > 0 and upload_errors:
             self._delete(uploaded_files, spec_file, retry)
+            if remote_keys is not None:
+                for key in uploaded_files:
+                    remote_keys.remove(key)
         wp.progress_bar_close()
         wp.reset_futures()
+        if remote_keys is not None:
+            remote_keys.close()
         return 0 if not upload_errors else 1
 
     def _pool_delete(self, ctx, obj):
@@ -149,13 +328,14 @@ class LocalRepository(MultihashFS):
         if self._exists(key) is False:
             key_path = self.get_keypath(key)
             self._fetch_ipld_remote(ctx, key, key_path)
+            self._written.add(key)
+            self.pack_object(key)
         return key
 
-    def _fetch_ipld_remote(self, ctx, key, key_path):
+    def _fetch_ipld_remote(self, ctx, key, key_path, hash_fs=None):
         store = ctx
         ensure_path_exists(os.path.dirname(key_path))
-        log.debug('Downloading ipld [%s]' % key, class_name=LOCAL_REPOSITORY_CLASS_NAME)
-        if store.get(key_path, key) is False:
+        if self._download(store, key, key_path, hash_fs) is False:
             raise RuntimeError('Error download ipld [%s]' % key)
         return key
 
@@ -164,19 +344,18 @@ class LocalRepository(MultihashFS):
         if hash_fs._exists(key) is False:
             key_path = hash_fs.get_keypath(key)
             try:
-                self._fetch_ipld_remote(ctx, key, key_path)
+                self._fetch_ipld_remote(ctx, key, key_path, hash_fs)
             except Exception:
                 pass
         return key
 
-    def _fetch_blob(self, ctx, key):
-        links = self.load(key)
-        for olink in links['Links']:
-            key = olink['Hash']
-            log.debug('Getting blob [%s]' % key, class_name=LOCAL_REPOSITORY_CLASS_NAME)
-            if self._exists(key) is False:
-                key_path = self.get_keypath(key)
-                self._fetch_blob_remote(ctx, key, key_path)
+    def _fetch_chunk(self, ctx, key):
+        log.debug('Getting blob [%s]' % key, class_name=LOCAL_REPOSITORY_CLASS_NAME)
+        if self._exists(key) is False:
+            key_path = self.get_keypath(key)
+            self._fetch_blob_remote(ctx, key, key_path)
+            self.pack_object(key)
+            self._mark_verified(key)
         return True
 
     def _fetch_blob_to_path(self, ctx, key, hash_fs):
@@ -187,19 +366,39 @@ class LocalRepository(MultihashFS):
                 log.debug('Getting blob [%s]' % key, class_name=LOCAL_REPOSITORY_CLASS_NAME)
                 if hash_fs._exists(key) is False:
                     key_path = hash_fs.get_keypath(key)
-                    self._fetch_blob_remote(ctx, key, key_path)
+                    self._fetch_blob_remote(ctx, key, key_path, hash_fs)
+                    hash_fs._mark_verified(key)
         except Exception:
             return False
         return True
 
-    def _fetch_blob_remote(self, ctx, key, key_path):
+    def _fetch_blob_remote(self, ctx, key, key_path, hash_fs=None):
         store = ctx
         ensure_path_exists(os.path.dirname(key_path))
-        log.debug('Downloading blob [%s]' % key, class_name=LOCAL_REPOSITORY_CLASS_NAME)
-        if store.get(key_path, key) is False:
+        if self._download(store, key, key_path, hash_fs) is False:
             raise RuntimeError('error download blob [%s]' % key)
         return True
 
+    def _download(self, store, key, key_path, hash_fs=None):
+        hash_fs = hash_fs if hash_fs is not None else self
+        # the first process missing key claims it, the others sharing the objects wait for it instead of downloading it
+        # again, and download it themselves if it failed (the lock is released even if the process dies)
+        with hash_fs.get_locks().key(key):
+            if hash_fs._exists(key):
+                log.debug('Object [%s] downloaded by another process' % key, class_name=LOCAL_REPOSITORY_CLASS_NAME)
+                return True
+            log.debug('Downloading object [%s]' % key, class_name=LOCAL_REPOSITORY_CLASS_NAME)
+            # downloaded next to key_path then renamed, other processes never find a partial object
+            tmp_path = tmp_file_path(key_path)
+            try:
+                if store.get(tmp_path, key) is False:
+                    return False
+                os.replace(tmp_path, key_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+        return True
+
     def adding_to_cache_dir(self, lkeys, args):
         for key in lkeys:
             # check file is in objects ; otherwise critical error (should have been fetched at step before)
@@ -216,16 +415,38 @@ class LocalRepository(MultihashFS):
             return False
         return True
 
-    @staticmethod
-    def _fetch_batch(iplds, args):
-        for key in iplds:
-            args["wp"].submit(args["function"], key)
-        futures = args["wp"].wait()
+    def _fetch_pipeline(self, lkeys, wp_ipld, wp_blob, max_pending_blobs):
+        # blobs of an IPLD are queued as soon as it is downloaded, with at most
+        # max_pending_blobs downloads in flight in the blob pool at any time.
+        queued_blobs = set()
+
+        def blobs_to_fetch():
+            for future in wp_ipld.imap_unordered(self._fetch_ipld, ((key,) for key in lkeys)):
+                try:
+                    key = future.result()
+                except Exception as e:
+                    log.error('Error to fetch ipld -- [%s]' % e, class_name=LOCAL_REPOSITORY_CLASS_NAME)
+                    raise
+                for olink in self.load(key)['Links']:
+                    blob = olink['Hash']
+                    if blob in queued_blobs or self._exists(blob):
+                        continue
+                    queued_blobs.add(blob)
+                    wp_blob.progress_bar_total_inc(1)
+                    yield (blob,)
+
+        blobs = blobs_to_fetch()
         try:
-            process_futures(futures, args["wp"])
-        except Exception as e:
-            log.error(args["error_msg"] % e, class_name=LOCAL_REPOSITORY_CLASS_NAME)
+            for future in wp_blob.imap_unordered(self._fetch_chunk, blobs, max_pending_blobs):
+                try:
+                    future.result()
+                except Exception as e:
+                    log.error('Error to fetch blob -- [%s]' % e, class_name=LOCAL_REPOSITORY_CLASS_NAME)
+                    return False
+        except Exception:
             return False
+        finally:
+            blobs.close()
         return True
 
     def fetch(self, metadata_path, tag, samples, retries=2, bare=False):
@@ -253,49 +474,49 @@ class LocalRepository(MultihashFS):
             return False
         if bare:
             return True
+        self._load_remote_packs(store, manifest['store'])
 
         # creates 2 independent worker pools for IPLD files and another for data chunks/blobs.
         # Indeed, IPLD files are 1st needed to get blobs to get from store.
         # Concurrency comes from the download of
         #   1) multiple IPLD files at a time and
-        #   2) multiple data chunks/blobs from multiple IPLD files at a time.
+        #   2) multiple data chunks/blobs from multiple IPLD files at a time,
+        # the blobs of each IPLD file being queued as soon as it is downloaded.
 
         wp_ipld = self._create_pool(self.__config, manifest['store'], retries, len(files))
-        # TODO: is that the more efficient in case the list is very large?
+        wp_blob = self._create_pool(self.__config, manifest['store'], retries, 0, 'chunks')
         lkeys = list(files.keys())
-        with change_mask_for_routine(self.is_shared_objects):
-            args = {'wp': wp_ipld}
-            args['error_msg'] = 'Error to fetch ipld -- [%s]'
-            args['function'] = self._fetch_ipld
-            result = run_function_per_group(lkeys, 20, function=self._fetch_batch, arguments=args)
-            if not result:
-                return False
-            wp_ipld.progress_bar_close()
-            del wp_ipld
-
-            wp_blob = self._create_pool(self.__config, manifest['store'], retries, len(files), 'chunks')
-
-            args['wp'] = wp_blob
-            args['error_msg'] = 'Error to fetch blob -- [%s]'
-            args['function'] = self._fetch_blob
-            result = run_function_per_group(lkeys, 20, function=self._fetch_batch, arguments=args)
-            if not result:
-                return False
-            wp_blob.progress_bar_close()
-            del wp_blob
-
-        return True
+        try:
+            with change_mask_for_routine(self.is_shared_objects), self.get_locks().shared():
+                result = self._fetch_pipeline(lkeys, wp_ipld, wp_blob, FETCH_MAX_PENDING_BLOBS)
+        finally:
+            self._record_written()
+        self._flush_verified()
+        wp_ipld.progress_bar_close()
+        wp_blob.progress_bar_close()
+        return result
 
     def _update_cache(self, cache, key):
-        # determine whether file is already in cache, if not, get it
-        if cache.exists(key) is False:
-            cfile = cache.get_keypath(key)
-            ensure_path_exists(os.path.dirname(cfile))
-            super().get(key, cfile)
+        # determine whether file is already in cache, if not, get it (waiting for a process getting the same file)
+        with cache.get_locks().key(key):
+            if cache.exists(key) is False:
+                cfile = cache.get_keypath(key)
+                ensure_path_exists(os.path.dirname(cfile))
+                tmp_path = tmp_file_path(cfile)
+                super().get(key, tmp_path)
+                if os.path.exists(tmp_path):
+                    os.replace(tmp_path, cfile)
+                    self._written.add(key)
+        cache.touch(key)
+
+    def _record_written(self):
+        written, self._written = self._written, set()
+        record_written(self.__config, written)
 
     def _update_links_wspace(self, key, status, args):
         # for all concrete files specified in manifest, create a hard link into workspace
         mutability = args['mutability']
+        copy_path = None
         for file in args['obj_files'][key]:
             args['mfiles'][file] = key
             file_path = convert_path(args['ws_path'], file)
@@ -306,9 +527,26 @@ class LocalRepository(MultihashFS):
                     set_write_read(file_path)
                     os.unlink(file_path)
                 ensure_path_exists(os.path.dirname(file_path))
-                super().get(key, file_path)
+                # files with the same content share the extents of the first one when possible
+                if copy_path is None or not self._clone_copy(copy_path, file_path):
+                    super().get(key, file_path)
+                    copy_path = file_path
             args['fidx'].update_full_index(file, file_path, status, key)
 
+    def _clone_copy(self, src_path, dst_path):
+        if not self._reflink:
+            return False
+        try:
+            with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+                clone_file(src.fileno(), dst.fileno())
+            return True
+        except OSError as e:
+            log.debug('Reflink from [%s] to [%s] failed: %s' % (src_path, dst_path, e),
+                      class_name=LOCAL_REPOSITORY_CLASS_NAME)
+            if os.path.exists(dst_path):
+                os.unlink(dst_path)
+            return False
+
     def _remove_unused_links_wspace(self, ws_path, mfiles):
         for root, dirs, files in os.walk(ws_path):
             relative_path = root[len(ws_path) + 1:]
@@ -366,10 +604,10 @@ class LocalRepository(MultihashFS):
         return True
 
     def _load_obj_files(self, samples, manifest_path, sampling_flag='', is_checkout=False):
-        obj_files = yaml_load(manifest_path)
+        obj_files = Manifest(manifest_path)
         try:
             if samples is not None:
-                set_files = SampleValidate.process_samples(samples, obj_files)
+                set_files = SampleValidate.process_samples(samples, obj_files.get_yaml())
                 if set_files is None or len(set_files) == 0:
                     return None
                 obj_files = set_files
@@ -384,7 +622,9 @@ class LocalRepository(MultihashFS):
             return None
         return obj_files
 
-    def checkout(self, cache_path, metadata_path, ws_path, tag, samples, bare=False):
+    def checkout(self, cache_path, metadata_path, ws_path, tag, samples, bare=False, paranoid=False):
+        # with paranoid, every chunk is hashed again instead of trusting the ones verified before
+        self._paranoid = paranoid
         categories_path, spec_name, version = spec_parse(tag)
         index_path = get_index_path(self.__config, self.__repo_type)
         # get all files for specific tag
@@ -396,6 +636,7 @@ class LocalRepository(MultihashFS):
             os.unlink(fidx_path)
         except FileNotFoundError:
             pass
+        remove_index_db(os.path.join(index_manifest_path, INDEX_DB_FILE))
         fidx = FullIndex(spec_name, index_path, mutability)
         # copy all files defined in manifest from objects to cache (if not there yet) then hard links to workspace
         mfiles = {}
@@ -408,22 +649,34 @@ class LocalRepository(MultihashFS):
 
         if not bare:
             cache = None
-            if mutability == Mutability.STRICT.value or mutability == Mutability.FLEXIBLE.value:
-                is_shared_cache = 'cache_path' in self.__config[self.__repo_type]
-                with change_mask_for_routine(is_shared_cache):
-                    cache = Cache(cache_path)
-                    wp = pool_factory(pb_elts=len(lkey), pb_desc='files into cache')
-                    args = {'wp': wp, 'cache': cache, 'cache_path': cache_path}
-                    if not run_function_per_group(lkey, 20, function=self.adding_files_into_cache, arguments=args):
+            try:
+                with ExitStack() as locks:
+                    # gc waits for the objects and the cache used by this checkout
+                    with change_mask_for_routine(self.is_shared_objects):
+                        locks.enter_context(self.get_locks().shared())
+                    if mutability == Mutability.STRICT.value or mutability == Mutability.FLEXIBLE.value:
+                        is_shared_cache = 'cache_path' in self.__config[self.__repo_type]
+                        with change_mask_for_routine(is_shared_cache):
+                            cache = Cache(cache_path, max_bytes=get_cache_max_bytes(self.__config))
+                            locks.enter_context(cache.get_locks().shared())
+                            wp = pool_factory(pb_elts=len(lkey), pb_desc='files into cache')
+                            args = {'wp': wp, 'cache': cache, 'cache_path': cache_path}
+                            if not run_function_per_group(lkey, 20, function=self.adding_files_into_cache, arguments=args):
+                                return
+                            wp.progress_bar_close()
+
+                    wps = pool_factory(pb_elts=len(lkey), pb_desc='files into workspace')
+                    args = {'wps': wps, 'cache': cache, 'fidx': fidx, 'ws_path': ws_path, 'mfiles': mfiles,
+                            'obj_files': obj_files, 'mutability': mutability}
+                    if not run_function_per_group(lkey, 20, function=self.adding_files_into_workspace, arguments=args):
                         return
-                    wp.progress_bar_close()
-
-            wps = pool_factory(pb_elts=len(lkey), pb_desc='files into workspace')
-            args = {'wps': wps, 'cache': cache, 'fidx': fidx, 'ws_path': ws_path, 'mfiles': mfiles,
-                    'obj_files': obj_files, 'mutability': mutability}
-            if not run_function_per_group(lkey, 20, function=self.adding_files_into_workspace, arguments=args):
-                return
-            wps.progress_bar_close()
+                    wps.progress_bar_close()
+            finally:
+                # once the locks are released, also when the checkout fails; the files just linked into the workspace are not evicted
+                if cache is not None:
+                    cache.evict()
+                    cache.close()
+                self._record_written()
         else:
             args = {'fidx': fidx, 'ws_path': ws_path, 'obj_files': obj_files}
             run_function_per_group(lkey, 20, function=self._update_index_bare_mode, arguments=args)
@@ -452,8 +705,8 @@ class LocalRepository(MultihashFS):
     def _pool_remote_fsck_ipld(self, ctx, obj):
         store = ctx
         log.debug('LocalRepository: check ipld [%s] in store' % obj, class_name=LOCAL_REPOSITORY_CLASS_NAME)
-        obj_path = self.get_keypath(obj)
-        ret = store.file_store(obj, obj_path)
+        with self.object_path(obj) as obj_path:
+            ret = store.file_store(obj, obj_path)
         return ret
 
     def _pool_remote_fsck_blob(self, ctx, obj):
@@ -466,8 +719,8 @@ class LocalRepository(MultihashFS):
         for olink in links['Links']:
             key = olink['Hash']
             store = ctx
-            obj_path = self.get_keypath(key)
-            ret = store.file_store(key, obj_path)
+            with self.object_path(key) as obj_path:
+                ret = store.file_store(key, obj_path)
             rets.append(ret)
         return rets
 
@@ -580,7 +833,7 @@ class LocalRepository(MultihashFS):
         categories_path, spec_name, version = spec_parse(tag)
         # get all files for specific tag
         manifest_path = os.path.join(metadata_path, categories_path, MANIFEST_FILE)
-        obj_files = yaml_load(manifest_path)
+        obj_files = Manifest(manifest_path)
 
         store = store_factory(self.__config, manifest['store'])
         if store is None:
@@ -589,6 +842,7 @@ class LocalRepository(MultihashFS):
 
         # TODO: is that the more efficient in case the list is very large?
         lkeys = list(obj_files.keys())
+        self._load_remote_packs(store, manifest['store'])
 
         if paranoid:
             try:
@@ -597,7 +851,10 @@ class LocalRepository(MultihashFS):
                 log.error(e, class_name=LOCAL_REPOSITORY_CLASS_NAME)
                 return
             self._remote_fsck_paranoid(manifest, retries, lkeys, batch_size)
-        wp_ipld = self._create_pool(self.__config, manifest['store'], retries, len(obj_files))
+        # keys missing from the listing of their prefix are sent without checking the store again
+        present_keys, missing_keys = self._list_remote_keys(store, lkeys) or (None, None)
+        wp_ipld = self._create_pool(self.__config, manifest['store'], retries, len(obj_files),
+                                    remote_keys=present_keys, missing_keys=missing_keys)
 
         submit_iplds_args = {'wp': wp_ipld}
         submit_iplds_args['ipld_unfixed'] = 0
@@ -620,7 +877,8 @@ class LocalRepository(MultihashFS):
                                      'ipld_missing'])) + ' missing descriptor files. Consider using the --thorough option.',
                          class_name=LOCAL_REPOSITORY_CLASS_NAME)
 
-        wp_blob = self._create_pool(self.__config, manifest['store'], retries, len(obj_files))
+        wp_blob = self._create_pool(self.__config, manifest['store'], retries, len(obj_files),
+                                    remote_keys=present_keys, missing_keys=missing_keys)
         submit_blob_args = {'wp': wp_blob}
         submit_blob_args['blob'] = 0
         submit_blob_args['blob_fixed'] = 0
@@ -673,15 +931,8 @@ class LocalRepository(MultihashFS):
         idx = MultihashIndex(spec, index_path, objects_path)
         idx_yaml = idx.get_index_yaml()
         corrupted_files = []
-        idx_yaml_mf = idx_yaml.get_manifest_index()
-
-        self.__progress_bar = tqdm(total=len(idx_yaml_mf.load()), desc='files', unit='files', unit_scale=True,
-                                   mininterval=1.0)
-        for key in idx_yaml_mf:
-            if idx_yaml_mf[key]['status'] == Status.c.name:
-                bisect.insort(corrupted_files, normalize_path(key))
-            self.__progress_bar.update(1)
-        self.__progress_bar.close()
+        for key in idx_yaml.get_files_by_status(Status.c.name):
+            bisect.insort(corrupted_files, normalize_path(key))
 
         return corrupted_files
 
@@ -722,48 +973,54 @@ class LocalRepository(MultihashFS):
         idx_yaml = idx.get_index_yaml()
         untracked_files = []
         changed_files = []
-        idx_yaml_mf = idx_yaml.get_manifest_index()
 
         bare_mode = os.path.exists(os.path.join(index_metadata_path, spec, 'bare'))
-        new_files, deleted_files, all_files, corrupted_files = self._get_index_files_status(bare_mode, idx_yaml_mf,
-                                                                                            path, status_directory)
+        ws_entries = None
+        if path is not None:
+            # files are hashed with the chunking of the entity to find the changed ones
+            chunking = get_chunking(os.path.join(path, file), repo_type) or Chunking.FIXED.value
+            stat_cache = StatCache(os.path.join(index_metadata_path, spec, STAT_CACHE_FILE), chunking,
+                                   os.path.join(index_metadata_path, spec, WATCH_DIR))
+            ws_entries = list(stat_cache.walk(path, posix_path(status_directory) if status_directory else '',
+                                              get_walk_workers_count(self.__config)))
+        new_files, deleted_files, index_files, corrupted_files = \
+            self._get_index_files_status(bare_mode, idx_yaml.get_index(), path, status_directory, ws_entries)
 
         if path is not None:
+            hash_fs = MultihashFS(objects_path, chunking=chunking)
             changed_files, untracked_files = \
-                self._get_workspace_files_status(all_files, full_metadata_path, idx_yaml_mf,
-                                                 index_full_metadata_path_with_cat, index_full_metadata_path_without_cat,
-                                                 path, new_files, status_directory)
+                self._get_workspace_files_status(index_files, full_metadata_path, index_full_metadata_path_with_cat,
+                                                 index_full_metadata_path_without_cat, path, new_files, ws_entries,
+                                                 stat_cache, hash_fs)
+            stat_cache.close()
 
         if tag:
             metadata.checkout()
         return new_files, deleted_files, untracked_files, corrupted_files, changed_files
 
-    def _get_workspace_files_status(self, all_files, full_metadata_path, idx_yaml_mf,
-                                    index_full_metadata_path_with_cat, index_full_metadata_path_without_cat, path,
-                                    new_files, status_directory=''):
+    def _get_workspace_files_status(self, index_files, full_metadata_path, index_full_metadata_path_with_cat,
+                                    index_full_metadata_path_without_cat, path, new_files, ws_entries, stat_cache,
+                                    hash_fs):
         changed_files = []
         untracked_files = []
-        for root, dirs, files in os.walk(path):
-            base_path = root[len(path) + 1:]
-            base_path_with_separator = base_path + os.path.sep
-
-            if status_directory and not base_path_with_separator.startswith(status_directory + os.path.sep):
-                continue
-
+        for base_path, files in ws_entries:
+            root = os.path.join(path, base_path)
             for file in files:
-                bpath = convert_path(base_path, file)
-                if bpath in all_files:
+                rel_path = base_path + '/' + file if base_path else file
+                file_in_index = index_files.get(rel_path)
+                if file_in_index is not None:
                     full_file_path = os.path.join(root, file)
-                    stat = os.stat(full_file_path)
-                    file_in_index = idx_yaml_mf[posix_path(bpath)]
-                    if file_in_index['mtime'] != stat.st_mtime and self.get_scid(full_file_path) != \
-                            file_in_index['hash']:
-                        bisect.insort(changed_files, bpath)
+                    stat = stat_cache.stat(rel_path, full_file_path)
+                    # stat and hash are only checked when the mtime differs from the one in the index
+                    if file_in_index[0] != stat.st_mtime and \
+                            stat_cache.get_scid(rel_path, full_file_path, hash_fs, stat) != file_in_index[1]:
+                        changed_files.append(normalize_path(rel_path))
                 else:
                     is_metadata_file = SPEC_EXTENSION in file or 'README.md' in file
+                    bpath = normalize_path(rel_path)
 
                     if not is_metadata_file:
-                        bisect.insort(untracked_files, bpath)
+                        untracked_files.append(bpath)
                     else:
                         file_path_metadata = os.path.join(full_metadata_path, file)
                         file_index_path_with_cat = os.path.join(index_full_metadata_path_with_cat, file)
@@ -773,6 +1030,8 @@ class LocalRepository(MultihashFS):
                         full_base_path = os.path.join(root, bpath)
                         self._compare_metadata_file(bpath, file_index_path, file_path_metadata, full_base_path,
                                                     new_files, untracked_files)
+        changed_files.sort()
+        untracked_files.sort()
         return changed_files, untracked_files
 
     def _compare_metadata_file(self, bpath, file_index_exists, file_path_metadata, full_base_path, new_files,
@@ -794,22 +1053,28 @@ class LocalRepository(MultihashFS):
         else:
             bisect.insort(untracked_files, bpath)
 
-    def _get_index_files_status(self, bare_mode, idx_yaml_mf, path, status_directory=''):
+    def _get_index_files_status(self, bare_mode, index_files, path, status_directory='', ws_entries=None):
         new_files = []
         deleted_files = []
-        all_files = []
+        all_files = {}
         corrupted_files = []
-        for key in idx_yaml_mf:
+        ws_files = None
+        if ws_entries is not None:
+            ws_files = {base_path + '/' + file if base_path else file for base_path, files in ws_entries for file in files}
+        for key, value in index_files.items():
+            all_files[key] = (value['mtime'], value['hash'])
             if status_directory and not key.startswith(status_directory + '/'):
-                bisect.insort(all_files, normalize_path(key))
                 continue
-            if not bare_mode and not os.path.exists(convert_path(path, key)):
-                bisect.insort(deleted_files, normalize_path(key))
-            elif idx_yaml_mf[key]['status'] == 'a' and os.path.exists(convert_path(path, key)):
-                bisect.insort(new_files, key)
-            elif idx_yaml_mf[key]['status'] == 'c' and os.path.exists(convert_path(path, key)):
-                bisect.insort(corrupted_files, normalize_path(key))
-            bisect.insort(all_files, normalize_path(key))
+            exists = key in ws_files if ws_files is not None else os.path.exists(convert_path(path, key))
+            if not bare_mode and not exists:
+                deleted_files.append(normalize_path(key))
+            elif value['status'] == 'a' and exists:
+                new_files.append(key)
+            elif value['status'] == 'c' and exists:
+                corrupted_files.append(normalize_path(key))
+        new_files.sort()
+        deleted_files.sort()
+        corrupted_files.sort()
         return new_files, deleted_files, all_files, corrupted_files
 
     def import_files(self, file_object, path, directory, retry, store_string):
@@ -920,9 +1185,12 @@ class LocalRepository(MultihashFS):
             return
         manifest_file = MANIFEST_FILE
         manifest_path = os.path.join(metadata_path, categories_path, manifest_file)
-        files = yaml_load(manifest_path)
+        files = Manifest(manifest_path)
         log.info('Exporting tag [{}] from [{}] to [{}].'.format(tag, manifest['store'], store_dst_type),
                  class_name=LOCAL_REPOSITORY_CLASS_NAME)
+        remote_packs = self._load_remote_packs(store, manifest['store'])
+        if remote_packs is not None:
+            store.set_remote_packs(remote_packs)
         wp_export_file = pool_factory(ctx_factory=lambda: store, retry=retry, pb_elts=len(files), pb_desc='files')
 
         lkeys = list(files.keys())
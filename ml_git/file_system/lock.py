@@ -0,0 +1,144 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+
+from ml_git import log
+from ml_git.constants import KEY_LOCK_SLOTS, KEY_LOCKS_FILE, LOCK_CLASS_NAME, LOCKS_DIR, PINS_DIR, STORE_LOCK_FILE
+from ml_git.ml_git_message import output_messages
+from ml_git.utils import ensure_path_exists
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# record locks belong to the process and closing any descriptor of the file releases all of them, so the file of the
+# key locks is opened once per process, threads locking the same slot being serialized on top of it
+_THREAD_STRIPES = 256
+_key_locks = {}
+_key_locks_lock = threading.Lock()
+
+
+def get_locks_path(store_path):
+    '''Directory of the locks of the store at store_path (objects or cache), next to it like its other databases.'''
+    store_path = os.path.normpath(store_path)
+    return os.path.join(os.path.dirname(store_path), LOCKS_DIR, os.path.basename(store_path))
+
+
+class _KeyLocks(object):
+
+    def __init__(self, path):
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        self._thread_locks = [threading.Lock() for _ in range(_THREAD_STRIPES)]
+
+    @contextmanager
+    def lock(self, slot):
+        with self._thread_locks[slot % _THREAD_STRIPES]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, slot)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, slot)
+
+
+class LockManager(object):
+    '''Coordinates the ml-git processes of a host sharing a store (objects or cache path) with fcntl locks on the
+    files of its locks directory.
+
+    Commands reading or writing the store hold its lock shared and gc holds it exclusive, so objects are never removed
+    while another process uses them. Writes of a key are serialized by a range lock on one byte of a single file (keys
+    sharing a slot only wait for each other). Pinned keys are kept by gc and cache eviction until unpinned. Without
+    fcntl (e.g. Windows) nothing is locked.'''
+
+    def __init__(self, store_path):
+        self._path = get_locks_path(store_path)
+        self._pins_path = os.path.join(self._path, PINS_DIR)
+
+    @contextmanager
+    def _store_lock(self, exclusive, blocking):
+        if fcntl is None:
+            yield True
+            return
+        operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        ensure_path_exists(self._path)
+        fd = os.open(os.path.join(self._path, STORE_LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            try:
+                fcntl.flock(fd, operation | fcntl.LOCK_NB)
+                acquired = True
+            except BlockingIOError:
+                acquired = False
+                if blocking:
+                    log.info(output_messages['INFO_WAITING_FOR_LOCK'] % self._path, class_name=LOCK_CLASS_NAME)
+                    fcntl.flock(fd, operation)
+                    acquired = True
+            yield acquired
+        finally:
+            # closing the descriptor releases the lock
+            os.close(fd)
+
+    def shared(self):
+        '''Held while using the store, waits for a gc in progress.'''
+        return self._store_lock(False, True)
+
+    def exclusive(self, blocking=True):
+        '''Held while removing objects from the store, yields whether it was acquired (always when blocking).'''
+        return self._store_lock(True, blocking)
+
+    @contextmanager
+    def key(self, key):
+        '''Held while writing key to the store, by any thread of any process.'''
+        if fcntl is None:
+            yield
+            return
+        path = os.path.realpath(os.path.join(self._path, KEY_LOCKS_FILE))
+        with _key_locks_lock:
+            if path not in _key_locks:
+                ensure_path_exists(self._path)
+                _key_locks[path] = _KeyLocks(path)
+            key_locks = _key_locks[path]
+        slot = int(hashlib.md5(key.encode()).hexdigest(), 16) % KEY_LOCK_SLOTS
+        with key_locks.lock(slot):
+            yield
+
+    def pin(self, name, keys):
+        '''Keeps keys in the store through gc and cache eviction until unpin(name).'''
+        ensure_path_exists(self._pins_path)
+        pin_path = os.path.join(self._pins_path, name)
+        tmp_path = '%s.%d.tmp' % (pin_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            for key in keys:
+                f.write(key + '\n')
+        os.replace(tmp_path, pin_path)
+        log.debug('Pin [%s] set on [%s]' % (name, self._path), class_name=LOCK_CLASS_NAME)
+
+    def unpin(self, name):
+        '''Returns whether name was pinned.'''
+        try:
+            os.unlink(os.path.join(self._pins_path, name))
+        except FileNotFoundError:
+            return False
+        log.debug('Pin [%s] removed from [%s]' % (name, self._path), class_name=LOCK_CLASS_NAME)
+        return True
+
+    def pins(self):
+        if not os.path.isdir(self._pins_path):
+            return []
+        return sorted(name for name in os.listdir(self._pins_path) if not name.endswith('.tmp'))
+
+    def pinned(self):
+        '''Keys of all the pins of the store.'''
+        keys = set()
+        for name in self.pins():
+            try:
+                with open(os.path.join(self._pins_path, name)) as f:
+                    keys.update(line.strip() for line in f if line.strip())
+            except FileNotFoundError:
+                pass
+        return keys
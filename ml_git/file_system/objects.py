@@ -12,7 +12,7 @@ from ml_git.constants import HASH_FS_CLASS_NAME
 from ml_git.file_system.hashfs import MultihashFS
 from ml_git.file_system.index import FullIndex, Status
 from ml_git.ml_git_message import output_messages
-from ml_git.utils import yaml_load, remove_unnecessary_files
+from ml_git.utils import remove_unnecessary_files
 
 
 class Objects(MultihashFS):
@@ -32,31 +32,40 @@ class Objects(MultihashFS):
         fidx = FullIndex(self.__spec, index_path)
         findex = fidx.get_index()
         log_path = os.path.join(self._logpath, 'store.log')
+        committed_files = []
         with open(log_path, 'a') as log_file:
             for k, v in findex.items():
                 if not os.path.exists(os.path.join(ws_path, k)):
                     deleted_files.append(k)
                 elif v['status'] == Status.a.name:
                     idx.fetch_scid(v['hash'], log_file)
-                    v['status'] = Status.u.name
+                    committed_files.append(k)
                     if 'previous_hash' in v:
                         added_files.append((v['previous_hash'], k))
-        fidx.get_manifest_index().save()
+        fidx.update_index_status(committed_files, Status.u.name)
         return added_files, deleted_files
 
-    def _get_used_blobs(self, descriptor_hashes):
-        used_blobs = []
-        for file in descriptor_hashes:
-            descriptor_path = self._get_hashpath(file)
-            descriptor = yaml_load(descriptor_path)
-            for hash in descriptor['Links']:
-                used_blobs.append(hash['Hash'])
-        used_blobs.extend(descriptor_hashes)
-        return used_blobs
-
-    def garbage_collector(self, blobs_hashes):
-        used_blobs = self._get_used_blobs(blobs_hashes)
+    def mark_used_blobs(self, descriptor_hashes, used_blobs):
+        '''Adds the descriptors and their chunks to used_blobs (a ReachableSet), each descriptor is loaded once.'''
+        for file in set(descriptor_hashes):
+            used_blobs.add(file)
+            # descriptors not fetched (e.g. bare checkout) have no chunks here
+            for hash in self.load(file).get('Links', []):
+                used_blobs.add(hash['Hash'])
+
+    def garbage_collector(self, used_blobs, dry_run=False):
         count_removed_objects, reclaimed_objects_space = remove_unnecessary_files(used_blobs,
-                                                                                  os.path.join(self._objects_path, HASH_FS_CLASS_NAME.lower()))
-        log.debug(output_messages['INFO_REMOVED_FILES'] % (humanize.intword(count_removed_objects), self._objects_path))
+                                                                                  os.path.join(self._objects_path, HASH_FS_CLASS_NAME.lower()),
+                                                                                  dry_run, exclude=['log'])
+        packs = self._get_packs()
+        if packs is not None:
+            unused_packed = [key for key in packs.keys() if key not in used_blobs]
+            count_removed_objects += len(unused_packed)
+            if dry_run:
+                reclaimed_objects_space += sum(packs.size(key) for key in unused_packed)
+            else:
+                packs.remove(unused_packed)
+                reclaimed_objects_space += packs.compact()
+        if not dry_run:
+            log.debug(output_messages['INFO_REMOVED_FILES'] % (humanize.intword(count_removed_objects), self._objects_path))
         return count_removed_objects, reclaimed_objects_space
@@ -0,0 +1,168 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import os
+import struct
+import uuid
+
+from ml_git import log
+from ml_git.constants import HASH_FS_CLASS_NAME, PACK_MAX_SIZE
+from ml_git.file_system.db import open_db
+from ml_git.utils import ensure_path_exists
+
+PACK_EXTENSION = '.pack'
+PACK_INDEX_FILE = 'index.db'
+
+
+class PackFS(object):
+    '''Append-only packfiles of objects, with an index of their offsets by CID (like git packs).
+
+    Pack layout (little endian):
+        header  : magic, version
+        records : [cid length, cid, data size, data]*
+
+    Each PackFS writes to its own packs (pack-<uuid>.pack), so several threads and processes can add objects
+    to the same directory at once, the index (index.db) is shared through SQLite. Objects are never
+    rewritten in place, remove() only drops them from the index and repack() reclaims their space.
+    As records are self-describing, a lost index is rebuilt from the packs.'''
+
+    MAGIC = b'MLGP'
+    VERSION = 1
+    _header = struct.Struct('<4sI')
+    _cid_len = struct.Struct('<I')
+    _data_len = struct.Struct('<Q')
+
+    def __init__(self, path, max_pack_size=PACK_MAX_SIZE):
+        self._path = path
+        self._max_pack_size = max_pack_size
+        self._pack = None
+        self._pack_name = None
+        ensure_path_exists(path)
+        index_path = os.path.join(path, PACK_INDEX_FILE)
+        is_new = not os.path.exists(index_path)
+        # the lock of the index also guards the pack being written
+        self._db = open_db(index_path, timeout=60)
+        with self._db.transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS objects (cid TEXT PRIMARY KEY, pack TEXT, offset INTEGER, '
+                       'size INTEGER) WITHOUT ROWID')
+            db.execute('CREATE INDEX IF NOT EXISTS objects_pack ON objects (pack)')
+        if is_new:
+            for pack in self.packs():
+                self._index_pack(pack)
+
+    def packs(self):
+        return sorted(file for file in os.listdir(self._path) if file.endswith(PACK_EXTENSION))
+
+    def _index_pack(self, pack):
+        log.debug('Indexing pack [%s]' % pack, class_name=HASH_FS_CLASS_NAME)
+        rows = []
+        with open(os.path.join(self._path, pack), 'rb') as f:
+            magic, _ = self._header.unpack(f.read(self._header.size))
+            if magic != self.MAGIC:
+                log.error('Invalid pack [%s]' % pack, class_name=HASH_FS_CLASS_NAME)
+                return
+            while True:
+                header = f.read(self._cid_len.size)
+                if len(header) < self._cid_len.size:
+                    break
+                cid = f.read(self._cid_len.unpack(header)[0]).decode()
+                size, = self._data_len.unpack(f.read(self._data_len.size))
+                rows.append((cid, pack, f.tell(), size))
+                f.seek(size, os.SEEK_CUR)
+        with self._db.transaction() as db:
+            db.executemany('INSERT OR IGNORE INTO objects (cid, pack, offset, size) VALUES (?, ?, ?, ?)', rows)
+
+    def _location(self, cid):
+        return self._db.fetchone('SELECT pack, offset, size FROM objects WHERE cid = ?', (cid,))
+
+    def exists(self, cid):
+        return self._location(cid) is not None
+
+    def size(self, cid):
+        location = self._location(cid)
+        return location[2] if location is not None else None
+
+    def read(self, cid):
+        location = self._location(cid)
+        if location is None:
+            return None
+        pack, offset, size = location
+        with open(os.path.join(self._path, pack), 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def _open_pack(self):
+        self._pack_name = 'pack-%s%s' % (uuid.uuid4().hex, PACK_EXTENSION)
+        log.debug('Create pack [%s]' % self._pack_name, class_name=HASH_FS_CLASS_NAME)
+        self._pack = open(os.path.join(self._path, self._pack_name), 'ab')
+        self._pack.write(self._header.pack(self.MAGIC, self.VERSION))
+
+    def write(self, cid, data):
+        with self._db.transaction() as db:
+            if self.exists(cid):
+                return False
+            if self._pack is None or self._pack.tell() + len(data) > self._max_pack_size:
+                self._close_pack()
+                self._open_pack()
+            encoded = cid.encode()
+            self._pack.write(self._cid_len.pack(len(encoded)) + encoded + self._data_len.pack(len(data)))
+            offset = self._pack.tell()
+            self._pack.write(data)
+            # data must reach the pack before the index points to it
+            self._pack.flush()
+            db.execute('INSERT OR IGNORE INTO objects (cid, pack, offset, size) VALUES (?, ?, ?, ?)',
+                       (cid, self._pack_name, offset, len(data)))
+            return True
+
+    def remove(self, cids):
+        with self._db.transaction() as db:
+            db.executemany('DELETE FROM objects WHERE cid = ?', ((cid,) for cid in cids))
+
+    def keys(self):
+        return [row[0] for row in self._db.fetchall('SELECT cid FROM objects')]
+
+    def __len__(self):
+        count, = self._db.fetchone('SELECT COUNT(*) FROM objects')
+        return count
+
+    def _live_sizes(self):
+        return dict(self._db.fetchall('SELECT pack, SUM(size) FROM objects GROUP BY pack'))
+
+    def compact(self, min_dead_ratio=0.5):
+        '''Rewrites the packs where at least min_dead_ratio of the space belongs to removed objects
+        and deletes the packs without any live object. Returns the number of bytes reclaimed.'''
+        with self._db.transaction() as db:
+            self._close_pack()
+            live_sizes = self._live_sizes()
+            reclaimed = 0
+            for pack in self.packs():
+                pack_path = os.path.join(self._path, pack)
+                pack_size = os.path.getsize(pack_path)
+                live = live_sizes.get(pack, 0)
+                if live > 0 and (pack_size - live) < min_dead_ratio * pack_size:
+                    continue
+                log.debug('Compact pack [%s]' % pack, class_name=HASH_FS_CLASS_NAME)
+                rows = db.fetchall('SELECT cid, offset, size FROM objects WHERE pack = ?', (pack,))
+                with open(pack_path, 'rb') as f:
+                    for cid, offset, size in rows:
+                        f.seek(offset)
+                        data = f.read(size)
+                        db.execute('DELETE FROM objects WHERE cid = ?', (cid,))
+                        self.write(cid, data)
+                self._close_pack()
+                os.unlink(pack_path)
+                reclaimed += pack_size - live
+            return reclaimed
+
+    def _close_pack(self):
+        if self._pack is not None:
+            self._pack.close()
+            self._pack = None
+            self._pack_name = None
+
+    def close(self):
+        with self._db.locked() as db:
+            self._close_pack()
+            db.close()
@@ -0,0 +1,75 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import hashlib
+import math
+
+from ml_git.constants import GC_BLOOM_ERROR_RATE, GC_MAX_SET_KEYS
+
+
+class BloomFilter(object):
+    '''Set of keys with a few bits per key, where a key never added can be found (false positive) with a probability
+    of error_rate while no more than capacity keys are added.'''
+
+    def __init__(self, capacity, error_rate=GC_BLOOM_ERROR_RATE):
+        self.capacity = capacity
+        self._nbits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._nhashes = max(1, round(self._nbits / capacity * math.log(2)))
+        self._bits = bytearray((self._nbits + 7) // 8)
+        self._count = 0
+
+    def _positions(self, key):
+        # double hashing: the positions are h1 + i * h2 for two independent 64 bits hashes of the key
+        digest = hashlib.sha256(key.encode()).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        return [(h1 + i * h2) % self._nbits for i in range(self._nhashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self._count += 1
+
+    def __contains__(self, key):
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def __len__(self):
+        return self._count
+
+
+class ReachableSet(object):
+    '''Keys reachable from the indexes of the entities (mark phase of gc): a key not in it is garbage.
+
+    Keys are kept in a set up to max_keys, then in bloom filters, each one twice as large as the previous one once it is
+    full, so huge stores are marked with a few bits per key. Bloom filters have no false negatives: a false positive only
+    keeps an unused object until a later gc.'''
+
+    def __init__(self, max_keys=GC_MAX_SET_KEYS, error_rate=GC_BLOOM_ERROR_RATE):
+        self._max_keys = max_keys
+        self._error_rate = error_rate
+        self._keys = set()
+        self._filters = []
+
+    def add(self, key):
+        if not self._filters:
+            self._keys.add(key)
+            if len(self._keys) > self._max_keys:
+                self._filters.append(BloomFilter(2 * self._max_keys, self._error_rate))
+                for k in self._keys:
+                    self._filters[-1].add(k)
+                self._keys = set()
+            return
+        if key in self:
+            return
+        if len(self._filters[-1]) >= self._filters[-1].capacity:
+            self._filters.append(BloomFilter(2 * self._filters[-1].capacity, self._error_rate))
+        self._filters[-1].add(key)
+
+    def update(self, keys):
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key):
+        return key in self._keys or any(key in f for f in self._filters)
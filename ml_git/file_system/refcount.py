@@ -0,0 +1,175 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import os
+
+from ml_git import log
+from ml_git.config import get_refcounts_path
+from ml_git.constants import REFCOUNT_CLASS_NAME
+from ml_git.file_system.db import open_db
+
+_COUNTED = 1
+_PENDING = 0
+# keys looked up by query, SQLite allows 999 parameters
+_QUERY_KEYS = 500
+
+
+class RefCounts(object):
+    '''Persistent reference counts of the objects used by the indexes of the entities, for incremental gc.
+
+    The roots are the descriptors (IPLDs) in the index of each entity (owner): a descriptor counts once per owner using
+    it, and a descriptor used counts once for each of its chunks. Objects whose count drops to zero are kept as
+    candidates, so gc only visits them instead of marking and sweeping the whole store. The chunks of a descriptor not
+    in the local objects when it gets used (e.g. bare checkout) are pending, and counted once it is found. Objects
+    written but never used by an index (e.g. fetched and not checked out, or replaced by an add) have no count: the
+    commands writing descriptors record them (written), gc only visits the ones without a count and their chunks.
+
+    The counts only mean something once built by a full gc (initialized), until then gc is always full.'''
+
+    def __init__(self, db_path):
+        self._db = open_db(db_path)
+        with self._db.transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID')
+            db.execute('CREATE TABLE IF NOT EXISTS roots (owner TEXT, key TEXT, PRIMARY KEY (owner, key)) WITHOUT ROWID')
+            # links is NULL for chunks, _COUNTED or _PENDING for descriptors
+            db.execute('CREATE TABLE IF NOT EXISTS refs (key TEXT PRIMARY KEY, count INTEGER, links INTEGER) '
+                       'WITHOUT ROWID')
+            db.execute('CREATE TABLE IF NOT EXISTS zero (key TEXT PRIMARY KEY) WITHOUT ROWID')
+            db.execute('CREATE TABLE IF NOT EXISTS written (key TEXT PRIMARY KEY) WITHOUT ROWID')
+
+    def is_initialized(self):
+        row = self._db.fetchone('SELECT value FROM settings WHERE name = ?', ('initialized',))
+        return row is not None and row[0] == '1'
+
+    def rebuild(self, owners):
+        '''Replaces all the counts by the ones of owners, a list of (owner, descriptors, objects) from a full gc.'''
+        with self._db.transaction() as db:
+            for table in ['roots', 'refs', 'zero', 'written']:
+                db.execute('DELETE FROM %s' % table)
+            for owner, keys, objects in owners:
+                self._update_roots(owner, keys, objects)
+            db.execute('INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)', ('initialized', '1'))
+
+    def update_roots(self, owner, keys, objects):
+        '''Sets the descriptors used by owner, descriptors and chunks are loaded from objects (a MultihashFS).'''
+        with self._db.transaction():
+            self._update_roots(owner, keys, objects)
+
+    def _update_roots(self, owner, keys, objects):
+        stored = {row[0] for row in self._db.fetchall('SELECT key FROM roots WHERE owner = ?', (owner,))}
+        keys = set(keys)
+        added = keys - stored
+        removed = stored - keys
+        self._db.executemany('INSERT INTO roots (owner, key) VALUES (?, ?)', ((owner, key) for key in added))
+        self._db.executemany('DELETE FROM roots WHERE owner = ? AND key = ?', ((owner, key) for key in removed))
+        for key in added:
+            if self._add(key, 1) == 1:
+                self._count_links(key, objects, 1)
+        for key in removed:
+            if self._add(key, -1) == 0:
+                self._count_links(key, objects, -1)
+        log.debug('Refcounts: %d descriptors added and %d removed for [%s]' % (len(added), len(removed), owner),
+                  class_name=REFCOUNT_CLASS_NAME)
+
+    def _add(self, key, delta):
+        row = self._db.fetchone('SELECT count FROM refs WHERE key = ?', (key,))
+        count = (row[0] if row is not None else 0) + delta
+        if row is None:
+            self._db.execute('INSERT INTO refs (key, count) VALUES (?, ?)', (key, count))
+        else:
+            self._db.execute('UPDATE refs SET count = ? WHERE key = ?', (count, key))
+        if count <= 0:
+            self._db.execute('INSERT OR IGNORE INTO zero (key) VALUES (?)', (key,))
+        else:
+            self._db.execute('DELETE FROM zero WHERE key = ?', (key,))
+        return count
+
+    def _count_links(self, key, objects, delta):
+        # the chunks of a descriptor are counted while it is used, i.e. links == _COUNTED iff count > 0 and found
+        row = self._db.fetchone('SELECT links FROM refs WHERE key = ?', (key,))
+        if (row[0] == _COUNTED) == (delta > 0):
+            return
+        descriptor = objects.load(key)
+        if 'Links' not in descriptor:
+            self._db.execute('UPDATE refs SET links = ? WHERE key = ?', (_PENDING, key))
+            return
+        for link in descriptor['Links']:
+            self._add(link['Hash'], delta)
+        self._db.execute('UPDATE refs SET links = ? WHERE key = ?', (_COUNTED if delta > 0 else _PENDING, key))
+
+    def count_pending(self, objects_list):
+        '''Counts the chunks of the used descriptors that were not found before, from any of objects_list.'''
+        with self._db.transaction() as db:
+            pending = [row[0] for row in db.fetchall('SELECT key FROM refs WHERE links = ? AND count > 0', (_PENDING,))]
+            for key in pending:
+                for objects in objects_list:
+                    if objects._exists(key):
+                        self._count_links(key, objects, 1)
+                        break
+
+    def owners(self):
+        return {row[0] for row in self._db.fetchall('SELECT DISTINCT owner FROM roots')}
+
+    def candidates(self):
+        '''Objects not used anymore since the last gc.'''
+        return [row[0] for row in self._db.fetchall('SELECT zero.key FROM zero JOIN refs ON zero.key = refs.key '
+                                                    'WHERE refs.count <= 0')]
+
+    def add_written(self, keys):
+        '''Records descriptors written to the objects or the cache, whether or not an index uses them.'''
+        with self._db.transaction() as db:
+            db.executemany('INSERT OR IGNORE INTO written (key) VALUES (?)', ((key,) for key in keys))
+
+    def unrecorded(self, objects_list):
+        '''Descriptors written since the last gc without a count, and their chunks (from any of objects_list) without
+        a count.'''
+        keys = [row[0] for row in self._db.fetchall('SELECT written.key FROM written LEFT JOIN refs '
+                                                    'ON written.key = refs.key WHERE refs.key IS NULL')]
+        chunks = set()
+        for key in keys:
+            for objects in objects_list:
+                if objects._exists(key):
+                    chunks.update(link['Hash'] for link in objects.load(key).get('Links', []))
+                    break
+        return keys + self.unknown(chunks - set(keys))
+
+    def unknown(self, keys):
+        '''Keys without a count, i.e. never used by an index since the counts were built.'''
+        keys = list(keys)
+        known = set()
+        for i in range(0, len(keys), _QUERY_KEYS):
+            page = keys[i:i + _QUERY_KEYS]
+            known.update(row[0] for row in self._db.fetchall('SELECT key FROM refs WHERE key IN (%s)'
+                                                             % ', '.join('?' * len(page)), page))
+        return [key for key in keys if key not in known]
+
+    def forget(self, keys):
+        '''Drops the keys removed by gc, and the written descriptors counted since (the others are pinned).'''
+        with self._db.transaction() as db:
+            db.executemany('DELETE FROM refs WHERE key = ?', ((key,) for key in keys))
+            db.executemany('DELETE FROM zero WHERE key = ?', ((key,) for key in keys))
+            db.executemany('DELETE FROM written WHERE key = ?', ((key,) for key in keys))
+            db.execute('DELETE FROM written WHERE key IN (SELECT key FROM refs)')
+
+    def close(self):
+        self._db.close()
+
+
+def record_written(config, keys):
+    '''Records the descriptors written by a command for the next incremental gc, once a full gc built the counts.'''
+    if not keys:
+        return
+    try:
+        db_path = get_refcounts_path(config)
+        if not os.path.exists(db_path):
+            return
+        refcounts = RefCounts(db_path)
+        try:
+            refcounts.add_written(keys)
+        finally:
+            refcounts.close()
+    except Exception as e:
+        # the objects are only missed by incremental gc until the next full gc
+        log.debug('Could not record the written objects: %s' % e, class_name=REFCOUNT_CLASS_NAME)
@@ -0,0 +1,39 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import errno
+import os
+import struct
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# linux/fs.h: _IOW(0x94, 9, int) and _IOW(0x94, 13, struct file_clone_range)
+FICLONE = 0x40049409
+FICLONERANGE = 0x4020940d
+_FILE_CLONE_RANGE = struct.Struct('qQQQ')
+# errors meaning the file system (or the pair of files) cannot share extents at all
+UNSUPPORTED_ERRORS = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.ENOSYS, errno.EBADF}
+
+
+def reflink_supported():
+    return fcntl is not None and hasattr(fcntl, 'ioctl') and os.name == 'posix'
+
+
+def clone_file(src_fd, dst_fd):
+    '''Makes dst_fd share all the extents of src_fd (copy-on-write), raises OSError when not supported.'''
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def clone_range(src_fd, src_offset, length, dst_fd, dst_offset):
+    '''Makes length bytes of dst_fd at dst_offset share the extents of src_fd at src_offset. Offsets must be
+    multiples of the block size of the file system, and so must length unless the range ends at the end of src_fd.'''
+    fcntl.ioctl(dst_fd, FICLONERANGE, _FILE_CLONE_RANGE.pack(src_fd, src_offset, length, dst_offset))
+
+
+def is_unsupported(e):
+    return isinstance(e, OSError) and e.errno in UNSUPPORTED_ERRORS
@@ -0,0 +1,122 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import os
+
+from ml_git import log
+from ml_git.constants import MULTI_HASH_CLASS_NAME
+from ml_git.file_system.db import open_db
+from ml_git.utils import yaml_load
+
+INDEX_COLUMNS = ['ctime', 'mtime', 'status', 'hash', 'size', 'previous_hash', 'untime']
+
+
+def remove_index_db(db_path):
+    for path in [db_path, db_path + '-wal', db_path + '-shm']:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+class SqliteIndex(object):
+    '''INDEX storage engine backed by SQLite.
+
+    Exposes the same interface as the Manifest used for INDEX.yaml (add, rm_key, get, save, iteration...),
+    but every add/remove is a single row upsert/delete and save() only commits the pending transaction.
+    Rows are also indexed by status, so queries like "all corrupted files" do not scan the whole index.'''
+
+    def __init__(self, db_path, yaml_path=None):
+        self._path = db_path
+        is_new = not os.path.exists(db_path)
+        self._db = open_db(db_path)
+        with self._db.transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS idx (file TEXT PRIMARY KEY, ctime REAL, mtime REAL, status TEXT, '
+                       'hash TEXT, size INTEGER, previous_hash TEXT, untime REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS idx_status ON idx (status)')
+        if is_new and yaml_path is not None and os.path.exists(yaml_path):
+            self._import_yaml(yaml_path)
+
+    def _import_yaml(self, yaml_path):
+        log.debug('Migrating index [%s] to [%s]' % (yaml_path, self._path), class_name=MULTI_HASH_CLASS_NAME)
+        rows = yaml_load(yaml_path)
+        for file, value in rows.items():
+            self.add(file, value)
+        self.save()
+        os.unlink(yaml_path)
+
+    @staticmethod
+    def _to_dict(row):
+        return {column: value for column, value in zip(INDEX_COLUMNS, row) if value is not None}
+
+    def _select(self, where='', params=()):
+        return self._db.fetchall('SELECT file, %s FROM idx %s' % (', '.join(INDEX_COLUMNS), where), params)
+
+    def add(self, file, value, previous_key=None):
+        self._db.execute('INSERT OR REPLACE INTO idx (file, %s) VALUES (?, %s)'
+                         % (', '.join(INDEX_COLUMNS), ', '.join('?' * len(INDEX_COLUMNS))),
+                         [file] + [value.get(column) for column in INDEX_COLUMNS])
+
+    def update_field(self, files, field, value):
+        assert field in INDEX_COLUMNS
+        self._db.executemany('UPDATE idx SET %s = ? WHERE file = ?' % field, [(value, file) for file in files])
+
+    def rm_key(self, file):
+        self._db.execute('DELETE FROM idx WHERE file = ?', (file,))
+
+    def rm_status(self, status):
+        self._db.execute('DELETE FROM idx WHERE status = ?', (status,))
+
+    def get_files_by_status(self, status):
+        return [row[0] for row in self._select('WHERE status = ?', (status,))]
+
+    def get_total_size(self):
+        total_size, = self._db.fetchone('SELECT COALESCE(SUM(size), 0) FROM idx')
+        return total_size
+
+    def exists(self, file):
+        return self.get(file) is not None
+
+    def get(self, file):
+        rows = self._select('WHERE file = ?', (file,))
+        if not rows:
+            return None
+        return self._to_dict(rows[0][1:])
+
+    def __getitem__(self, file):
+        value = self.get(file)
+        if value is None:
+            raise KeyError(file)
+        return value
+
+    def __contains__(self, file):
+        return self.exists(file)
+
+    def __iter__(self):
+        for row in self._select():
+            yield row[0]
+
+    def __len__(self):
+        count, = self._db.fetchone('SELECT COUNT(*) FROM idx')
+        return count
+
+    def items(self):
+        for row in self._select():
+            yield row[0], self._to_dict(row[1:])
+
+    def keys(self):
+        return iter(self)
+
+    def get_yaml(self):
+        return self
+
+    def load(self):
+        return dict(self.items())
+
+    def save(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,282 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from ml_git import log
+from ml_git.constants import MULTI_HASH_CLASS_NAME, Chunking
+from ml_git.file_system.db import open_db
+from ml_git.file_system.watcher import Journal
+
+# changes made within this delay of the scan can share a timestamp with a later change, so they are not cached
+RACY_DELAY_NS = 2 * 10 ** 9
+_CACHED_DIRS = 256
+_VERSION = '2'
+
+
+def _to_seconds(ns):
+    # same float as os.stat_result.st_mtime
+    sec, nsec = divmod(ns, 10 ** 9)
+    return sec + nsec * 1e-9
+
+
+class CachedStat(namedtuple('CachedStat', ['st_ino', 'st_size', 'st_mtime_ns', 'st_ctime_ns'])):
+
+    @property
+    def st_mtime(self):
+        return _to_seconds(self.st_mtime_ns)
+
+    @property
+    def st_ctime(self):
+        return _to_seconds(self.st_ctime_ns)
+
+
+class StatCache(object):
+    '''Stat information (inode, size, mtime_ns, ctime_ns) and hash of the workspace files, as in the git index.
+
+    A file whose stat did not change since it was hashed keeps its hash, so only the files really modified are hashed
+    again. The names of the entries of each directory are kept with its mtime as well: adding, removing or renaming an
+    entry changes the mtime of its directory, so the directories that did not change are not read again.
+    A file edited in place does not change the mtime of its directory, its own stat is still checked.
+    Hashes depend on the chunking of the entity, they are dropped when it changes.
+
+    When a watcher runs for the workspace (watch_path), the entries it did not report as changed since they were
+    cached are marked as watched, and their stat and listing are used without reading the file system.'''
+
+    def __init__(self, db_path, chunking=Chunking.FIXED.value, watch_path=None):
+        # the lock of the database also guards the entries loaded from it
+        self._db = open_db(db_path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID')
+        if self._get_setting('version') != _VERSION:
+            self._db.execute('DROP TABLE IF EXISTS files')
+            self._db.execute('DROP TABLE IF EXISTS dirs')
+            self._db.execute('DELETE FROM settings')
+            self._set_setting('version', _VERSION)
+        self._db.execute('CREATE TABLE IF NOT EXISTS files (dir TEXT, name TEXT, ino INTEGER, size INTEGER, '
+                         'mtime_ns INTEGER, ctime_ns INTEGER, hash TEXT, watched INTEGER, PRIMARY KEY (dir, name)) '
+                         'WITHOUT ROWID')
+        self._db.execute('CREATE TABLE IF NOT EXISTS dirs (dir TEXT PRIMARY KEY, mtime_ns INTEGER, files TEXT, '
+                         'dirs TEXT, watched INTEGER) WITHOUT ROWID')
+        if self._get_setting('chunking') != chunking:
+            self._db.execute('DELETE FROM files')
+            self._set_setting('chunking', chunking)
+        self._start_ns = time.time_ns()
+        self._watched = watch_path is not None and self._load_journal(Journal(watch_path))
+        self._db.commit()
+        self._entries = OrderedDict()
+
+    def _get_setting(self, name):
+        row = self._db.fetchone('SELECT value FROM settings WHERE name = ?', (name,))
+        return row[0] if row is not None else None
+
+    def _set_setting(self, name, value):
+        self._db.execute('INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)', (name, value))
+
+    def _load_journal(self, journal):
+        changes = journal.changes(self._get_setting('watch_token'))
+        if changes is None:
+            return False
+        token, paths = changes
+        if paths is None:
+            # new watcher, the cached entries may have changed before it started
+            log.debug('Stat cache: new watcher journal', class_name=MULTI_HASH_CLASS_NAME)
+            self._db.execute('UPDATE files SET watched = 0')
+            self._db.execute('UPDATE dirs SET watched = 0')
+        else:
+            log.debug('Stat cache: %d paths changed since the last scan' % len(paths), class_name=MULTI_HASH_CLASS_NAME)
+            for path in paths:
+                self._unwatch(path)
+        self._set_setting('watch_token', token)
+        return True
+
+    def _unwatch(self, path):
+        if path.endswith('/'):
+            tree = path.rstrip('/')
+            if not tree:
+                self._db.execute('UPDATE files SET watched = 0')
+                self._db.execute('UPDATE dirs SET watched = 0')
+                return
+            for table in ['files', 'dirs']:
+                self._db.execute('UPDATE %s SET watched = 0 WHERE dir = ? OR substr(dir, 1, ?) = ?' % table,
+                                 (tree, len(tree) + 1, tree + '/'))
+            path = tree
+        rel_dir, _, name = path.rpartition('/')
+        self._db.execute('UPDATE files SET watched = 0 WHERE dir = ? AND name = ?', (rel_dir, name))
+        self._db.execute('UPDATE dirs SET watched = 0 WHERE dir = ?', (rel_dir,))
+
+    @staticmethod
+    def _stat_key(st):
+        return st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns
+
+    def _is_racy(self, st):
+        return self._start_ns - max(st.st_mtime_ns, st.st_ctime_ns) < RACY_DELAY_NS
+
+    def _read_dir(self, rel_dir, full_dir):
+        row = self._db.fetchone('SELECT mtime_ns, files, dirs, watched FROM dirs WHERE dir = ?', (rel_dir,))
+        if row is not None and self._watched and row[3]:
+            return json.loads(row[1]), json.loads(row[2])
+        st = os.stat(full_dir)
+        if row is not None and row[0] == st.st_mtime_ns:
+            files, dirs = json.loads(row[1]), json.loads(row[2])
+        else:
+            files = []
+            dirs = []
+            with os.scandir(full_dir) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        # like os.walk, symbolic links to directories are not followed
+                        if not entry.is_symlink():
+                            dirs.append(entry.name)
+                    else:
+                        files.append(entry.name)
+        # a racy listing is only used while watched, its mtime never matches
+        mtime_ns = -1 if self._is_racy(st) else st.st_mtime_ns
+        if row is None or row[0] != mtime_ns or row[3] != self._watched:
+            if mtime_ns != -1 or self._watched:
+                self._db.execute('INSERT OR REPLACE INTO dirs (dir, mtime_ns, files, dirs, watched) VALUES (?, ?, ?, ?, ?)',
+                                 (rel_dir, mtime_ns, json.dumps(files), json.dumps(dirs), int(self._watched)))
+        return files, dirs
+
+    def walk(self, path, directory='', nworkers=1):
+        '''Yields the relative path (posix, '' for path) and the file names of each directory of path,
+        beginning with directory. With nworkers > 1, directories are read by nworkers threads, in no particular order.'''
+        directory = directory.strip('/')
+        if nworkers > 1:
+            yield from self._parallel_walk(path, directory, nworkers)
+        else:
+            pending = [directory]
+            while pending:
+                rel_dir = pending.pop()
+                try:
+                    files, dirs = self._read_dir(rel_dir, os.path.join(path, rel_dir))
+                except (FileNotFoundError, NotADirectoryError):
+                    continue
+                yield rel_dir, files
+                pending.extend(rel_dir + '/' + name if rel_dir else name for name in reversed(dirs))
+        self.save()
+
+    def _parallel_walk(self, path, directory, nworkers):
+        # the threads share a stack of directories to read, an idle thread takes the last one found by any thread
+        pending = [directory]
+        results = queue.Queue()
+        state = {'active': 0, 'stop': False}
+        cond = threading.Condition()
+
+        def worker():
+            while True:
+                with cond:
+                    while not pending and state['active'] and not state['stop']:
+                        cond.wait()
+                    if not pending or state['stop']:
+                        cond.notify_all()
+                        results.put(None)
+                        return
+                    rel_dir = pending.pop()
+                    state['active'] += 1
+                dirs = []
+                try:
+                    files, dirs = self._read_dir(rel_dir, os.path.join(path, rel_dir))
+                    results.put((rel_dir, files))
+                except (FileNotFoundError, NotADirectoryError):
+                    pass
+                except Exception as e:
+                    results.put(e)
+                with cond:
+                    pending.extend(rel_dir + '/' + name if rel_dir else name for name in reversed(dirs))
+                    state['active'] -= 1
+                    cond.notify_all()
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(nworkers)]
+        for thread in threads:
+            thread.start()
+        try:
+            running = nworkers
+            while running:
+                result = results.get()
+                if result is None:
+                    running -= 1
+                elif isinstance(result, Exception):
+                    raise result
+                else:
+                    yield result
+        finally:
+            with cond:
+                state['stop'] = True
+                cond.notify_all()
+            for thread in threads:
+                thread.join()
+
+    def _get_entries(self, rel_dir):
+        # the entries of a directory are loaded at once, files are mostly looked up directory by directory
+        with self._db.locked() as db:
+            entries = self._entries.get(rel_dir)
+            if entries is None:
+                rows = db.fetchall('SELECT name, ino, size, mtime_ns, ctime_ns, hash, watched FROM files WHERE dir = ?',
+                                   (rel_dir,))
+                entries = {row[0]: row[1:] for row in rows}
+                self._entries[rel_dir] = entries
+                if len(self._entries) > _CACHED_DIRS:
+                    self._entries.popitem(last=False)
+            return entries
+
+    def stat(self, rel_path, full_path):
+        '''os.stat of full_path, or its cached stat if it is watched and did not change.'''
+        if self._watched:
+            rel_dir, _, name = rel_path.rpartition('/')
+            entry = self._get_entries(rel_dir).get(name)
+            if entry is not None and entry[5]:
+                return CachedStat(*entry[:4])
+            st = os.stat(full_path)
+            self.update(rel_path, st)
+            return st
+        return os.stat(full_path)
+
+    def get(self, rel_path, st):
+        '''Hash of rel_path if its stat did not change since it was hashed, None otherwise.'''
+        rel_dir, _, name = rel_path.rpartition('/')
+        entry = self._get_entries(rel_dir).get(name)
+        if entry is not None and entry[:4] == self._stat_key(st):
+            return entry[4]
+        return None
+
+    def update(self, rel_path, st, key=None):
+        rel_dir, _, name = rel_path.rpartition('/')
+        stat_key = self._stat_key(st)
+        cached = self._get_entries(rel_dir).get(name)
+        if cached is not None and cached[:4] == stat_key and key in (None, cached[4]):
+            key = cached[4]
+        elif key is not None and self._is_racy(st):
+            # the stat of a racy file is only used while watched, not its hash
+            if not self._watched:
+                return
+            key = None
+        entry = stat_key + (key, int(self._watched))
+        if entry == cached:
+            return
+        with self._db.locked() as db:
+            db.execute('INSERT OR REPLACE INTO files (dir, name, ino, size, mtime_ns, ctime_ns, hash, watched) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (rel_dir, name) + entry)
+            if rel_dir in self._entries:
+                self._entries[rel_dir][name] = entry
+
+    def get_scid(self, rel_path, full_path, hash_fs, st=None):
+        st = os.stat(full_path) if st is None else st
+        scid = self.get(rel_path, st)
+        if scid is None:
+            log.debug('Hashing [%s]' % rel_path, class_name=MULTI_HASH_CLASS_NAME)
+            scid = hash_fs.get_scid(full_path)
+            self.update(rel_path, st, scid)
+        return scid
+
+    def save(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.close(commit=True)
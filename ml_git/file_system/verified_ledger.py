@@ -0,0 +1,55 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import threading
+
+from ml_git.file_system.db import open_db
+
+
+class VerifiedLedger(object):
+    '''Persistent record of the loose chunks whose content was checked against their CID, with the inode, size and
+    mtime_ns of the chunk file at that time.
+
+    A chunk file whose stat did not change since it was checked is not hashed again when files are rebuilt from it.
+    Replacing or rewriting the file changes its stat, silent corruption of the disk does not (see --paranoid).
+    Chunks added are kept in memory and written at once on flush.'''
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._db = open_db(db_path)
+        with self._db.transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS chunks (key TEXT PRIMARY KEY, ino INTEGER, size INTEGER, '
+                       'mtime_ns INTEGER) WITHOUT ROWID')
+
+    def is_verified(self, key, st):
+        with self._lock:
+            verified = self._pending.get(key)
+        if verified is None:
+            verified = self._db.fetchone('SELECT ino, size, mtime_ns FROM chunks WHERE key = ?', (key,))
+        return verified is not None and tuple(verified) == (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def add(self, key, st):
+        with self._lock:
+            self._pending[key] = (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        with self._db.transaction() as db:
+            db.executemany('INSERT OR REPLACE INTO chunks (key, ino, size, mtime_ns) VALUES (?, ?, ?, ?)',
+                           ((key,) + verified for key, verified in pending.items()))
+
+    def remove(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+        with self._db.transaction() as db:
+            db.execute('DELETE FROM chunks WHERE key = ?', (key,))
+
+    def close(self):
+        self.flush()
+        self._db.close()
@@ -0,0 +1,344 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import ctypes
+import ctypes.util
+import json
+import os
+import signal
+import struct
+import subprocess
+import sys
+import time
+import uuid
+
+from ml_git import log
+from ml_git.constants import WATCHER_CLASS_NAME
+from ml_git.utils import ensure_path_exists
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+_WORKSPACE_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+    IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+_DIR_CHANGES = IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+_EVENT = struct.Struct('iIII')
+_READ_SIZE = 1024 * 1024
+
+JOURNAL_FILE = 'journal'
+LOG_FILE = 'watcher.log'
+COOKIE_PREFIX = 'cookie-'
+# a new journal (and one full scan) is cheaper than reading a large one on each status
+JOURNAL_MAX_SIZE = 16 * 1024 * 1024
+SYNC_TIMEOUT = 2
+START_TIMEOUT = 600
+
+
+def inotify_supported():
+    return sys.platform.startswith('linux') and hasattr(_libc(), 'inotify_init1')
+
+
+def _libc():
+    return ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Inotify(object):
+    '''inotify instance (Linux), through ctypes.'''
+
+    def __init__(self):
+        self._libc = _libc()
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            self._raise()
+
+    def _raise(self, path=None):
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno), path)
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            self._raise(path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        '''Blocks until there are events and returns them as (wd, mask, name) tuples.'''
+        data = os.read(self.fd, _READ_SIZE)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Journal(object):
+    '''Paths changed in a workspace, written by its watcher in watch_path/journal.
+
+    The first line has the id and pid of the watcher. Each following line is a path (posix, relative to the workspace)
+    that changed, with a trailing / when anything below it may have changed too. The watcher starts a new journal, with
+    a new id, when it may have missed events.
+
+    Events are written a little after they happen. To read all the changes made before a given moment, a cookie file
+    is created in watch_path (watched by the same inotify instance, so its event comes after the previous ones) and the
+    journal is read up to the line #<cookie> written by the watcher.'''
+
+    def __init__(self, watch_path):
+        self._watch_path = watch_path
+        self._journal_path = os.path.join(watch_path, JOURNAL_FILE)
+
+    def header(self):
+        try:
+            with open(self._journal_path) as f:
+                return json.loads(f.readline())
+        except (OSError, ValueError):
+            return None
+
+    def is_running(self):
+        header = self.header()
+        return header is not None and _is_alive(header['pid'])
+
+    def _sync(self):
+        header = self.header()
+        if header is None or not _is_alive(header['pid']):
+            return None
+        cookie = COOKIE_PREFIX + uuid.uuid4().hex
+        cookie_path = os.path.join(self._watch_path, cookie)
+        marker = ('#%s\n' % cookie).encode()
+        deadline = time.monotonic() + SYNC_TIMEOUT
+        open(cookie_path, 'w').close()
+        try:
+            while time.monotonic() < deadline:
+                with open(self._journal_path, 'rb') as f:
+                    data = f.read()
+                header_end = data.find(b'\n') + 1
+                if json.loads(data[:header_end]) != header:
+                    # new journal, the cookie may have been written to the previous one
+                    return None
+                pos = data.find(marker, header_end)
+                if pos >= 0:
+                    return header['id'], data, header_end, pos + len(marker)
+                time.sleep(0.005)
+        except (OSError, ValueError):
+            pass
+        finally:
+            os.remove(cookie_path)
+        log.debug('Watcher did not answer in %ds' % SYNC_TIMEOUT, class_name=WATCHER_CLASS_NAME)
+        return None
+
+    def changes(self, token=None):
+        '''Returns None when no watcher is running. Otherwise returns a new token and the paths changed since token
+        (returned by a previous call), or None instead of the paths if they are not known since token.'''
+        sync = self._sync()
+        if sync is None:
+            return None
+        journal_id, data, header_end, end = sync
+        new_token = '%s:%d' % (journal_id, end)
+        if token is None or not token.startswith(journal_id + ':'):
+            return new_token, None
+        start = max(int(token[len(journal_id) + 1:]), header_end)
+        paths = {line for line in data[start:end].decode().split('\n') if line and not line.startswith('#')}
+        return new_token, paths
+
+
+class Watcher(object):
+    '''Records the paths changed in the workspace path in a Journal in watch_path.'''
+
+    def __init__(self, path, watch_path):
+        self._path = path
+        self._watch_path = watch_path
+        self._journal_path = os.path.join(watch_path, JOURNAL_FILE)
+        self._inotify = None
+        self._wds = {}
+        self._root_wd = None
+        self._cookie_wd = None
+        self._journal = None
+
+    def _add_watches(self, rel_dir):
+        pending = [rel_dir]
+        while pending:
+            rel_dir = pending.pop()
+            full_dir = os.path.join(self._path, rel_dir)
+            try:
+                wd = self._inotify.add_watch(full_dir, _WORKSPACE_MASK)
+                self._wds[wd] = rel_dir
+                with os.scandir(full_dir) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(rel_dir + '/' + entry.name if rel_dir else entry.name)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            if rel_dir == '':
+                self._root_wd = wd
+
+    def _remove_watches(self, rel_dir):
+        prefix = rel_dir + '/'
+        for wd, watched_dir in list(self._wds.items()):
+            if watched_dir == rel_dir or watched_dir.startswith(prefix):
+                self._inotify.rm_watch(wd)
+                del self._wds[wd]
+
+    def _new_journal(self):
+        if self._journal is not None:
+            os.close(self._journal)
+        tmp_path = self._journal_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps({'id': uuid.uuid4().hex, 'pid': os.getpid()}) + '\n')
+        os.replace(tmp_path, self._journal_path)
+        self._journal = os.open(self._journal_path, os.O_WRONLY | os.O_APPEND)
+
+    def _write(self, lines):
+        if not lines:
+            return
+        os.write(self._journal, ('\n'.join(lines) + '\n').encode())
+        if os.fstat(self._journal).st_size > JOURNAL_MAX_SIZE:
+            self._new_journal()
+
+    def _on_overflow(self):
+        # events were dropped, new directories may not be watched
+        log.debug('inotify queue overflow, watching [%s] again' % self._path, class_name=WATCHER_CLASS_NAME)
+        for wd in list(self._wds):
+            self._inotify.rm_watch(wd)
+        self._wds = {}
+        self._add_watches('')
+        self._new_journal()
+
+    def _handle(self, events):
+        '''Returns the journal lines of events, False when the workspace was removed.'''
+        lines = []
+        seen = set()
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                self._on_overflow()
+                return []
+            if wd == self._cookie_wd:
+                if name.startswith(COOKIE_PREFIX) and mask & IN_CREATE:
+                    lines.append('#' + name)
+                    # a change after the cookie must be written after it, even if it was written before
+                    seen = set()
+                continue
+            rel_dir = self._wds.get(wd)
+            if rel_dir is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._wds[wd]
+                continue
+            if not name:
+                if wd == self._root_wd and mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    return False
+                continue
+            rel_path = rel_dir + '/' + name if rel_dir else name
+            if mask & IN_ISDIR and mask & _DIR_CHANGES:
+                if mask & IN_MOVED_FROM:
+                    self._remove_watches(rel_path)
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    # files may be created in it before it is watched
+                    self._add_watches(rel_path)
+                rel_path += '/'
+            if rel_path not in seen:
+                seen.add(rel_path)
+                lines.append(rel_path)
+        return lines
+
+    def run(self):
+        ensure_path_exists(self._watch_path)
+        self._inotify = Inotify()
+        try:
+            self._add_watches('')
+            self._cookie_wd = self._inotify.add_watch(self._watch_path, IN_CREATE | IN_ONLYDIR)
+            self._new_journal()
+            log.debug('Watching [%s] (%d directories)' % (self._path, len(self._wds)), class_name=WATCHER_CLASS_NAME)
+            while True:
+                lines = self._handle(self._inotify.read_events())
+                if lines is False:
+                    log.debug('[%s] was removed' % self._path, class_name=WATCHER_CLASS_NAME)
+                    return
+                self._write(lines)
+        finally:
+            self._inotify.close()
+            header = Journal(self._watch_path).header()
+            if header is not None and header['pid'] == os.getpid():
+                os.remove(self._journal_path)
+
+
+def start_watcher(path, watch_path):
+    '''Starts a watcher process for the workspace path, if none is running, and waits until it watches all the
+    directories.'''
+    journal = Journal(watch_path)
+    if journal.is_running():
+        log.info('A watcher is already running for [%s]' % path, class_name=WATCHER_CLASS_NAME)
+        return
+    if not inotify_supported():
+        raise RuntimeError('The watcher requires inotify (Linux).')
+    ensure_path_exists(watch_path)
+    # ml_git may not be installed in the interpreter (source checkout)
+    package_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_root, os.environ.get('PYTHONPATH')])))
+    with open(os.path.join(watch_path, LOG_FILE), 'a') as log_file:
+        process = subprocess.Popen([sys.executable, '-m', 'ml_git.file_system.watcher', os.path.abspath(path), watch_path],
+                                   stdin=subprocess.DEVNULL, stdout=log_file, stderr=log_file, env=env,
+                                   start_new_session=True)
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        header = journal.header()
+        if header is not None and header['pid'] == process.pid:
+            log.info('Watching [%s]' % path, class_name=WATCHER_CLASS_NAME)
+            return
+        if process.poll() is not None:
+            break
+        time.sleep(0.05)
+    raise RuntimeError('The watcher did not start, see %s' % os.path.join(watch_path, LOG_FILE))
+
+
+def stop_watcher(watch_path):
+    header = Journal(watch_path).header()
+    if header is None or not _is_alive(header['pid']):
+        log.info('No watcher running', class_name=WATCHER_CLASS_NAME)
+        return
+    os.kill(header['pid'], signal.SIGTERM)
+    log.info('Watcher stopped', class_name=WATCHER_CLASS_NAME)
+
+
+def _exit(signum, frame):
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, _exit)
+    log.init_logger('debug')
+    Watcher(sys.argv[1], sys.argv[2]).run()
@@ -61,6 +61,12 @@ def set_level(loglevel):
     init_logger(loglevel)
 
 
+def get_level():
+    if MLGitLogger is None or not MLGitLogger.handlers:
+        return None
+    return logging.getLevelName(MLGitLogger.handlers[0].level).lower()
+
+
 def __log(level, log_message, dict):
     global MLGitLogger
     try:
@@ -3,14 +3,235 @@
 SPDX-License-Identifier: GPL-2.0-only
 """
 
-from ml_git.utils import yaml_load, yaml_save
+import hashlib
+import mmap
+import os
+import struct
 from pprint import pformat
 
+from ml_git import log
+from ml_git.constants import BINARY_MANIFESTS_DIR, MANIFEST_BINARY_EXTENSION, MANIFEST_CLASS_NAME, ROOT_FILE_NAME
+from ml_git.utils import ensure_path_exists, tmp_file_path, yaml_load, yaml_save
+
+
+def get_binary_manifest_path(manifest_path):
+    '''Binary manifest of the YAML manifest at manifest_path, kept out of the metadata repository in the directory
+    of its entity (.ml-git/<entity>/binary_manifests) and named after the hash of the manifest path.
+    Returns None for a manifest outside of a .ml-git directory.'''
+    manifest_path = os.path.realpath(manifest_path)
+    parts = manifest_path.split(os.sep)
+    if ROOT_FILE_NAME not in parts:
+        return None
+    root = len(parts) - 1 - parts[::-1].index(ROOT_FILE_NAME)
+    base = os.sep.join(parts[:root + 2] if root + 2 < len(parts) else parts[:root + 1])
+    name = hashlib.md5(manifest_path.encode()).hexdigest() + MANIFEST_BINARY_EXTENSION
+    return os.path.join(base, BINARY_MANIFESTS_DIR, name)
+
+
+def remove_binary_manifest(manifest_path):
+    binary_path = get_binary_manifest_path(manifest_path)
+    if binary_path is None:
+        return
+    try:
+        os.unlink(binary_path)
+    except FileNotFoundError:
+        pass
+
+
+class BinaryManifest(object):
+    '''Read-only, memory-mapped view over a manifest (key -> set of files).
+
+    Layout (little endian):
+        header       : magic, version, source size, source mtime_ns, number of keys, number of files
+        key offsets  : one uint64 per key, in the same order as the YAML manifest
+        key sorted   : one uint32 per key, indexes of key offsets sorted by key
+        file offsets : one uint64 per file, sorted by file
+        records      : key records [len, key, nfiles, (len, file)*] and file records [len, file, key index]
+
+    The source size and mtime_ns fingerprint the YAML file the binary was built from,
+    a binary manifest that does not match its YAML file is ignored (and rebuilt by the next load).'''
+
+    MAGIC = b'MLGM'
+    VERSION = 1
+    _header = struct.Struct('<4sIQqII')
+    _u32 = struct.Struct('<I')
+    _u64 = struct.Struct('<Q')
+
+    def __init__(self, path, fd, mm):
+        self._path = path
+        self._fd = fd
+        self._mm = mm
+        _, _, _, _, self._nkeys, self._nfiles = self._header.unpack_from(mm, 0)
+        self._key_offsets = self._header.size
+        self._key_sorted = self._key_offsets + self._nkeys * self._u64.size
+        self._file_offsets = self._key_sorted + self._nkeys * self._u32.size
+
+    @staticmethod
+    def _fingerprint(source_path):
+        st = os.stat(source_path)
+        return st.st_size, st.st_mtime_ns
+
+    @classmethod
+    def open(cls, path, source_path):
+        if path is None:
+            return None
+        try:
+            size, mtime_ns = cls._fingerprint(source_path)
+            fd = open(path, 'rb')
+        except OSError:
+            return None
+        try:
+            mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            fd.close()
+            return None
+        try:
+            magic, version, src_size, src_mtime_ns, _, _ = cls._header.unpack_from(mm, 0)
+        except struct.error:
+            magic = None
+        if magic != cls.MAGIC or version != cls.VERSION or (src_size, src_mtime_ns) != (size, mtime_ns):
+            log.debug('Ignoring stale binary manifest [%s]' % path, class_name=MANIFEST_CLASS_NAME)
+            mm.close()
+            fd.close()
+            return None
+        return cls(path, fd, mm)
+
+    @classmethod
+    def save(cls, manifest, path, source_path, fingerprint=None):
+        '''Writes the binary of manifest, unless source_path changed since it was read (fingerprint taken before).'''
+        keys = list(manifest.keys())
+        files = sorted((str(file), i) for i, key in enumerate(keys) for file in manifest[key])
+        key_sorted = sorted(range(len(keys)), key=lambda i: keys[i])
+
+        records = bytearray()
+        key_offsets = []
+        base = cls._header.size + len(keys) * (cls._u64.size + cls._u32.size) + len(files) * cls._u64.size
+        for key in keys:
+            key_offsets.append(base + len(records))
+            cls._append_str(records, key)
+            values = manifest[key]
+            records += cls._u32.pack(len(values))
+            for file in values:
+                cls._append_str(records, str(file))
+        file_offsets = []
+        for file, key_idx in files:
+            file_offsets.append(base + len(records))
+            cls._append_str(records, file)
+            records += cls._u32.pack(key_idx)
+
+        size, mtime_ns = cls._fingerprint(source_path)
+        if fingerprint is not None and fingerprint != (size, mtime_ns):
+            return
+        tmp_path = tmp_file_path(path)
+        with open(tmp_path, 'wb') as f:
+            f.write(cls._header.pack(cls.MAGIC, cls.VERSION, size, mtime_ns, len(keys), len(files)))
+            f.write(struct.pack('<%dQ' % len(key_offsets), *key_offsets))
+            f.write(struct.pack('<%dI' % len(key_sorted), *key_sorted))
+            f.write(struct.pack('<%dQ' % len(file_offsets), *file_offsets))
+            f.write(records)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def _append_str(cls, buffer, value):
+        encoded = value.encode()
+        buffer += cls._u32.pack(len(encoded))
+        buffer += encoded
+
+    def _read_str(self, offset):
+        length, = self._u32.unpack_from(self._mm, offset)
+        start = offset + self._u32.size
+        return self._mm[start:start + length].decode(), start + length
+
+    def _key_offset(self, idx):
+        return self._u64.unpack_from(self._mm, self._key_offsets + idx * self._u64.size)[0]
+
+    def _file_offset(self, idx):
+        return self._u64.unpack_from(self._mm, self._file_offsets + idx * self._u64.size)[0]
+
+    def _sorted_key_offset(self, idx):
+        key_idx, = self._u32.unpack_from(self._mm, self._key_sorted + idx * self._u32.size)
+        return self._key_offset(key_idx)
+
+    @staticmethod
+    def _bisect(value, count, read_at):
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            found, end = read_at(mid)
+            if found == value:
+                return end
+            if found < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def _read_files(self, offset):
+        nfiles, = self._u32.unpack_from(self._mm, offset)
+        offset += self._u32.size
+        files = set()
+        for _ in range(nfiles):
+            file, offset = self._read_str(offset)
+            files.add(file)
+        return files
+
+    def get(self, key):
+        end = self._bisect(key, self._nkeys, lambda i: self._read_str(self._sorted_key_offset(i)))
+        if end is None:
+            return None
+        return self._read_files(end)
+
+    def exists(self, key):
+        return self._bisect(key, self._nkeys, lambda i: self._read_str(self._sorted_key_offset(i))) is not None
+
+    def search(self, file):
+        end = self._bisect(file, self._nfiles, lambda i: self._read_str(self._file_offset(i)))
+        if end is None:
+            return None
+        key_idx, = self._u32.unpack_from(self._mm, end)
+        return self._read_str(self._key_offset(key_idx))[0]
+
+    def __len__(self):
+        return self._nkeys
+
+    def __iter__(self):
+        for i in range(self._nkeys):
+            yield self._read_str(self._key_offset(i))[0]
+
+    def items(self):
+        for i in range(self._nkeys):
+            key, end = self._read_str(self._key_offset(i))
+            yield key, self._read_files(end)
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def close(self):
+        self._mm.close()
+        self._fd.close()
+
 
 class Manifest(object):
     def __init__(self, manifest):
         self._mfpath = manifest
-        self._manifest = yaml_load(manifest)
+        self._mf_data = None
+        self._binary_path = get_binary_manifest_path(manifest)
+        self._binary = BinaryManifest.open(self._binary_path, manifest)
+        if self._binary is None:
+            # missing or stale (e.g. manifest written by a clone or a pull), rebuilt for the next loads
+            self._mf_data = self._load_yaml()
+
+    @property
+    def _manifest(self):
+        # any operation other than a lookup materializes the whole manifest
+        if self._mf_data is None:
+            self._mf_data = self._binary.to_dict()
+            self._binary.close()
+            self._binary = None
+        return self._mf_data
+
+    def _is_lazy(self):
+        return self._mf_data is None
 
     def add(self, key, file, previous_key=None):
         mf = self._manifest
@@ -79,9 +300,13 @@ class Manifest(object):
         self.__rm(key)
 
     def exists(self, key):
+        if self._is_lazy():
+            return self._binary.exists(key)
         return key in self._manifest
 
     def search(self, file):
+        if self._is_lazy():
+            return self._binary.search(file)
         mf = self._manifest
         for key in mf:
             if file in mf[key]:
@@ -89,22 +314,40 @@ class Manifest(object):
         return None
 
     def __iter__(self):
+        if self._is_lazy():
+            yield from self._binary
+            return
         for key in self._manifest.keys():
             yield key
 
+    def __len__(self):
+        if self._is_lazy():
+            return len(self._binary)
+        return len(self._manifest)
+
+    def __contains__(self, key):
+        return self.exists(key)
+
+    def keys(self):
+        return iter(self)
+
     def __getitem__(self, key):
+        if self._is_lazy():
+            files = self._binary.get(key)
+            if files is None:
+                raise KeyError(key)
+            return files
         return self._manifest[key]
 
     def get(self, key):
         try:
-            return self._manifest[key]
+            return self[key]
         except Exception:
             return None
 
     def exists_keyfile(self, key, file):
-        mf = self._manifest
         try:
-            files = mf[key]
+            files = self[key]
             return file in files
         except Exception:
             pass
@@ -117,10 +360,41 @@ class Manifest(object):
         return pformat(self._manifest, indent=4)
 
     def save(self):
-        yaml_save(self._manifest, self._mfpath)
+        mf = self._manifest
+        yaml_save(mf, self._mfpath)
+        self._save_binary()
+
+    def _load_yaml(self):
+        try:
+            fingerprint = BinaryManifest._fingerprint(self._mfpath)
+        except OSError:
+            return yaml_load(self._mfpath)
+        mf = yaml_load(self._mfpath)
+        self._save_binary(mf, fingerprint)
+        return mf
+
+    def _save_binary(self, mf=None, fingerprint=None):
+        if mf is None:
+            mf = self._mf_data
+        if not mf or self._binary_path is None or not os.path.exists(self._mfpath):
+            return
+        if not all(isinstance(files, (set, list)) for files in mf.values()):
+            return
+        try:
+            ensure_path_exists(os.path.dirname(self._binary_path))
+            BinaryManifest.save(mf, self._binary_path, self._mfpath, fingerprint)
+        except OSError as e:
+            log.debug('Could not write binary manifest for [%s] -- [%s]' % (self._mfpath, e),
+                      class_name=MANIFEST_CLASS_NAME)
 
     def load(self):
-        return yaml_load(self._mfpath)
+        binary = BinaryManifest.open(self._binary_path, self._mfpath)
+        if binary is None:
+            return self._load_yaml()
+        try:
+            return binary.to_dict()
+        finally:
+            binary.close()
 
     def get_diff(self, manifest_to_compare):
         result = {}
@@ -13,7 +13,7 @@ from ml_git._metadata import MetadataManager
 from ml_git.config import get_refs_path, get_sample_spec_doc
 from ml_git.constants import METADATA_CLASS_NAME, LOCAL_REPOSITORY_CLASS_NAME, ROOT_FILE_NAME, Mutability, \
     SPEC_EXTENSION, MANIFEST_FILE
-from ml_git.manifest import Manifest
+from ml_git.manifest import Manifest, remove_binary_manifest
 from ml_git.ml_git_message import output_messages
 from ml_git.plugin_interface.data_plugin_constants import ADD_METADATA
 from ml_git.plugin_interface.plugin_especialization import PluginCaller
@@ -132,6 +132,7 @@ class Metadata(MetadataManager):
         mobj.save()
         del (mobj)
         os.unlink(idx_path)
+        remove_binary_manifest(idx_path)
         return True
 
     def spec_split(self, spec):
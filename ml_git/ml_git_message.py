@@ -21,11 +21,18 @@ output_messages = {
     'INFO_STARTING_GC': 'Starting the garbage collector for %s',
     'INFO_REMOVED_FILES': 'A total of %s files have been removed from %s',
     'INFO_RECLAIMED_SPACE': 'Total reclaimed space %s.',
+    'INFO_PINNED_TAG': 'The objects of %s are kept by gc and cache eviction until unpinned',
+    'INFO_UNPINNED_TAG': 'The objects of %s are not pinned anymore',
+    'INFO_WAITING_FOR_LOCK': 'Waiting for other ml-git processes using %s',
+    'INFO_RECLAIMABLE_SPACE': 'A total of %s files could be removed from %s, reclaiming %s.',
+    'INFO_STARTING_REPACK': 'Starting the repack for %s',
+    'INFO_PACKED_OBJECTS': 'A total of %s loose objects have been moved to packs in %s',
     'INFO_ENTITY_DELETED': 'Entity %s was deleted',
 
     'ERROR_WITHOUT_TAG_FOR_THIS_ENTITY': 'No entity with that name was found.',
     'ERROR_MULTIPLES_ENTITIES_WITH_SAME_NAME': 'You have more than one entity with the same name. Use one of the following tags to perform the checkout:\n',
     'ERROR_WRONG_VERSION_NUMBER_TO_CHECKOUT': 'The version specified for that entity does not exist. Last entity tag:\n\t%s',
+    'ERROR_TAG_NOT_PINNED': '%s is not pinned',
     'ERROR_UNINITIALIZED_METADATA': 'You don\'t have any metadata initialized',
     'ERROR_REMOTE_UNCONFIGURED': 'Remote URL not found for [%s]. Check your configuration file.',
     'ERROR_ENTITY_NOT_FOUND': 'Entity type [%s] not found in your configuration file.',
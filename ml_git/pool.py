@@ -6,73 +6,354 @@ SPDX-License-Identifier: GPL-2.0-only
 from ml_git import log
 from concurrent import futures
 from tqdm import tqdm
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+from botocore.exceptions import ClientError, NoCredentialsError, PartialCredentialsError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotoConnectionError
+from google.auth.exceptions import RefreshError
+from googleapiclient.errors import HttpError
 from ml_git.constants import POOL_CLASS_NAME
+import json
 import os
-import time
 import random
+import socket
+import threading
+import time
 
 
-def pool_factory(ctx_factory=None, nworkers=os.cpu_count() * 5, retry=2, pb_elts=None, pb_desc='units'):
+def pool_factory(ctx_factory=None, nworkers=os.cpu_count() * 5, retry=2, pb_elts=None, pb_desc='units', adaptive=False):
     log.debug('Create a worker pool with [%d] threads & retry strategy of [%d]' % (nworkers, retry),
               class_name=POOL_CLASS_NAME)
+    retry_policy = RetryPolicy(retry, budget=RetryBudget())
+    if adaptive:
+        # contexts are created on demand, as the concurrency grows
+        return WorkerPool(nworkers=nworkers, retry=retry, pb_elts=pb_elts, pb_desc=pb_desc,
+                          ctx_factory=ctx_factory, controller=ConcurrencyController(nworkers), retry_policy=retry_policy)
     ctxs = [ctx_factory() for i in range(nworkers)] if ctx_factory is not None else None
-    return WorkerPool(nworkers=nworkers, pool_ctxs=ctxs, retry=retry, pb_elts=pb_elts, pb_desc=pb_desc)
+    return WorkerPool(nworkers=nworkers, pool_ctxs=ctxs, retry=retry, pb_elts=pb_elts, pb_desc=pb_desc,
+                      retry_policy=retry_policy)
+
+
+# error codes (S3 and Azure) and reasons (Google Drive) of the stores
+THROTTLING_ERROR_CODES = {'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequests',
+                          'TooManyRequestsException', 'RequestThrottled', 'ServerBusy', 'rateLimitExceeded',
+                          'userRateLimitExceeded', 'sharingRateLimitExceeded'}
+THROTTLING_STATUS_CODES = {429, 503}
+# transient errors, whatever their HTTP status (e.g. the S3 RequestTimeout and ExpiredToken are 400)
+RETRYABLE_ERROR_CODES = THROTTLING_ERROR_CODES | {'RequestTimeout', 'RequestTimeoutException', 'ExpiredToken',
+                                                  'ExpiredTokenException', 'RequestExpired', 'RequestTimeTooSkewed',
+                                                  'InternalError', 'ServiceUnavailable', 'OperationAborted',
+                                                  'OperationTimedOut', 'backendError', 'internalError'}
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+PERMANENT_ERROR_TYPES = (FileNotFoundError, PermissionError, NoCredentialsError, PartialCredentialsError, RefreshError)
+# connection failures and timeouts (e.g. EndpointConnectionError, ReadTimeoutError, ConnectionClosedError)
+RETRYABLE_ERROR_TYPES = (BotoConnectionError, HTTPClientError, ServiceRequestError, ServiceResponseError, ConnectionError,
+                         TimeoutError, socket.timeout)
+
+
+def _gdrive_reason(e):
+    try:
+        return json.loads(e.content.decode())['error']['errors'][0]['reason']
+    except (AttributeError, ValueError, KeyError, IndexError, TypeError):
+        return None
+
+
+def _store_error(e):
+    '''Error code and HTTP status of an error returned by a store, None for any other error.'''
+    if isinstance(e, ClientError):
+        code = e.response.get('Error', {}).get('Code')
+        status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    elif isinstance(e, HttpResponseError):
+        code, status = getattr(e, 'error_code', None), e.status_code
+    elif isinstance(e, HttpError):
+        code, status = _gdrive_reason(e), getattr(e.resp, 'status', None)
+    else:
+        return None
+    try:
+        return code, int(status)
+    except (TypeError, ValueError):
+        return code, None
+
+
+def _error_headers(e):
+    if isinstance(e, ClientError):
+        return e.response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+    if isinstance(e, HttpResponseError) and e.response is not None:
+        return e.response.headers
+    if isinstance(e, HttpError):
+        # googleapiclient keeps the headers in the response itself
+        return e.resp
+    return {}
+
+
+def is_throttling_error(e):
+    error = _store_error(e)
+    if error is None:
+        return False
+    code, status = error
+    return code in THROTTLING_ERROR_CODES or status in THROTTLING_STATUS_CODES
+
+
+def is_permanent_error(e):
+    if isinstance(e, RETRYABLE_ERROR_TYPES):
+        return False
+    if isinstance(e, PERMANENT_ERROR_TYPES):
+        return True
+    error = _store_error(e)
+    if error is None:
+        return False
+    code, status = error
+    if code in RETRYABLE_ERROR_CODES or status in RETRYABLE_STATUS_CODES:
+        return False
+    # other client errors (e.g. NoSuchKey, AccessDenied, InvalidArgument) fail the same way when retried
+    return status is not None and 400 <= status < 500
+
+
+def get_retry_after(e):
+    try:
+        headers = _error_headers(e)
+        value = headers.get('retry-after', headers.get('Retry-After'))
+        return max(float(value), 0)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class RetryBudget(object):
+    '''Retries allowed to a whole pool. Every retry takes a token and every success gives back a fraction of one,
+    so a few failing objects cannot keep the pool retrying while the others succeed.'''
+
+    def __init__(self, capacity=100, refill=0.1):
+        self._capacity = capacity
+        self._tokens = capacity
+        self._refill = refill
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def success(self):
+        with self._lock:
+            self._tokens = min(self._tokens + self._refill, self._capacity)
+
+
+class RetryPolicy(object):
+    '''Decides whether a failed task is retried and how long to wait before the next attempt.
+
+    Permanent errors (missing objects, bad credentials...) fail at once. Other errors are retried up to
+    retry times, waiting the Retry-After hint sent by the store when there is one, or a random time up to
+    base * 2^attempt seconds (exponential backoff with full jitter) capped at cap seconds.'''
+
+    def __init__(self, retry=2, base=0.5, cap=20, budget=None):
+        self._retry = retry if retry >= 0 else 0
+        self._base = base
+        self._cap = cap
+        self._budget = budget
+
+    @property
+    def retry(self):
+        return self._retry
+
+    def should_retry(self, e, attempt):
+        if attempt > self._retry or is_permanent_error(e):
+            return False
+        if self._budget is not None and not self._budget.acquire():
+            log.debug('Retry budget exhausted', class_name=POOL_CLASS_NAME)
+            return False
+        return True
+
+    def wait_time(self, e, attempt):
+        retry_after = get_retry_after(e)
+        if retry_after is not None:
+            return min(retry_after, self._cap)
+        return random.uniform(0, min(self._cap, self._base * 2 ** attempt))
+
+    def success(self):
+        if self._budget is not None:
+            self._budget.success()
+
+
+class ConcurrencyController(object):
+    '''Limits the number of tasks running at the same time in a WorkerPool, in the style of AIMD.
+
+    The limit starts low and grows by one task per window while throughput keeps up and latency stays
+    close to the lowest observed. It is halved when a task fails with a throttling error or when latency
+    grows without any throughput gain.'''
+
+    def __init__(self, max_limit, initial_limit=4, min_limit=1, window=1.0):
+        self._max_limit = max(max_limit, 1)
+        self._min_limit = max(min(min_limit, self._max_limit), 1)
+        self._limit = max(min(initial_limit, self._max_limit), self._min_limit)
+        self._window = window
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._last_throughput = 0
+        self._min_latency = None
+        self._last_decrease = float('-inf')
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_start = time.monotonic()
+        self._completed = 0
+        self._latency_sum = 0
+
+    @property
+    def limit(self):
+        return self._limit
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= self._limit:
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self, latency, throttled=False):
+        with self._cond:
+            self._in_flight -= 1
+            if throttled:
+                self._decrease('throttling')
+            else:
+                self._completed += 1
+                self._latency_sum += latency
+                self._adjust()
+            self._cond.notify_all()
+
+    def _adjust(self):
+        elapsed = time.monotonic() - self._window_start
+        if elapsed < self._window or self._completed < self._limit:
+            return
+        throughput = self._completed / elapsed
+        latency = self._latency_sum / self._completed
+        if self._min_latency is None or latency < self._min_latency:
+            self._min_latency = latency
+        if latency > 2 * self._min_latency and throughput <= self._last_throughput:
+            self._decrease('latency')
+        elif self._limit < self._max_limit:
+            self._limit += 1
+            self._log_limit('increase', throughput, latency)
+        self._last_throughput = throughput
+        self._reset_window()
+
+    def _decrease(self, reason):
+        # a burst of throttling errors only counts once per window
+        now = time.monotonic()
+        if now - self._last_decrease < self._window:
+            return
+        self._last_decrease = now
+        self._limit = max(self._limit // 2, self._min_limit)
+        self._log_limit('decrease (%s)' % reason)
+        self._reset_window()
+
+    def _log_limit(self, change, throughput=None, latency=None):
+        stats = '' if throughput is None else ' -- throughput [%.1f/s] latency [%.3fs]' % (throughput, latency)
+        log.debug('Adaptive concurrency %s to [%d]%s' % (change, self._limit, stats), class_name=POOL_CLASS_NAME)
 
 
 class WorkerPool(object):
-    def __init__(self, nworkers=10, pool_ctxs=None, retry=0, pb_elts=None, pb_desc='units'):
+    def __init__(self, nworkers=10, pool_ctxs=None, retry=0, pb_elts=None, pb_desc='units', ctx_factory=None,
+                 controller=None, retry_policy=None):
         if pool_ctxs is not None and len(pool_ctxs) != nworkers:
             return None
         self._avail_ctx = pool_ctxs
+        self._ctx_factory = ctx_factory
+        if ctx_factory is not None and pool_ctxs is None:
+            self._avail_ctx = []
+        self._controller = controller
 
         nwrkrs = nworkers if nworkers > 0 else 1
+        self._nworkers = nwrkrs
         self._pool = futures.ThreadPoolExecutor(max_workers=nwrkrs)
 
         self._futures = []
-        self._retry = retry if retry >= 0 else 0
+        self._retry_policy = retry_policy if retry_policy is not None else RetryPolicy(retry)
 
         self._progress_bar = tqdm(total=pb_elts, desc=pb_desc, unit=pb_desc, unit_scale=True, mininterval=1.0) if pb_elts is not None else None
 
-    def _retry_wait(self, retry):
-        wait = 1 + 2 * random.randint(0, retry)
-        log.debug('Wait [%d] before next attempt' % wait, class_name=POOL_CLASS_NAME)
+    def _retry_wait(self, e, retry):
+        wait = self._retry_policy.wait_time(e, retry)
+        log.debug('Wait [%.2f] before next attempt' % wait, class_name=POOL_CLASS_NAME)
         time.sleep(wait)
 
-    def _submit_fn(self, userfn, *args, **kwds):
+    def _call(self, userfn, *args, **kwds):
+        if self._controller is not None:
+            self._controller.acquire()
         ctx = self._get_ctx()
+        start = time.monotonic()
+        throttled = False
+        try:
+            if ctx is not None:
+                return userfn(ctx, *args, **kwds)
+            return userfn(*args, **kwds)
+        except Exception as e:
+            throttled = is_throttling_error(e)
+            raise e
+        finally:
+            self._release_ctx(ctx)
+            if self._controller is not None:
+                self._controller.release(time.monotonic() - start, throttled)
 
+    def _submit_fn(self, userfn, *args, **kwds):
         result = False
         retry_cnt = 0
         while True:
             try:
-                if ctx is not None:
-                    result = userfn(ctx, *args, **kwds)
-                else:
-                    result = userfn(*args, **kwds)
+                result = self._call(userfn, *args, **kwds)
             except Exception as e:
-                if retry_cnt < self._retry:
+                if self._retry_policy.should_retry(e, retry_cnt + 1):
                     retry_cnt += 1
                     log.warn('Worker exception - [%s] -- retry [%d]' % (e, retry_cnt), class_name=POOL_CLASS_NAME)
-                    self._retry_wait(retry_cnt)
+                    self._retry_wait(e, retry_cnt)
                     continue
                 else:
                     log.error('Worker failure - [%s] -- [%d] attempts' % (e, retry_cnt), class_name=POOL_CLASS_NAME)
-                    self._release_ctx(ctx)
                     raise e
             break
 
         log.debug('Worker success at attempt [%d]' % (retry_cnt+1), class_name=POOL_CLASS_NAME)
-        self._release_ctx(ctx)
+        self._retry_policy.success()
         self._progress()
 
         return result
 
     def submit(self, userfn, *args, **kwds):
-        self._futures.append(self._pool.submit(self._submit_fn, userfn, *args, **kwds))
+        future = self._pool.submit(self._submit_fn, userfn, *args, **kwds)
+        self._futures.append(future)
+        return future
+
+    def imap_unordered(self, userfn, args_iterable, window=None):
+        '''Runs userfn(*args) for each args in args_iterable, with at most window tasks in flight
+        (twice the number of workers by default), and yields each future as soon as it is done.
+        args_iterable is consumed lazily and the futures are not kept by the pool, so memory does not
+        grow with the number of tasks.'''
+        window = window if window is not None else 2 * self._nworkers
+        args_iterator = iter(args_iterable)
+        pending = set()
+        try:
+            while True:
+                for args in args_iterator:
+                    pending.add(self._pool.submit(self._submit_fn, userfn, *args))
+                    if len(pending) >= window:
+                        break
+                if not pending:
+                    return
+                done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future
+        finally:
+            for future in pending:
+                future.cancel()
+            futures.wait(pending)
 
     def _get_ctx(self):
         if self._avail_ctx is not None:
-            return self._avail_ctx.pop()
+            try:
+                return self._avail_ctx.pop()
+            except IndexError:
+                if self._ctx_factory is None:
+                    raise
+                return self._ctx_factory()
 
     def _release_ctx(self, ctx):
         if ctx is not None:
@@ -5,6 +5,7 @@ SPDX-License-Identifier: GPL-2.0-only
 import errno
 import os
 import re
+from contextlib import ExitStack
 
 import humanize
 from git import InvalidGitRepositoryError, GitError
@@ -15,20 +16,24 @@ from ml_git.admin import remote_add, store_add, clone_config_repository, init_ml
 from ml_git.config import get_index_path, get_objects_path, get_cache_path, get_metadata_path, get_refs_path, \
     validate_config_spec_hash, validate_spec_hash, get_sample_config_spec, get_sample_spec_doc, \
     get_index_metadata_path, create_workspace_tree_structure, start_wizard_questions, config_load, \
-    get_global_config_path, save_global_config_in_local
+    get_global_config_path, save_global_config_in_local, get_refcounts_path, get_cache_max_bytes
 from ml_git.constants import REPOSITORY_CLASS_NAME, LOCAL_REPOSITORY_CLASS_NAME, HEAD, HEAD_1, Mutability, StoreType, \
-    RGX_TAG_FORMAT, EntityType, MANIFEST_FILE, SPEC_EXTENSION
+    RGX_TAG_FORMAT, EntityType, MANIFEST_FILE, SPEC_EXTENSION, WATCH_DIR
 from ml_git.file_system.cache import Cache
 from ml_git.file_system.hashfs import MultihashFS
 from ml_git.file_system.index import MultihashIndex, Status, FullIndex
 from ml_git.file_system.local import LocalRepository
+from ml_git.file_system.lock import LockManager
 from ml_git.file_system.objects import Objects
+from ml_git.file_system.reachable import ReachableSet
+from ml_git.file_system.refcount import RefCounts, record_written
+from ml_git.file_system.watcher import start_watcher, stop_watcher
 from ml_git.manifest import Manifest
 from ml_git.metadata import Metadata, MetadataManager
 from ml_git.ml_git_message import output_messages
 from ml_git.refs import Refs
 from ml_git.spec import spec_parse, search_spec_file, increment_version_in_spec, get_entity_tag, update_store_spec, \
-    validate_bucket_name, set_version_in_spec
+    validate_bucket_name, set_version_in_spec, get_chunking
 from ml_git.tag import UsrTag
 from ml_git.utils import yaml_load, ensure_path_exists, get_root_path, get_path_with_categories, \
     RootPathException, change_mask_for_routine, clear, get_yaml_str, unzip_files_in_directory, \
@@ -129,6 +134,9 @@ class Repository(object):
         spec_path = os.path.join(path, file)
         if not self._is_spec_valid(spec_path):
             return None
+        chunking = get_chunking(spec_path, repo_type)
+        if chunking is None:
+            return None
 
         # Check tag before anything to avoid creating unstable state
         log.debug('Repository: check if tag already exists', class_name=REPOSITORY_CLASS_NAME)
@@ -150,9 +158,13 @@ class Repository(object):
         try:
             # adds chunks to ml-git Index
             log.info('%s adding path [%s] to ml-git index' % (repo_type, path), class_name=REPOSITORY_CLASS_NAME)
-            with change_mask_for_routine(is_shared_objects):
-                idx = MultihashIndex(spec, index_path, objects_path, mutability, cache_path)
-                idx.add(path, manifest, file_path)
+            with change_mask_for_routine(is_shared_objects), repo.get_locks().shared():
+                idx = MultihashIndex(spec, index_path, objects_path, mutability, cache_path, chunking)
+                try:
+                    idx.add(path, manifest, file_path)
+                finally:
+                    # a descriptor replaced in the index by a later add is only collected by gc if recorded
+                    record_written(self.__config, idx.get_written())
 
             # create hard links in ml-git Cache
             self.create_hard_links_in_cache(cache_path, index_path, is_shared_cache, mutability, path, spec)
@@ -215,8 +227,11 @@ class Repository(object):
         mf = os.path.join(index_path, 'metadata', spec, MANIFEST_FILE)
         with change_mask_for_routine(is_shared_cache):
             if mutability in [Mutability.STRICT.value, Mutability.FLEXIBLE.value]:
-                cache = Cache(cache_path, path, mf)
-                cache.update()
+                cache = Cache(cache_path, path, mf, get_cache_max_bytes(self.__config))
+                with cache.get_locks().shared():
+                    cache.update()
+                cache.evict()
+                cache.close()
 
     def _check_corrupted_files(self, spec, repo):
         try:
@@ -364,6 +379,7 @@ class Repository(object):
         # commit objects in index to ml-git objects
         o = Objects(spec, objects_path)
         changed_files, deleted_files = o.commit_index(index_path, path)
+        self._update_refcounts(repo_type, spec)
 
         bare_mode = os.path.exists(os.path.join(index_path, 'metadata', spec, 'bare'))
 
@@ -468,7 +484,7 @@ class Repository(object):
 
     '''push all data related to a ml-git repository to the LocalRepository git repository and data store'''
 
-    def push(self, spec, retry=2, clear_on_fail=False):
+    def push(self, spec, retry=2, clear_on_fail=False, no_head=False):
         repo_type = self.__repo_type
         try:
             objects_path = get_objects_path(self.__config, repo_type)
@@ -506,7 +522,7 @@ class Repository(object):
         full_spec_path = os.path.join(spec_path, spec_file)
 
         repo = LocalRepository(self.__config, objects_path, repo_type)
-        ret = repo.push(objects_path, full_spec_path, retry, clear_on_fail)
+        ret = repo.push(objects_path, full_spec_path, retry, clear_on_fail, no_head)
 
         # ensure first we're on master !
         met.checkout()
@@ -717,6 +733,7 @@ class Repository(object):
         force_get = options['force']
         bare = options['bare']
         version = options['version']
+        paranoid = options['paranoid']
         repo_type = self.__repo_type
         try:
             cache_path = get_cache_path(self.__config, repo_type)
@@ -775,7 +792,8 @@ class Repository(object):
 
         try:
             r = LocalRepository(self.__config, objects_path, repo_type)
-            r.checkout(cache_path, metadata_path, ws_path, tag, samples, bare)
+            r.checkout(cache_path, metadata_path, ws_path, tag, samples, bare, paranoid)
+            self._update_refcounts(repo_type, spec_name)
         except OSError as e:
             self._checkout_ref()
             if e.errno == errno.ENOSPC:
@@ -886,6 +904,7 @@ class Repository(object):
             idx.remove_manifest()
             fidx.remove_from_index_yaml(file_names)
             fidx.remove_uncommitted()
+        self._update_refcounts(repo_type, spec)
 
         if reset_type == '--hard':  # reset workspace
             remove_from_workspace(file_names, path, spec)
@@ -906,6 +925,30 @@ class Repository(object):
         local.change_config_store(bucket['profile'], bucket_name, store_type, region=bucket['region'], endpoint_url=bucket['endpoint_url'])
         local.import_files(object, path, root_dir, retry, '{}://{}'.format(store_type, bucket_name))
 
+    def watch(self, spec, stop=False):
+        repo_type = self.__repo_type
+        try:
+            refs_path = get_refs_path(self.__config, repo_type)
+            index_metadata_path = get_index_metadata_path(self.__config, repo_type)
+            ref = Refs(refs_path, spec, repo_type)
+            tag, sha = ref.branch()
+            path, file = search_spec_file(repo_type, spec, get_path_with_categories(tag))
+        except Exception as e:
+            log.error(e, class_name=REPOSITORY_CLASS_NAME)
+            return
+
+        if path is None:
+            return
+
+        watch_path = os.path.join(index_metadata_path, spec, WATCH_DIR)
+        try:
+            if stop:
+                stop_watcher(watch_path)
+            else:
+                start_watcher(path, watch_path)
+        except Exception as e:
+            log.error(e, class_name=REPOSITORY_CLASS_NAME)
+
     def unlock_file(self, spec, file_path):
         repo_type = self.__repo_type
 
@@ -1079,43 +1122,189 @@ class Repository(object):
         categories_path = get_path_with_categories(tag)
         search_spec_file(repo_type, spec, categories_path)
 
+    def _full_garbage_collector(self, entities, stores, refcounts, dry_run):
+        # mark: the objects used by the indexes of all the entities and the pinned ones
+        used_blobs = ReachableSet()
+        for _, objects, cache, blobs_hashes in entities:
+            for hashes in blobs_hashes.values():
+                objects.mark_used_blobs(hashes, used_blobs)
+            objects.mark_used_blobs(self._get_pinned(objects, cache), used_blobs)
+        removed_files = 0
+        reclaimed_space = 0
+        for store in stores:
+            count_removed, reclaimed = store.garbage_collector(used_blobs, dry_run)
+            removed_files += count_removed
+            reclaimed_space += reclaimed
+        if not dry_run:
+            refcounts.rebuild([(self._refcount_owner(repo_type, spec), hashes, objects)
+                               for repo_type, objects, _, blobs_hashes in entities for spec, hashes in blobs_hashes.items()])
+        return removed_files, reclaimed_space
+
+    def _incremental_garbage_collector(self, entities, stores, refcounts, dry_run):
+        # the indexes changed by commands that do not update the counts (e.g. add) are taken into account first
+        owners = set()
+        for repo_type, objects, _, blobs_hashes in entities:
+            for spec, hashes in blobs_hashes.items():
+                owner = self._refcount_owner(repo_type, spec)
+                owners.add(owner)
+                refcounts.update_roots(owner, hashes, objects)
+        for owner in refcounts.owners() - owners:
+            # entity deleted since the last gc
+            repo_type = owner.split('/')[0]
+            refcounts.update_roots(owner, [], MultihashFS(get_objects_path(self.__config, repo_type)))
+        refcounts.count_pending([objects for _, objects, _, _ in entities])
+        pinned = set()
+        for _, objects, cache, _ in entities:
+            objects.mark_used_blobs(self._get_pinned(objects, cache), pinned)
+        unused = set(refcounts.candidates())
+        # objects written without being used by any index (e.g. fetched and abandoned) have no count
+        unused.update(refcounts.unrecorded([objects for _, objects, _, _ in entities]))
+        unused = [key for key in unused if key not in pinned]
+        log.debug('%d objects not used anymore since the last gc' % len(unused), class_name=REPOSITORY_CLASS_NAME)
+        removed_files = 0
+        reclaimed_space = 0
+        for store in stores:
+            count_removed, reclaimed = store.remove_keys(unused, dry_run)
+            removed_files += count_removed
+            reclaimed_space += reclaimed
+        if not dry_run:
+            refcounts.forget(unused)
+        return removed_files, reclaimed_space
+
+    @staticmethod
+    def _get_pinned(objects, cache):
+        return objects.get_locks().pinned() | cache.get_locks().pinned()
+
     def _get_blobs_hashes(self, index_path, objects_path, repo_type):
-        blobs_hashes = []
+        '''Descriptors used by the index of each entity, by entity name.'''
+        blobs_hashes = {}
         for root, dirs, files in os.walk(os.path.join(index_path, 'metadata')):
             for spec in dirs:
                 try:
                     self._check_is_valid_entity(repo_type, spec)
                     idx = MultihashIndex(spec, index_path, objects_path)
-                    blobs_hashes.extend(idx.get_hashes_list())
+                    blobs_hashes[spec] = idx.get_hashes_list()
                 except Exception:
                     log.debug(output_messages['INFO_ENTITY_DELETED'] % spec, class_name=REPOSITORY_CLASS_NAME)
         return blobs_hashes
 
-    def garbage_collector(self):
+    @staticmethod
+    def _refcount_owner(repo_type, spec):
+        return '%s/%s' % (repo_type, spec)
+
+    def _update_refcounts(self, repo_type, spec):
+        # reference counts are only kept once a full gc built them, gc brings them up to date anyway
+        refcounts_path = get_refcounts_path(self.__config)
+        if not os.path.exists(refcounts_path):
+            return
+        refcounts = RefCounts(refcounts_path)
+        try:
+            if refcounts.is_initialized():
+                index_path = get_index_path(self.__config, repo_type)
+                objects_path = get_objects_path(self.__config, repo_type)
+                hashes = MultihashIndex(spec, index_path, objects_path).get_hashes_list()
+                refcounts.update_roots(self._refcount_owner(repo_type, spec), hashes, MultihashFS(objects_path))
+        except Exception as e:
+            log.debug('Could not update the reference counts of [%s]: %s' % (spec, e), class_name=REPOSITORY_CLASS_NAME)
+        finally:
+            refcounts.close()
+
+    def repack(self):
         any_metadata = False
-        removed_files = 0
+        packed_objects = 0
         reclaimed_space = 0
         for entity in EntityType:
             repo_type = entity.value
             if self.metadata_exists(repo_type):
-                log.info(output_messages['INFO_STARTING_GC'] % repo_type, class_name=REPOSITORY_CLASS_NAME)
+                log.info(output_messages['INFO_STARTING_REPACK'] % repo_type, class_name=REPOSITORY_CLASS_NAME)
                 any_metadata = True
+                objects = MultihashFS(get_objects_path(self.__config, repo_type))
+                with objects.get_locks().exclusive():
+                    count_packed_objects, reclaimed_objects_space = objects.repack()
+                packed_objects += count_packed_objects
+                reclaimed_space += reclaimed_objects_space
+        if not any_metadata:
+            log.error(output_messages['ERROR_UNINITIALIZED_METADATA'], class_name=REPOSITORY_CLASS_NAME)
+            return
+        log.info(output_messages['INFO_PACKED_OBJECTS'] % (humanize.intword(packed_objects),
+                                                           os.path.join(get_root_path(), '.ml-git')),
+                 class_name=REPOSITORY_CLASS_NAME)
+        log.info(output_messages['INFO_RECLAIMED_SPACE'] % humanize.naturalsize(reclaimed_space),
+                 class_name=REPOSITORY_CLASS_NAME)
+
+    def garbage_collector(self, dry_run=False, full=False):
+        entities = []
+        for entity in EntityType:
+            repo_type = entity.value
+            if self.metadata_exists(repo_type):
+                log.info(output_messages['INFO_STARTING_GC'] % repo_type, class_name=REPOSITORY_CLASS_NAME)
                 index_path = get_index_path(self.__config, repo_type)
                 objects_path = get_objects_path(self.__config, repo_type)
-                blobs_hashes = self._get_blobs_hashes(index_path, objects_path, repo_type)
-
-                cache = Cache(get_cache_path(self.__config, repo_type))
-                count_removed_cache, reclaimed_cache_space = cache.garbage_collector(blobs_hashes)
-                objects = Objects('', objects_path)
-                count_removed_objects, reclaimed_objects_space = objects.garbage_collector(blobs_hashes)
-
-                reclaimed_space += reclaimed_objects_space + reclaimed_cache_space
-                removed_files += count_removed_objects + count_removed_cache
-        if not any_metadata:
+                entities.append((repo_type, Objects('', objects_path), Cache(get_cache_path(self.__config, repo_type)),
+                                 self._get_blobs_hashes(index_path, objects_path, repo_type)))
+        if not entities:
             log.error(output_messages['ERROR_UNINITIALIZED_METADATA'], class_name=REPOSITORY_CLASS_NAME)
             return
+        # cache and objects paths can be shared by entities, each directory is swept once
+        stores = {}
+        for _, objects, cache, _ in entities:
+            stores.setdefault(os.path.realpath(cache._path), cache)
+            stores.setdefault(os.path.realpath(objects._path), objects)
+        refcounts = RefCounts(get_refcounts_path(self.__config))
+        try:
+            with ExitStack() as locks:
+                # waits for the commands of other processes using the stores, new ones wait for gc
+                for path in sorted(stores):
+                    locks.enter_context(stores[path].get_locks().exclusive())
+                if full or not refcounts.is_initialized():
+                    removed_files, reclaimed_space = self._full_garbage_collector(entities, stores.values(), refcounts,
+                                                                                  dry_run)
+                else:
+                    removed_files, reclaimed_space = self._incremental_garbage_collector(entities, stores.values(),
+                                                                                         refcounts, dry_run)
+        finally:
+            refcounts.close()
+        if dry_run:
+            log.info(output_messages['INFO_RECLAIMABLE_SPACE'] % (humanize.intword(removed_files),
+                                                                  os.path.join(get_root_path(), '.ml-git'),
+                                                                  humanize.naturalsize(reclaimed_space)),
+                     class_name=REPOSITORY_CLASS_NAME)
+            return
         log.info(output_messages['INFO_REMOVED_FILES'] % (humanize.intword(removed_files),
                                                           os.path.join(get_root_path(), '.ml-git')),
                  class_name=REPOSITORY_CLASS_NAME)
         log.info(output_messages['INFO_RECLAIMED_SPACE'] % humanize.naturalsize(reclaimed_space),
                  class_name=REPOSITORY_CLASS_NAME)
+
+    def _get_stores_paths(self):
+        repo_type = self.__repo_type
+        return [(get_objects_path(self.__config, repo_type), 'objects_path' in self.__config[repo_type]),
+                (get_cache_path(self.__config, repo_type), 'cache_path' in self.__config[repo_type])]
+
+    def pin(self, tag):
+        '''Keeps the objects of tag in the local objects and cache through gc and cache eviction, until unpinned.'''
+        try:
+            metadata_path = get_metadata_path(self.__config, self.__repo_type)
+            m = Metadata('', metadata_path, self.__config, self.__repo_type)
+            keys = list(yaml_load(self._get_current_manifest_file(m, tag)))
+        except Exception as e:
+            log.error(e, class_name=REPOSITORY_CLASS_NAME)
+            return False
+        for path, is_shared in self._get_stores_paths():
+            with change_mask_for_routine(is_shared):
+                locks = LockManager(path)
+                # a gc in progress is waited for, the next ones keep the objects
+                with locks.shared():
+                    locks.pin(tag, keys)
+        log.info(output_messages['INFO_PINNED_TAG'] % tag, class_name=REPOSITORY_CLASS_NAME)
+        return True
+
+    def unpin(self, tag):
+        unpinned = False
+        for path, _ in self._get_stores_paths():
+            unpinned = LockManager(path).unpin(tag) or unpinned
+        if not unpinned:
+            log.error(output_messages['ERROR_TAG_NOT_PINNED'] % tag, class_name=REPOSITORY_CLASS_NAME)
+            return False
+        log.info(output_messages['INFO_UNPINNED_TAG'] % tag, class_name=REPOSITORY_CLASS_NAME)
+        return True
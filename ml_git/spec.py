@@ -7,7 +7,7 @@ import os
 
 from ml_git import log
 from ml_git import utils
-from ml_git.constants import ML_GIT_PROJECT_NAME, SPEC_EXTENSION
+from ml_git.constants import ML_GIT_PROJECT_NAME, SPEC_EXTENSION, CHUNKING, Chunking
 from ml_git.utils import get_root_path, yaml_load
 
 
@@ -82,6 +82,16 @@ def get_version(file, repotype='dataset'):
         return -1
 
 
+def get_chunking(file, repotype='dataset'):
+    spec_hash = utils.yaml_load(file)
+    chunking = spec_hash.get(repotype, {}).get(CHUNKING, Chunking.FIXED.value)
+    if chunking not in Chunking.list():
+        log.error('Invalid chunking [%s], it should be one of %s.  File:\n     %s' % (chunking, Chunking.list(), file),
+                  class_name=ML_GIT_PROJECT_NAME)
+        return None
+    return chunking
+
+
 """Validate the version inside the dataset specification file hash can be located and is an int."""
 
 
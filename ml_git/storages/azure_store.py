@@ -5,7 +5,9 @@ SPDX-License-Identifier: GPL-2.0-only
 
 import os
 
+import requests
 import toml
+from azure.core.pipeline.transport import RequestsTransport
 from azure.storage.blob import BlobServiceClient, ContainerClient
 from ml_git import log
 from ml_git.constants import AZURE_STORE_NAME, StoreType
@@ -14,17 +16,29 @@ from ml_git.storages.store import Store
 
 
 class AzureMultihashStore(Store, MultihashStore):
-    def __init__(self, bucket_name, bucket):
+    def __init__(self, bucket_name, bucket, max_pool_connections=None):
         self._bucket = bucket_name
         self._store_type = StoreType.AZUREBLOBH.value
         self._account = self.get_account()
+        self._max_pool_connections = max_pool_connections
         super().__init__()
 
+    def _get_transport(self):
+        if self._max_pool_connections is None:
+            return {}
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self._max_pool_connections)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return {'transport': RequestsTransport(session=session, session_owner=False)}
+
     def connect(self):
         log.debug('Connect - Storage [%s] ;' % self._store_type,
                   class_name=AZURE_STORE_NAME)
         try:
-            self._store = BlobServiceClient.from_connection_string(self._account, connection_timeout=300)
+            # the service client is thread safe, clones of this store share it and its connection pool
+            self._store = BlobServiceClient.from_connection_string(self._account, connection_timeout=300,
+                                                                   **self._get_transport())
         except Exception:
             raise RuntimeError('Unable to connect to the Azure storage.')
 
@@ -38,7 +52,7 @@ class AzureMultihashStore(Store, MultihashStore):
             return False
 
     def put(self, key_path, file_path):
-        if self.key_exists(key_path) is True:
+        if self.remote_key_exists(key_path) is True:
             log.debug('Object [%s] already in Azure store' % key_path, class_name=AZURE_STORE_NAME)
             return True
         if not os.path.exists(file_path):
@@ -52,12 +66,17 @@ class AzureMultihashStore(Store, MultihashStore):
         except Exception as e:
             if 'The specified blob already exists.' in str(e):
                 log.debug('The specified blob [%s] already exists.' % key_path)
+                self.remote_key_added(key_path)
                 return key_path
             raise e
+        self.remote_key_added(key_path)
         return key_path
 
     def get(self, file_path, reference):
         try:
+            packed = self.get_packed(file_path, reference)
+            if packed is not None:
+                return packed
             blob_client = self._store.get_blob_client(container=self._bucket, blob=reference)
             with open(file_path, 'wb') as download_file:
                 data = blob_client.download_blob().readall()
@@ -69,12 +88,30 @@ class AzureMultihashStore(Store, MultihashStore):
             return False
         return True
 
+    def get_object(self, key_path):
+        data = self.read_packed(key_path)
+        if data is not None:
+            return data
+        blob_client = self._store.get_blob_client(container=self._bucket, blob=key_path)
+        return blob_client.download_blob().readall()
+
+    def get_range(self, key_path, offset, size):
+        blob_client = self._store.get_blob_client(container=self._bucket, blob=key_path)
+        return blob_client.download_blob(offset=offset, length=size).readall()
+
     def list_files_from_path(self, path):
         bucket_response = self._store.create_container(path)
         log.info('\nListing blobs in container:' + path)
         blob_list = bucket_response.list_blobs()
         return blob_list
 
+    def list_keys(self, prefix=''):
+        log.debug('List - listing keys with prefix [%s] from container [%s]' % (prefix, self._bucket),
+                  class_name=AZURE_STORE_NAME)
+        container_client = self._store.get_container_client(self._bucket)
+        for page in container_client.list_blobs(name_starts_with=prefix or None).by_page():
+            yield [blob.name for blob in page]
+
     def get_account(self):
         connection_string = os.getenv('AZURE_STORAGE_CONNECTION_STRING')
         if connection_string is not None:
@@ -42,13 +42,22 @@ class GoogleDriveStore(Store):
         except Exception as e:
             log.error(e, class_name=GDRIVE_STORE)
 
+    def clone(self):
+        # the drive service is not thread safe, only the credentials are shared
+        store = super().clone()
+        try:
+            store._store = build('drive', 'v3', credentials=self.credentials)
+        except Exception as e:
+            log.error(e, class_name=GDRIVE_STORE)
+        return store
+
     def put(self, key_path, file_path):
 
         if not self.drive_path_id:
             log.error('Drive path [%s] not found.' % self._drive_path, class_name=GDRIVE_STORE)
             return False
 
-        if self.key_exists(key_path):
+        if self.remote_key_exists(key_path):
             log.debug('Key path [%s] already exists in drive path [%s].' % (key_path, self._drive_path), class_name=GDRIVE_STORE)
             return True
 
@@ -63,6 +72,7 @@ class GoogleDriveStore(Store):
         except Exception:
             raise RuntimeError('The file could not be uploaded: [%s]' % file_path, class_name=GDRIVE_STORE)
 
+        self.remote_key_added(key_path)
         return True
 
     def get(self, file_path, reference):
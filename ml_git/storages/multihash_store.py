@@ -13,6 +13,26 @@ from multihash import multihash
 
 class MultihashStore(object):
 
+    def read_packed(self, key_path):
+        remote_packs = getattr(self, '_remote_packs', None)
+        location = remote_packs.get(key_path) if remote_packs is not None else None
+        if location is None:
+            return None
+        pack_key, offset, size = location
+        log.debug('Reading [%s] from remote pack [%s]' % (key_path, pack_key), class_name=MULTI_HASH_STORE_NAME)
+        return self.get_range(pack_key, offset, size)
+
+    def get_packed(self, file_path, key_path):
+        '''Downloads key_path with a ranged GET of its remote pack, returns None if it is not in a pack.'''
+        data = self.read_packed(key_path)
+        if data is None:
+            return None
+        if not self.check_integrity(key_path, self.digest(data)):
+            return False
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        return True
+
     def digest(self, data):
         m = hashlib.sha256()
         m.update(data)
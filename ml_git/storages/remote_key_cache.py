@@ -0,0 +1,50 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+from ml_git.file_system.db import open_db
+
+
+class RemoteKeyCache(object):
+    '''Persistent set of the keys known to be present in a store, keyed by store URI (e.g. s3h://mlgit-datasets).
+
+    Keys are only added after a successful upload or existence check, so a push interrupted
+    midway does not need to check again the objects that were already sent.'''
+
+    def __init__(self, db_path, store_uri):
+        self._store_uri = store_uri
+        self._db = open_db(db_path)
+        with self._db.transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS remote_keys (store TEXT, key TEXT, PRIMARY KEY (store, key)) '
+                       'WITHOUT ROWID')
+
+    def exists(self, key):
+        row = self._db.fetchone('SELECT 1 FROM remote_keys WHERE store = ? AND key = ?', (self._store_uri, key))
+        return row is not None
+
+    def __contains__(self, key):
+        return self.exists(key)
+
+    def add(self, key):
+        with self._db.transaction() as db:
+            db.execute('INSERT OR IGNORE INTO remote_keys (store, key) VALUES (?, ?)', (self._store_uri, key))
+
+    def remove(self, key):
+        with self._db.transaction() as db:
+            db.execute('DELETE FROM remote_keys WHERE store = ? AND key = ?', (self._store_uri, key))
+
+    def clear(self):
+        with self._db.transaction() as db:
+            db.execute('DELETE FROM remote_keys WHERE store = ?', (self._store_uri,))
+
+    def update(self, present, missing):
+        # keys found missing by a listing of the store were removed from it in the meantime
+        with self._db.transaction() as db:
+            db.executemany('INSERT OR IGNORE INTO remote_keys (store, key) VALUES (?, ?)',
+                           ((self._store_uri, key) for key in present))
+            db.executemany('DELETE FROM remote_keys WHERE store = ? AND key = ?',
+                           ((self._store_uri, key) for key in missing))
+
+    def close(self):
+        self._db.close()
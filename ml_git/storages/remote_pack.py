@@ -0,0 +1,90 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import json
+import os
+import shutil
+import threading
+import uuid
+
+from ml_git import log
+from ml_git.constants import MULTI_HASH_STORE_NAME
+from ml_git.storages.multihash_store import MultihashStore
+from ml_git.utils import ensure_path_exists, json_load
+
+REMOTE_PACKS_PREFIX = 'packs/'
+PACK_SUFFIX = '.pack'
+INDEX_SUFFIX = '.idx'
+
+
+def supports_remote_packs(store):
+    # stores able to download a byte range of an object (get_range) can read the objects pushed in remote packs
+    return isinstance(store, MultihashStore) and hasattr(store, 'get_range')
+
+
+def new_pack_key():
+    return REMOTE_PACKS_PREFIX + uuid.uuid4().hex
+
+
+def write_pack(pack_path, index_path, objects):
+    '''Writes the (cid, data) pairs of objects one after the other in pack_path,
+    and their offset and size ({cid: [offset, size]}) in index_path.'''
+    index = {}
+    with open(pack_path, 'wb') as pack:
+        for cid, data in objects:
+            index[cid] = [pack.tell(), len(data)]
+            pack.write(data)
+    with open(index_path, 'w') as f:
+        json.dump(index, f)
+    return index
+
+
+class RemotePackIndex(object):
+    '''Location (pack key, offset, size) of the objects pushed in remote packs.
+
+    Each remote pack (packs/<id>.pack) has an index (packs/<id>.idx) with the offset and size of its objects.
+    Indexes never change once uploaded, so each one is downloaded only once and kept in cache_path.'''
+
+    def __init__(self, cache_path):
+        self._cache_path = cache_path
+        self._objects = {}
+        self._lock = threading.Lock()
+        ensure_path_exists(cache_path)
+
+    def load(self, store):
+        pages = store.list_keys(REMOTE_PACKS_PREFIX)
+        if pages is None:
+            return self
+        for key in (key for page in pages for key in page):
+            if not key.endswith(INDEX_SUFFIX):
+                continue
+            index_path = os.path.join(self._cache_path, os.path.basename(key))
+            if not os.path.exists(index_path):
+                log.debug('Downloading pack index [%s]' % key, class_name=MULTI_HASH_STORE_NAME)
+                tmp_path = index_path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(store.get_object(key))
+                os.replace(tmp_path, index_path)
+            self._add(key[:-len(INDEX_SUFFIX)] + PACK_SUFFIX, json_load(index_path))
+        log.debug('Loaded [%d] objects from remote packs' % len(self._objects), class_name=MULTI_HASH_STORE_NAME)
+        return self
+
+    def _add(self, pack_key, index):
+        with self._lock:
+            for cid, (offset, size) in index.items():
+                self._objects[cid] = (pack_key, offset, size)
+
+    def add_pack(self, pack_key, index, index_path):
+        shutil.copyfile(index_path, os.path.join(self._cache_path, os.path.basename(pack_key)[:-len(PACK_SUFFIX)] + INDEX_SUFFIX))
+        self._add(pack_key, index)
+
+    def get(self, cid):
+        return self._objects.get(cid)
+
+    def __contains__(self, cid):
+        return cid in self._objects
+
+    def __len__(self):
+        return len(self._objects)
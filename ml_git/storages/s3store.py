@@ -3,8 +3,10 @@
 SPDX-License-Identifier: GPL-2.0-only
 """
 
+import collections
 import hashlib
 import os
+from concurrent import futures
 from pprint import pprint
 
 import boto3
@@ -17,30 +19,46 @@ from ml_git.constants import STORE_FACTORY_CLASS_NAME, S3STORE_NAME, S3_MULTI_HA
 from ml_git.ml_git_message import output_messages
 from ml_git.storages.multihash_store import MultihashStore
 from ml_git.storages.store import Store
+from ml_git.utils import tmp_file_path
 
 
 class S3Store(Store):
-    def __init__(self, bucket_name, bucket):
+    # objects larger than a part are downloaded with parallel ranged GETs, by threads shared with the clones of the store
+    _download_part_size = 8 * 1024 * 1024
+    _download_threads = 8
+    # botocore default size of the connection pool
+    _default_pool_connections = 10
+
+    def __init__(self, bucket_name, bucket, max_pool_connections=None):
         self._store_type = 'S3'
         self._profile = bucket['aws-credentials']['profile']
         self._region = get_key('region', bucket)
         self._minio_url = get_key('endpoint-url', bucket)
         self._bucket = bucket_name
+        self._max_pool_connections = max_pool_connections
+        # the ranged GETs of all the workers together do not use more connections than the pool has
+        self._download_workers = min(self._download_threads, max_pool_connections or self._default_pool_connections)
+        self._download_executor = futures.ThreadPoolExecutor(max_workers=self._download_workers)
         super(S3Store, self).__init__()
 
     def connect(self):
         log.debug('Connect - profile [%s] ; region [%s]' % (self._profile, self._region), class_name=S3STORE_NAME)
-        self._session = boto3.Session(profile_name=self._profile, region_name=self._region)
+        session = boto3.Session(profile_name=self._profile, region_name=self._region)
+        config = {}
+        if self._max_pool_connections is not None:
+            config['max_pool_connections'] = self._max_pool_connections
+        # a botocore client (unlike a boto3 resource) is thread safe, so clones of this store can share it
         if self._minio_url != '':
             log.debug('Connecting to [%s]' % self._minio_url, class_name=STORE_FACTORY_CLASS_NAME)
-            self._store = self._session.resource(StoreType.S3.value, endpoint_url=self._minio_url,
-                                                 config=Config(signature_version='s3v4'))
+            self._client = session.client(StoreType.S3.value, endpoint_url=self._minio_url,
+                                          config=Config(signature_version='s3v4', **config))
         else:
-            self._store = self._session.resource(StoreType.S3.value)
+            self._client = session.client(StoreType.S3.value, config=Config(**config))
+        self._store = self._client
 
     def bucket_exists(self):
         try:
-            self._store.meta.client.head_bucket(Bucket=self._bucket)
+            self._client.head_bucket(Bucket=self._bucket)
             return True
         except ClientError as e:
             error_msg = e.response['Error']['Message']
@@ -57,10 +75,9 @@ class S3Store(Store):
         return ''.join([bucket_prefix, str(uuid.uuid4())])
 
     def create_bucket(self, bucket_prefix):
-        s3_connection = self._store
-        current_region = self._session.region_name
+        current_region = self._client.meta.region_name
         bucket_name = self.create_bucket_name(bucket_prefix)
-        bucket_response = s3_connection.create_bucket(
+        bucket_response = self._client.create_bucket(
             Bucket=bucket_name,
             CreateBucketConfiguration={'LocationConstraint': current_region})
         return bucket_name, bucket_response
@@ -71,12 +88,9 @@ class S3Store(Store):
         return keyfile
 
     def key_exists(self, key_path):
-        bucket = self._bucket
-        s3_resource = self._store
-
         object_found = True
         try:
-            s3_resource.Bucket(bucket).Object(key_path).load()
+            self._client.head_object(Bucket=self._bucket, Key=key_path)
         except ClientError as e:
             if e.response['Error']['Code'] == '404':
                 object_found = False
@@ -87,10 +101,9 @@ class S3Store(Store):
 
     def put(self, key_path, file_path):
         bucket = self._bucket
-        s3_resource = self._store
         self.key_exists(key_path)
-        res = s3_resource.Bucket(bucket).Object(key_path).put(file_path, Body=open(file_path,
-                                                                                   'rb'))  # TODO :test for errors here!!!
+        with open(file_path, 'rb') as f:
+            res = self._client.put_object(Bucket=bucket, Key=key_path, Body=f)  # TODO :test for errors here!!!
         pprint(res)
         try:
             version = res['VersionId']
@@ -103,9 +116,7 @@ class S3Store(Store):
         return self._to_uri(key_path, version)
 
     def put_object(self, file_path, object):
-        bucket = self._bucket
-        s3_resource = self._store
-        s3_resource.Object(bucket, file_path).put(Body=object)
+        self._client.put_object(Bucket=self._bucket, Key=file_path, Body=object)
 
     @staticmethod
     def _to_file(uri):
@@ -128,31 +139,77 @@ class S3Store(Store):
         return self._get(file_path, key, version=version)
 
     def get_object(self, key_path):
-        bucket = self._bucket
-        s3_resource = self._store
-
         if not self.key_exists(key_path):
             raise RuntimeError('Object [%s] not found' % key_path)
 
-        res = s3_resource.Object(bucket, key_path).get()
+        res = self._client.get_object(Bucket=self._bucket, Key=key_path)
         return res['Body'].read()
 
+    def _get_range(self, key_path, start, end, etag, version=None):
+        args = {'Bucket': self._bucket, 'Key': key_path, 'Range': 'bytes=%d-%d' % (start, end), 'IfMatch': etag}
+        if version is not None:
+            args['VersionId'] = version
+        return self._client.get_object(**args)['Body'].read()
+
+    @staticmethod
+    def _md5_etag(head):
+        # the ETag is the MD5 of the content only for single part uploads without SSE-KMS/SSE-C
+        etag = head['ETag'].strip('"')
+        if '-' in etag or head.get('ServerSideEncryption') == 'aws:kms' or 'SSECustomerAlgorithm' in head:
+            return None
+        return etag
+
     def _get(self, file, key_path, version=None):
         bucket = self._bucket
-        s3_resource = self._store
+        args = {'Bucket': bucket, 'Key': key_path}
         if version is not None:
-            res = s3_resource.Object(bucket, key_path).get(VersionId=version)
-            r = res['Body']
-            log.debug('Get - downloading [%s], version [%s], from bucket [%s] into file [%s]'
-                      % (key_path, version, bucket, file), class_name=S3STORE_NAME)
-            with open(file, 'wb') as f:
-                while True:
-                    chunk = r.read(1024)
-                    if not chunk:
-                        break
-                    f.write(chunk)
-        else:
-            return s3_resource.Object(bucket, key_path).download_file(file)
+            args['VersionId'] = version
+        head = self._client.head_object(**args)
+        size = head['ContentLength']
+        log.debug('Get - downloading [%s], version [%s], from bucket [%s] into file [%s]'
+                  % (key_path, version, bucket, file), class_name=S3STORE_NAME)
+
+        # written next to file and renamed once checked, a failed download never leaves a file behind
+        tmp_path = tmp_file_path(file)
+        m = hashlib.md5()
+        try:
+            with open(tmp_path, 'wb') as f:
+                if size <= self._download_part_size:
+                    self._write_part(f, m, self._client.get_object(IfMatch=head['ETag'], **args)['Body'].read())
+                else:
+                    self._get_parts(f, m, key_path, size, head['ETag'], version)
+            etag = self._md5_etag(head)
+            if etag is not None and m.hexdigest() != etag:
+                log.error('Get - corrupted download of [%s] from bucket [%s]' % (key_path, bucket),
+                          class_name=S3STORE_NAME)
+                return False
+            os.replace(tmp_path, file)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        return True
+
+    def _get_parts(self, f, m, key_path, size, etag, version):
+        part_size = self._download_part_size
+        max_pending = 2 * self._download_workers
+        pending = collections.deque()
+        try:
+            # parts are written (and hashed) in order, at most 2 parts per thread are kept in memory
+            for start in range(0, size, part_size):
+                pending.append(self._download_executor.submit(self._get_range, key_path, start,
+                                                              min(start + part_size, size) - 1, etag, version))
+                if len(pending) >= max_pending:
+                    self._write_part(f, m, pending.popleft().result())
+            while pending:
+                self._write_part(f, m, pending.popleft().result())
+        finally:
+            for future in pending:
+                future.cancel()
+
+    @staticmethod
+    def _write_part(f, m, data):
+        m.update(data)
+        f.write(data)
 
     def delete(self, file_path, reference):
         key, version = self._to_file(reference)
@@ -160,41 +217,38 @@ class S3Store(Store):
 
     def _delete(self, key_path, version=None):
         bucket = self._bucket
-        s3_resource = self._store
         log.debug('Delete - deleting [%s] with version [%s] from bucket [%s]' % (key_path, version, bucket),
                   class_name=S3STORE_NAME)
         if version is not None:
-            s3_resource.Object(bucket, key_path).delete(VersionId=version)
+            self._client.delete_object(Bucket=bucket, Key=key_path, VersionId=version)
         else:
-            return s3_resource.Object(bucket, key_path).delete()
+            return self._client.delete_object(Bucket=bucket, Key=key_path)
 
     def list_files_from_path(self, path):
-        bucket = self._bucket
-        s3_resource = self._store
-        res = s3_resource.Bucket(bucket)
-
-        if path:
-            files = [object.key for object in res.objects.filter(Prefix=path + '/')]
-        else:
-            files = [object.key for object in res.objects.all()]
+        prefix = path + '/' if path else ''
+        paginator = self._client.get_paginator('list_objects_v2')
+        files = [obj['Key'] for page in paginator.paginate(Bucket=self._bucket, Prefix=prefix) for obj in page.get('Contents', [])]
 
         return list(filter(lambda file: file[-1] != '/', files))
 
+    def list_keys(self, prefix=''):
+        log.debug('List - listing keys with prefix [%s] from bucket [%s]' % (prefix, self._bucket), class_name=S3STORE_NAME)
+        paginator = self._client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self._bucket, Prefix=prefix):
+            yield [obj['Key'] for obj in page.get('Contents', [])]
+
 
 class S3MultihashStore(S3Store, MultihashStore):
-    def __init__(self, bucket_name, bucket, blocksize=256 * 1024):
+    def __init__(self, bucket_name, bucket, blocksize=256 * 1024, max_pool_connections=None):
         self._blk_size = blocksize
         if blocksize < 64 * 1024:
             self._blk_size = 64 * 1024
         if blocksize > 1024 * 1024:
             self._blk_size = 1024 * 1024
-        super(S3MultihashStore, self).__init__(bucket_name, bucket)
+        super(S3MultihashStore, self).__init__(bucket_name, bucket, max_pool_connections)
 
     def put(self, key_path, file_path):
-        bucket = self._bucket
-        s3_resource = self._store
-
-        if self.key_exists(key_path) is True:
+        if self.remote_key_exists(key_path) is True:
             log.debug('Object [%s] already in S3 store' % key_path, class_name=S3STORE_NAME)
             return True
 
@@ -203,17 +257,30 @@ class S3MultihashStore(S3Store, MultihashStore):
             return False
 
         with open(file_path, 'rb') as f:
-            s3_resource.Bucket(bucket).Object(key_path).put(file_path, Body=f)  # TODO :test for errors here!!!
+            self._client.put_object(Bucket=self._bucket, Key=key_path, Body=f)
+        self.remote_key_added(key_path)
         return key_path
 
     def get(self, file_path, key_path):
+        packed = self.get_packed(file_path, key_path)
+        if packed is not None:
+            return packed
         return self._get(file_path, key_path)
 
+    def get_object(self, key_path):
+        data = self.read_packed(key_path)
+        if data is not None:
+            return data
+        return super(S3MultihashStore, self).get_object(key_path)
+
+    def get_range(self, key_path, offset, size):
+        res = self._client.get_object(Bucket=self._bucket, Key=key_path, Range='bytes=%d-%d' % (offset, offset + size - 1))
+        return res['Body'].read()
+
     def _get(self, file, key_path):
         bucket = self._bucket
-        s3_resource = self._store
 
-        res = s3_resource.Object(bucket, key_path).get()
+        res = self._client.get_object(Bucket=bucket, Key=key_path)
         c = res['Body']
         log.debug(
             'Get - downloading [%s] from bucket [%s] into file [%s]' % (key_path, bucket, file),
@@ -241,6 +308,5 @@ class S3MultihashStore(S3Store, MultihashStore):
 
     def _delete(self, key_path):
         bucket = self._bucket
-        s3_resource = self._store
         log.debug('Delete - deleting [%s] from bucket [%s]' % (key_path, bucket), class_name=S3_MULTI_HASH_STORE_NAME)
-        return s3_resource.Object(bucket, key_path).delete()
+        return self._client.delete_object(Bucket=bucket, Key=key_path)
@@ -4,10 +4,16 @@ SPDX-License-Identifier: GPL-2.0-only
 """
 
 import abc
+import copy
 import os
 
 
 class Store(abc.ABC):
+    _remote_keys = None
+    _no_head = False
+    _missing_keys = None
+    _remote_packs = None
+
     def __init__(self):
         self.connect()
         if self._store is None:
@@ -41,6 +47,64 @@ class Store(abc.ABC):
         """
         pass
 
+    def clone(self):
+        """
+        Method to create another store for the same bucket sharing the connection of this one.
+
+        :return: store.
+        """
+        store = copy.copy(self)
+        store._remote_keys = None
+        store._no_head = False
+        store._missing_keys = None
+        store._remote_packs = None
+        return store
+
+    def set_remote_keys(self, remote_keys, no_head=False, missing_keys=None):
+        """
+        Method to set the cache of keys known to be present in the store.
+
+        :param remote_keys: RemoteKeyCache of this store, or a set with the keys listed from it.
+        :param no_head: if True, keys not in the cache are assumed to be missing without checking the store.
+        :param missing_keys: set of keys known to be missing from the store (e.g. not in the listing of their prefix).
+        """
+        self._remote_keys = remote_keys
+        self._no_head = no_head
+        self._missing_keys = missing_keys
+
+    def set_remote_packs(self, remote_packs):
+        """
+        Method to set the index of the objects pushed in remote packs of the store.
+
+        :param remote_packs: RemotePackIndex of this store.
+        """
+        self._remote_packs = remote_packs
+
+    def remote_key_exists(self, keypath):
+        if self._remote_keys is not None and keypath in self._remote_keys:
+            return True
+        if self._remote_packs is not None and keypath in self._remote_packs:
+            return True
+        if self._no_head or (self._missing_keys is not None and keypath in self._missing_keys):
+            return False
+        exists = self.key_exists(keypath)
+        if exists:
+            self.remote_key_added(keypath)
+        return exists
+
+    def remote_key_added(self, keypath):
+        if self._remote_keys is not None:
+            self._remote_keys.add(keypath)
+
+    def list_keys(self, prefix=''):
+        """
+        Method to list the keys present in the store.
+
+        :param prefix: only keys starting with this prefix are listed.
+        :return: iterator over the pages (lists) of keys as they are listed, or None if the store does not support listing.
+        """
+        return None
+
     def store(self, key, file, path, prefix=None):
         full_path = os.sep.join([path, file])
         return self.file_store(key, full_path, prefix)
@@ -3,6 +3,9 @@
 SPDX-License-Identifier: GPL-2.0-only
 """
 
+import json
+import threading
+
 import boto3
 from botocore.exceptions import ProfileNotFound
 
@@ -12,8 +15,42 @@ from ml_git.storages.azure_store import AzureMultihashStore
 from ml_git.storages.google_drive_store import GoogleDriveMultihashStore, GoogleDriveStore
 from ml_git.storages.s3store import S3Store, S3MultihashStore
 
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _create_store(store_class, bucket_name, bucket, nworkers):
+    if nworkers is not None and issubclass(store_class, (S3Store, AzureMultihashStore)):
+        # the connection pool is shared by all the workers using this store
+        return store_class(bucket_name, bucket, max_pool_connections=nworkers)
+    return store_class(bucket_name, bucket)
+
+
+def _get_store(store_class, store_string, bucket_name, bucket, nworkers):
+    key = (store_string, json.dumps(bucket, sort_keys=True, default=str), nworkers)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _create_store(store_class, bucket_name, bucket, nworkers)
+            if store._store is None:
+                return store
+            _stores[key] = store
+    return store.clone()
+
+
+def clear_stores_cache():
+    with _stores_lock:
+        _stores.clear()
+
+
+def store_factory(config, store_string, nworkers=None):
+    """
+    Creates a store for store_string (e.g. s3h://mlgit-datasets).
 
-def store_factory(config, store_string):
+    The first store created for a store string and bucket configuration is kept for the whole process,
+    the following calls return clones of it sharing its client, credentials and connection pool.
+    nworkers is the number of threads expected to use the store at once, it sizes the connection pool.
+    """
     stores = {StoreType.S3.value: S3Store, StoreType.S3H.value: S3MultihashStore,
               StoreType.AZUREBLOBH.value: AzureMultihashStore, StoreType.GDRIVEH.value: GoogleDriveMultihashStore,
               StoreType.GDRIVE.value: GoogleDriveStore}
@@ -33,7 +70,7 @@ def store_factory(config, store_string):
                       bucket_name, store_type, config_bucket_name), class_name=STORE_FACTORY_CLASS_NAME)
             return None
         bucket = config['store'][store_type][bucket_name]
-        return stores[store_type](bucket_name, bucket)
+        return _get_store(stores[store_type], store_string, bucket_name, bucket, nworkers)
     except ProfileNotFound as pfn:
         log.error(pfn, class_name=STORE_FACTORY_CLASS_NAME)
         return None
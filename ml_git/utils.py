@@ -10,6 +10,7 @@ import shutil
 import stat
 import zipfile
 import sys
+import threading
 from contextlib import contextmanager
 from pathlib import Path, PurePath, PurePosixPath
 from stat import S_IREAD, S_IRGRP, S_IROTH, S_IWUSR
@@ -182,6 +183,17 @@ def get_file_size(path):
     return os.stat(path).st_size
 
 
+def tmp_file_path(path):
+    '''Name next to path for a file written by the calling thread, renamed to path once complete so other processes
+    never see it partially written.'''
+    return '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+
+
+def is_tmp_file(name):
+    '''Whether name is a file being written (or left over by a process that died writing it), see tmp_file_path.'''
+    return name.endswith('.tmp')
+
+
 @contextmanager
 def change_mask_for_routine(is_shared_path=False):
     if is_shared_path:
@@ -251,13 +263,17 @@ def group_files_by_path(files):
 
 
 @Halo(text='Removing unnecessary files', spinner='dots')
-def remove_unnecessary_files(filenames, path):
+def remove_unnecessary_files(filenames, path, dry_run=False, exclude=[]):
+    # filenames is tested once per file on disk, so it has to be a set (or ReachableSet) and not a list
+    if isinstance(filenames, list):
+        filenames = set(filenames)
     total_count = 0
     total_reclaimed_space = 0
-    dirs = os.listdir(path)
+    dirs = [dir for dir in os.listdir(path) if dir not in exclude]
     wp = pool_factory()
+    # each shard of the hashfs is swept by its own worker
     for dir in dirs:
-        wp.submit(remove_other_files, filenames, os.path.join(path, dir))
+        wp.submit(remove_other_files, filenames, os.path.join(path, dir), dry_run)
     futures = wp.wait()
     for future in futures:
         reclaimed_space, count = future.result()
@@ -267,7 +283,7 @@ def remove_unnecessary_files(filenames, path):
     return total_count, total_reclaimed_space
 
 
-def remove_other_files(filenames, path):
+def remove_other_files(filenames, path, dry_run=False):
     reclaimed_space = 0
     count = 0
     for root, dirs, files in os.walk(path):
@@ -275,7 +291,9 @@ def remove_other_files(filenames, path):
             if file not in filenames:
                 file_path = os.path.join(root, file)
                 reclaimed_space += Path(file_path).stat().st_size
+                count += 1
+                if dry_run:
+                    continue
                 set_write_read(file_path)
                 os.unlink(file_path)
-                count += 1
     return reclaimed_space, count
@@ -0,0 +1,90 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+
+Compares fixed-size and content-defined chunking (chunking: cdc) in a MultihashFS.
+Each file gets several versions with a few bytes inserted or removed at random offsets,
+as when a CSV gains a row or a checkpoint a field, and all versions are stored.
+The dedup ratio is the size of all versions over the size of the objects stored.
+
+    python scripts/benchmark/chunking_benchmark.py --files 4 --size 16 --versions 5
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from ml_git import log
+from ml_git.file_system.hashfs import MultihashFS
+
+
+def edit(data, rnd, edits):
+    for _ in range(edits):
+        offset = rnd.randrange(len(data))
+        if rnd.random() < 0.5:
+            data = data[:offset] + os.urandom(rnd.randint(1, 64)) + data[offset:]
+        else:
+            data = data[:offset] + data[offset + rnd.randint(1, 64):]
+    return data
+
+
+def create_files(path, count, size_mb, versions, edits):
+    os.makedirs(path)
+    rnd = random.Random(0)
+    files = []
+    for i in range(count):
+        data = os.urandom(size_mb * 1024 * 1024)
+        for version in range(versions):
+            file_path = os.path.join(path, 'file%d-v%d' % (i, version))
+            with open(file_path, 'wb') as f:
+                f.write(data)
+            files.append(file_path)
+            data = edit(data, rnd, edits)
+    return files
+
+
+def stored_size(objects_path):
+    size = 0
+    for root, dirs, files in os.walk(objects_path):
+        if 'log' in root:
+            continue
+        size += sum(os.path.getsize(os.path.join(root, file)) for file in files)
+    return size
+
+
+def run(files, objects_path, chunking):
+    shutil.rmtree(objects_path, ignore_errors=True)
+    hfs = MultihashFS(objects_path, chunking=chunking)
+    start = time.perf_counter()
+    for file in files:
+        hfs.put(file)
+    return time.perf_counter() - start, stored_size(objects_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MultihashFS chunking benchmark')
+    parser.add_argument('--files', type=int, default=4, help='number of files')
+    parser.add_argument('--size', type=int, default=16, help='size of each file in MiB')
+    parser.add_argument('--versions', type=int, default=5, help='number of versions of each file')
+    parser.add_argument('--edits', type=int, default=3, help='number of edits between versions')
+    args = parser.parse_args()
+    log.init_logger('info')
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        files = create_files(os.path.join(tmp_dir, 'data'), args.files, args.size, args.versions, args.edits)
+        objects_path = os.path.join(tmp_dir, 'objects')
+        total = sum(os.path.getsize(file) for file in files)
+        for chunking in ['fixed', 'cdc']:
+            elapsed, stored = run(files, objects_path, chunking)
+            print('%-6s %8.2fs %8.1f MiB/s  dedup ratio %5.2f' % (chunking, elapsed, total / elapsed / 1024 / 1024,
+                                                                  total / stored))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
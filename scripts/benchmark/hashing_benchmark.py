@@ -0,0 +1,69 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+
+Compares the time to hash and store files in a MultihashFS using only the
+worker threads (hash_workers_count: 1) against the process based HashEngine.
+
+    python scripts/benchmark/hashing_benchmark.py --files 200 --size 8
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from ml_git import log
+from ml_git.file_system.hash_engine import HashEngine
+from ml_git.file_system.hashfs import MultihashFS
+from ml_git.pool import pool_factory
+
+
+def create_files(path, count, size_mb):
+    os.makedirs(path)
+    files = []
+    for i in range(count):
+        file_path = os.path.join(path, 'file%d' % i)
+        with open(file_path, 'wb') as f:
+            f.write(os.urandom(size_mb * 1024 * 1024))
+        files.append(file_path)
+    return files
+
+
+def run(files, objects_path, hash_workers):
+    shutil.rmtree(objects_path, ignore_errors=True)
+    engine = HashEngine(MultihashFS(objects_path), hash_workers)
+    wp = pool_factory(pb_elts=None)
+    start = time.perf_counter()
+    for file in files:
+        wp.submit(engine.put, file)
+    for future in wp.wait():
+        future.result()
+    elapsed = time.perf_counter() - start
+    engine.shutdown()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MultihashFS hashing benchmark')
+    parser.add_argument('--files', type=int, default=200, help='number of files to hash')
+    parser.add_argument('--size', type=int, default=8, help='size of each file in MiB')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of hashing processes')
+    args = parser.parse_args()
+    log.init_logger('info')
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        files = create_files(os.path.join(tmp_dir, 'data'), args.files, args.size)
+        objects_path = os.path.join(tmp_dir, 'objects')
+        total_mb = args.files * args.size
+        for label, workers in [('threads', 1), ('processes (%d)' % args.workers, args.workers)]:
+            elapsed = run(files, objects_path, workers)
+            print('%-20s %8.2fs %10.1f MiB/s' % (label, elapsed, total_mb / elapsed))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
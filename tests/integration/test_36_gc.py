@@ -11,7 +11,7 @@ import pytest
 
 from ml_git.ml_git_message import output_messages
 from tests.integration.commands import MLGIT_COMMIT, MLGIT_PUSH, MLGIT_REPOSITORY_GC, MLGIT_CHECKOUT, MLGIT_ADD, \
-    MLGIT_INIT, MLGIT_ENTITY_INIT
+    MLGIT_INIT, MLGIT_ENTITY_INIT, MLGIT_FETCH
 from tests.integration.helper import init_repository, add_file, check_output, ERROR_MESSAGE, clear, ML_GIT_DIR
 
 
@@ -124,3 +124,19 @@ class GcAcceptanceTests(unittest.TestCase):
         self.assertNotIn(ERROR_MESSAGE, check_output(MLGIT_ENTITY_INIT % entity))
         self.assertNotIn(ERROR_MESSAGE, check_output(MLGIT_CHECKOUT % (entity, entity + '-ex --version=3')))
         self.assertTrue(os.path.exists(file))
+
+    @pytest.mark.usefixtures('start_local_git_server', 'switch_to_tmp_dir')
+    def test_08_gc_fetched_objects(self):
+        entity = 'dataset'
+        self.set_up_gc(entity)
+        self.assertIn(output_messages['INFO_STARTING_GC'] % entity, check_output(MLGIT_REPOSITORY_GC))
+        objects_path = os.path.join(self.tmp_dir, ML_GIT_DIR, entity, 'objects')
+        objects = {os.path.join(root, file) for root, _, files in os.walk(objects_path) for file in files}
+        # fetched without being checked out, no index uses them
+        self.assertNotIn(ERROR_MESSAGE, check_output(MLGIT_FETCH % (entity, entity + '-ex --version=2')))
+        fetched = {os.path.join(root, file) for root, _, files in os.walk(objects_path) for file in files} - objects
+        self.assertNotEqual(set(), fetched)
+        self.assertIn(output_messages['INFO_STARTING_GC'] % entity, check_output(MLGIT_REPOSITORY_GC))
+        for file in fetched:
+            self.assertFalse(os.path.exists(file))
+        self.assertTrue(all(os.path.exists(file) for file in objects))
@@ -9,6 +9,7 @@ import unittest
 import pytest
 
 from ml_git.file_system.cache import Cache
+from ml_git.file_system.lock import LockManager
 from ml_git.utils import yaml_save, set_write_read
 
 
@@ -27,3 +28,75 @@ class CacheTestCases(unittest.TestCase):
         st = os.stat(os.path.join(self.test_dir, data, 'think-hires.jpg'))
         self.assertTrue(st.st_nlink > 1)
         self.assertTrue(c.exists('zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u'))
+
+    def test_evict(self):
+        cache_path = os.path.join(self.tmp_dir, 'cache')
+        src_path = os.path.join(self.tmp_dir, 'src')
+        os.makedirs(src_path)
+        keys = ['zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9%d' % i for i in range(4)]
+        c = Cache(cache_path, max_bytes=250)
+        for key in keys:
+            file_path = os.path.join(src_path, key)
+            with open(file_path, 'w') as f:
+                f.write('0' * 100)
+            c.link(key, file_path, force=False)
+            os.unlink(file_path)
+        c.ilink(keys[0], os.path.join(self.tmp_dir, 'workspace', 'linked'))
+        c.touch(keys[1])
+
+        # keys[0] is linked into a workspace, keys[1] was used after keys[2] and keys[3]
+        self.assertEqual((2, 200), c.evict())
+        self.assertEqual([True, True, False, False], [c.exists(key) for key in keys])
+        self.assertEqual((0, 0), c.evict())
+        c.close()
+
+        # files already in the cache are added when the budget is set
+        os.unlink(os.path.join(cache_path, 'cache_lru.db'))
+        c = Cache(cache_path, max_bytes=100)
+        self.assertEqual((1, 100), c.evict())
+        self.assertEqual([True, False], [c.exists(key) for key in keys[:2]])
+        c.close()
+
+    def test_evict_pinned(self):
+        cache_path = os.path.join(self.tmp_dir, 'cache')
+        keys = ['zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9%d' % i for i in range(3)]
+        c = Cache(cache_path, max_bytes=200)
+        for key in keys:
+            file_path = os.path.join(self.tmp_dir, key)
+            with open(file_path, 'w') as f:
+                f.write('0' * 100)
+            c.link(key, file_path, force=False)
+            os.unlink(file_path)
+        c.get_locks().pin('dataset-ex__1', keys[:1])
+
+        # not evicted while the cache is used by another process
+        with LockManager(cache_path).shared():
+            self.assertEqual((0, 0), c.evict())
+        self.assertEqual((1, 100), c.evict())
+        self.assertEqual([True, False, True], [c.exists(key) for key in keys])
+        c.close()
+
+    def test_ilink_existing_file(self):
+        cache_path = os.path.join(self.tmp_dir, 'cache')
+        key = 'zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9A'
+        file_path = os.path.join(self.tmp_dir, 'file')
+        with open(file_path, 'w') as f:
+            f.write('cached')
+        c = Cache(cache_path)
+        c.link(key, file_path)
+        # a file added by another process in the meantime is linked instead
+        os.unlink(file_path)
+        with open(file_path, 'w') as f:
+            f.write('cached')
+        os.link(c.get_keypath(key), os.path.join(self.tmp_dir, 'other'))
+        c.link(key, file_path)
+        self.assertTrue(os.path.samefile(c.get_keypath(key), file_path))
+
+        dst_path = os.path.join(self.tmp_dir, 'workspace', 'file')
+        os.makedirs(os.path.dirname(dst_path))
+        with open(dst_path, 'w') as f:
+            f.write('old')
+        c.ilink(key, dst_path)
+        c.ilink(key, dst_path)
+        self.assertTrue(os.path.samefile(c.get_keypath(key), dst_path))
+        self.assertEqual(['file'], os.listdir(os.path.dirname(dst_path)))
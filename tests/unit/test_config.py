@@ -15,8 +15,9 @@ from ml_git.config import validate_config_spec_hash, get_sample_config_spec, get
     validate_spec_hash, config_verbose, get_refs_path, config_load, mlgit_config_load, list_repos, \
     get_index_path, get_objects_path, get_cache_path, get_metadata_path, import_dir, \
     extract_store_info_from_list, create_workspace_tree_structure, get_batch_size, merge_conf, \
-    merge_local_with_global_config, mlgit_config, save_global_config_in_local, start_wizard_questions
-from ml_git.constants import BATCH_SIZE_VALUE, BATCH_SIZE, Mutability
+    merge_local_with_global_config, mlgit_config, save_global_config_in_local, start_wizard_questions, get_hash_workers_count, \
+    get_reflink
+from ml_git.constants import BATCH_SIZE_VALUE, BATCH_SIZE, HASH_WORKERS_COUNT, Mutability, REFLINK
 from ml_git.utils import get_root_path, yaml_load
 
 
@@ -157,6 +158,20 @@ class ConfigTestCases(unittest.TestCase):
         batch_size = get_batch_size(config)
         self.assertEqual(batch_size, BATCH_SIZE_VALUE)
 
+    def test_get_hash_workers_count(self):
+        config = {HASH_WORKERS_COUNT: 2}
+        self.assertEqual(get_hash_workers_count(config), 2)
+        config[HASH_WORKERS_COUNT] = 0
+        self.assertRaises(RuntimeError, lambda: get_hash_workers_count(config))
+        config[HASH_WORKERS_COUNT] = 'string'
+        self.assertRaises(RuntimeError, lambda: get_hash_workers_count(config))
+
+    def test_get_reflink(self):
+        self.assertTrue(get_reflink({}))
+        for value, expected in [(False, False), ('false', False), ('0', False), ('True', True), ('1', True)]:
+            self.assertEqual(get_reflink({REFLINK: value}), expected)
+        self.assertRaises(RuntimeError, lambda: get_reflink({REFLINK: 'maybe'}))
+
     def test_merge_conf(self):
         local_conf = {'dataset': {'git': ''}}
         global_conf = {'dataset': {'git': 'url'}, 'model': {'git': 'url'}, 'store': {}}
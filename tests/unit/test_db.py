@@ -0,0 +1,46 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import os
+import unittest
+
+import pytest
+
+from ml_git.file_system.db import open_db
+
+
+@pytest.mark.usefixtures('tmp_dir')
+class DatabaseTestCases(unittest.TestCase):
+
+    def test_transaction(self):
+        db_path = os.path.join(self.tmp_dir, 'dbs', 'test.db')
+        db = open_db(db_path)
+        self.assertEqual(db.fetchone('PRAGMA journal_mode')[0], 'wal')
+        with db.transaction():
+            db.execute('CREATE TABLE t (k TEXT PRIMARY KEY)')
+            db.executemany('INSERT INTO t (k) VALUES (?)', [('a',), ('b',)])
+
+        other = open_db(db_path)
+        self.assertEqual(other.fetchall('SELECT k FROM t ORDER BY k'), [('a',), ('b',)])
+
+        with db.locked():
+            db.execute('DELETE FROM t')
+        self.assertEqual(len(other.fetchall('SELECT k FROM t')), 2)
+        db.close(commit=True)
+        self.assertEqual(other.fetchall('SELECT k FROM t'), [])
+        other.close()
+
+    def test_transaction_rollback(self):
+        db = open_db(os.path.join(self.tmp_dir, 'test.db'))
+        with db.transaction():
+            db.execute('CREATE TABLE t (k TEXT PRIMARY KEY)')
+        with self.assertRaises(RuntimeError):
+            with db.transaction():
+                db.execute('INSERT INTO t (k) VALUES (?)', ('a',))
+                raise RuntimeError('failed')
+        # a later commit does not write the statements of the failed transaction
+        db.commit()
+        self.assertEqual(db.fetchall('SELECT k FROM t'), [])
+        db.close()
@@ -0,0 +1,33 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import os
+import unittest
+
+import pytest
+
+from ml_git.constants import HASH_POOL_MIN_FILES
+from ml_git.file_system.hash_engine import HashEngine
+from ml_git.file_system.hashfs import MultihashFS
+
+
+@pytest.mark.usefixtures('tmp_dir')
+class HashEngineTestCases(unittest.TestCase):
+
+    def test_pool_started_for_large_adds(self):
+        hfs = MultihashFS(os.path.join(self.tmp_dir, 'objects'), reflink=False)
+        engine = HashEngine(hfs, 2)
+        file_path = os.path.join(self.tmp_dir, 'file')
+        with open(file_path, 'wb') as f:
+            f.write(b'0' * 1024)
+        try:
+            # small adds are hashed in this process
+            for _ in range(HASH_POOL_MIN_FILES):
+                self.assertEqual(engine.get_scid(file_path), hfs.get_scid(file_path))
+            self.assertIsNone(engine._pool)
+            self.assertEqual(engine.put(file_path), hfs.get_scid(file_path))
+            self.assertIsNotNone(engine._pool)
+        finally:
+            engine.shutdown()
@@ -3,15 +3,19 @@
 SPDX-License-Identifier: GPL-2.0-only
 """
 
+import errno
 import hashlib
 import os
 import unittest
+from unittest import mock
 
 import pytest
 
+from ml_git.file_system.hash_engine import HashEngine
 from ml_git.file_system.hashfs import MultihashFS, HashFS
 from ml_git.file_system.index import MultihashIndex
 from ml_git.file_system.objects import Objects
+from ml_git.utils import tmp_file_path
 
 chunks256 = {
     'zdj7Wena1SoxPakkmaBTq1853qqKFwo1gDMWLB4SJjREsuGTC',
@@ -175,6 +179,189 @@ class MultihashFSTestCases(unittest.TestCase):
         self.assertTrue('zdj7WaUNoRAzciw2JJi69s2HjfCyzWt39BHCucCV2CsAX6vSv' in corrupted_files)
         self.assertFalse(os.path.exists(chunk_in_wrong_dir))
 
+    def test_hash_engine(self):
+        file_path = os.path.join(self.tmp_dir, 'file1')
+        with open(file_path, 'wb') as f:
+            f.write(os.urandom(600 * 1024))
+        hfs = MultihashFS(os.path.join(self.tmp_dir, 'objects'))
+        expected_scid = hfs.get_scid(file_path)
+
+        engine = HashEngine(hfs, nworkers=2)
+        self.assertEqual(engine.get_scid(file_path), expected_scid)
+        self.assertEqual(engine.put(file_path), expected_scid)
+        engine.shutdown()
+        self.assertTrue(hfs._exists(expected_scid))
+        self.assertEqual(len(hfs.load(expected_scid)['Links']), 3)
+
+    def test_pack_layout(self):
+        file_path = os.path.join(self.tmp_dir, 'file1')
+        with open(file_path, 'wb') as f:
+            f.write(os.urandom(600 * 1024))
+        objects_path = os.path.join(self.tmp_dir, 'objects')
+        hfs = MultihashFS(objects_path, layout='pack')
+        scid = hfs.put(file_path)
+        self.assertFalse(os.path.exists(hfs.get_keypath(scid)))
+        self.assertTrue(hfs._exists(scid))
+        self.assertEqual(len(hfs._get_packs()), 4)
+        self.assertEqual(sorted(files for files in hfs.walk()), [sorted(hfs._get_packs().keys())])
+
+        dst_path = os.path.join(self.tmp_dir, 'file2')
+        self.assertEqual(hfs.get(scid, dst_path), 600 * 1024)
+        with open(file_path, 'rb') as f1, open(dst_path, 'rb') as f2:
+            self.assertEqual(f1.read(), f2.read())
+        chunk = hfs.load(scid)['Links'][0]['Hash']
+        with hfs.object_path(chunk) as chunk_path:
+            self.assertEqual(os.path.getsize(chunk_path), 256 * 1024)
+        self.assertFalse(os.path.exists(chunk_path))
+        self.assertEqual(hfs.fsck(), [])
+
+        loose_path = os.path.join(self.tmp_dir, 'file3')
+        with open(loose_path, 'wb') as f:
+            f.write(os.urandom(100 * 1024))
+        loose_hfs = MultihashFS(objects_path, layout='loose')
+        loose_scid = loose_hfs.put(loose_path)
+        self.assertTrue(os.path.exists(loose_hfs.get_keypath(loose_scid)))
+        # left over by a process that died while writing the chunk
+        stale_tmp_path = tmp_file_path(loose_hfs.get_keypath(loose_scid))
+        with open(stale_tmp_path, 'wb') as f:
+            f.write(b'partial')
+        self.assertEqual(loose_hfs.fsck(), [])
+        self.assertEqual(loose_hfs.repack(), (2, 0))
+        self.assertFalse(os.path.exists(loose_hfs.get_keypath(loose_scid)))
+        self.assertFalse(os.path.exists(stale_tmp_path))
+        self.assertTrue(hfs._exists(loose_scid))
+
+        loose_hfs._get_packs().remove([loose_scid, loose_hfs.load(loose_scid)['Links'][0]['Hash']])
+        self.assertFalse(loose_hfs._exists(loose_scid))
+        self.assertTrue(loose_hfs.repack()[1] > 100 * 1024)
+        self.assertEqual(hfs.get(scid, dst_path), 600 * 1024)
+
+    def test_content_defined_chunking(self):
+        data = os.urandom(2 * 1024 * 1024)
+        file_path = os.path.join(self.tmp_dir, 'file1')
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        hfs = MultihashFS(os.path.join(self.tmp_dir, 'objects'), chunking='cdc')
+        scid = hfs.put(file_path)
+        self.assertEqual(hfs.get_scid(file_path), scid)
+        links = hfs.load(scid)['Links']
+        self.assertTrue(all(64 * 1024 <= link['Size'] <= 1024 * 1024 for link in links[:-1]))
+        self.assertTrue(len({link['Size'] for link in links}) > 1)
+
+        edited_path = os.path.join(self.tmp_dir, 'file2')
+        with open(edited_path, 'wb') as f:
+            f.write(data[:1000] + b'ml-git' + data[1000:])
+        edited_links = hfs.load(hfs.put(edited_path))['Links']
+        # only the chunk with the inserted bytes changes
+        self.assertEqual(len({link['Hash'] for link in links} - {link['Hash'] for link in edited_links}), 1)
+
+        # fixed-size IPLDs are still read by a cdc MultihashFS
+        fixed_hfs = MultihashFS(os.path.join(self.tmp_dir, 'objects'))
+        fixed_scid = fixed_hfs.put(file_path)
+        dst_path = os.path.join(self.tmp_dir, 'file3')
+        self.assertEqual(hfs.get(fixed_scid, dst_path), len(data))
+        self.assertEqual(fixed_hfs.get(scid, dst_path), len(data))
+        with open(dst_path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_get_reflink(self):
+        data = os.urandom(600 * 1024 + 100)
+        file_path = os.path.join(self.tmp_dir, 'file1')
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        hfs = MultihashFS(os.path.join(self.tmp_dir, 'objects'), reflink=True)
+        scid = hfs.put(file_path)
+        clones = []
+
+        def clone_range(src_fd, src_offset, length, dst_fd, dst_offset):
+            clones.append((dst_offset, length))
+            os.pwrite(dst_fd, os.pread(src_fd, length, src_offset), dst_offset)
+
+        dst_path = os.path.join(self.tmp_dir, 'file2')
+        with mock.patch('ml_git.file_system.hashfs.clone_range', side_effect=clone_range):
+            self.assertEqual(hfs.get(scid, dst_path), len(data))
+        self.assertEqual([(0, 256 * 1024), (256 * 1024, 256 * 1024), (512 * 1024, 88 * 1024 + 100)], clones)
+        with open(dst_path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+        # not supported by the file system: chunks are copied and reflink is not tried again
+        with mock.patch('ml_git.file_system.hashfs.clone_range', side_effect=OSError(errno.EOPNOTSUPP, 'not supported')) \
+                as clone_mock:
+            self.assertEqual(hfs.get(scid, dst_path), len(data))
+            self.assertEqual(clone_mock.call_count, 1)
+        with open(dst_path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_get_splice(self):
+        data = os.urandom(600 * 1024 + 100)
+        file_path = os.path.join(self.tmp_dir, 'file1')
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        objects_path = os.path.join(self.tmp_dir, 'objects')
+        scid = MultihashFS(objects_path, reflink=False).put(file_path)
+        dst_path = os.path.join(self.tmp_dir, 'file2')
+
+        # chunks are checked the first time they are read, then copied by the kernel
+        hfs = MultihashFS(objects_path, reflink=False)
+        hfs._splice = 'copy_file_range'
+        for checks in [4, 1]:
+            with mock.patch.object(hfs, '_check_integrity', wraps=hfs._check_integrity) as check_mock, \
+                    mock.patch('os.copy_file_range', wraps=os.copy_file_range) as copy_mock:
+                self.assertEqual(hfs.get(scid, dst_path), len(data))
+            self.assertEqual(checks, check_mock.call_count)
+            self.assertEqual(0 if checks == 4 else 3, copy_mock.call_count)
+            with open(dst_path, 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+        # not supported between the files: sendfile is used from then on
+        with mock.patch('os.copy_file_range', side_effect=OSError(errno.EXDEV, 'cross-device')) as copy_mock, \
+                mock.patch('os.sendfile', wraps=os.sendfile) as sendfile_mock:
+            self.assertEqual(hfs.get(scid, dst_path), len(data))
+        self.assertEqual(1, copy_mock.call_count)
+        self.assertEqual(3, sendfile_mock.call_count)
+        self.assertEqual('sendfile', hfs._splice)
+        with open(dst_path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_get_verified_ledger(self):
+        data = os.urandom(600 * 1024 + 100)
+        file_path = os.path.join(self.tmp_dir, 'file1')
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        objects_path = os.path.join(self.tmp_dir, 'objects')
+        ledger_path = os.path.join(self.tmp_dir, 'verified_chunks.db')
+        scid = MultihashFS(objects_path, reflink=False).put(file_path)
+        dst_path = os.path.join(self.tmp_dir, 'file2')
+
+        def count_checks(paranoid=False):
+            hfs = MultihashFS(objects_path, reflink=False, ledger_path=ledger_path)
+            hfs._paranoid = paranoid
+            with mock.patch.object(hfs, '_check_integrity', wraps=hfs._check_integrity) as check_mock:
+                self.assertEqual(hfs.get(scid, dst_path), len(data))
+            with open(dst_path, 'rb') as f:
+                self.assertEqual(f.read(), data)
+            return check_mock.call_count
+
+        # the descriptor is always checked, chunks only until they are in the ledger
+        self.assertEqual(4, count_checks())
+        self.assertEqual(1, count_checks())
+        self.assertEqual(4, count_checks(paranoid=True))
+
+        # a chunk file changed since it was verified is hashed again
+        hfs = MultihashFS(objects_path)
+        chunk_path = hfs._get_hashpath(hfs.load(scid)['Links'][0]['Hash'])
+        st = os.stat(chunk_path)
+        os.utime(chunk_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        self.assertEqual(2, count_checks())
+        self.assertEqual(1, count_checks())
+
+        # the chunks verified while getting a file are written to the ledger at once
+        hfs = MultihashFS(objects_path, reflink=False, ledger_path=os.path.join(self.tmp_dir, 'verified_chunks2.db'))
+        ledger = hfs._get_ledger()
+        with mock.patch.object(ledger._db, 'transaction', wraps=ledger._db.transaction) as transaction_mock:
+            self.assertEqual(hfs.get(scid, dst_path), len(data))
+        self.assertEqual(transaction_mock.call_count, 1)
+
 
 hfsfiles = {'think-hires.jpg'}
 
@@ -8,7 +8,8 @@ import unittest
 
 import pytest
 
-from ml_git.file_system.index import MultihashIndex
+from ml_git.constants import IndexEngine
+from ml_git.file_system.index import MultihashIndex, FullIndex, Status
 from ml_git.utils import yaml_load, yaml_save
 
 singlefile = {
@@ -121,3 +122,28 @@ class IndexTestCases(unittest.TestCase):
 
         self.assertTrue(mf.exists('zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u'))
         self.assertTrue(mf.exists('zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2'))
+
+    def test_full_index_sqlite_engine(self):
+        file_path = os.path.join(self.tmp_dir, 'file1')
+        with open(file_path, 'w') as f:
+            f.write('ml-git')
+        index_path = os.path.join(self.tmp_dir, 'metadata', 'dataset-spec')
+        fidx = FullIndex('dataset-spec', self.tmp_dir)
+        fidx.update_full_index('file1', file_path, Status.a.name, 'zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2')
+        fidx.save_manifest_index()
+
+        fidx = FullIndex('dataset-spec', self.tmp_dir, engine=IndexEngine.SQLITE.value)
+        self.assertFalse(os.path.exists(os.path.join(index_path, 'INDEX.yaml')))
+        self.assertTrue(os.path.exists(os.path.join(index_path, 'INDEX.db')))
+        self.assertEqual(fidx.get_files_by_status(Status.a.name), ['file1'])
+        self.assertEqual(fidx.get_total_size(), 6)
+        fidx.update_index_status(['file1'], Status.u.name)
+        self.assertEqual(fidx.get_index()['file1']['status'], Status.u.name)
+        self.assertNotIn('previous_hash', fidx.get_index()['file1'])
+        fidx.get_manifest_index().close()
+
+        FullIndex('dataset-spec', self.tmp_dir, engine=IndexEngine.YAML.value)
+        self.assertFalse(os.path.exists(os.path.join(index_path, 'INDEX.db')))
+        f_idx = yaml_load(os.path.join(index_path, 'INDEX.yaml'))
+        self.assertEqual(f_idx['file1']['status'], Status.u.name)
+        self.assertEqual(f_idx['file1']['hash'], 'zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2')
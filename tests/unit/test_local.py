@@ -4,8 +4,11 @@ SPDX-License-Identifier: GPL-2.0-only
 """
 
 import filecmp
+import json
 import os
 import shutil
+import threading
+import time
 import unittest
 import boto3
 import botocore
@@ -119,6 +122,84 @@ class LocalRepositoryTestCases(unittest.TestCase):
         for key in idx.get_index():
             self.assertIsNotNone(s3.Object(testbucketname, key))
 
+    def test_push_remote_packs(self):
+        mlgit_dir = os.path.join(self.tmp_dir, '.ml-git')
+        indexpath = os.path.join(mlgit_dir, 'index-test')
+        mdpath = os.path.join(mlgit_dir, 'metadata-test')
+        objectpath = os.path.join(mlgit_dir, 'objects-test')
+        specpath = os.path.join(mdpath, 'vision-computing/images/dataset-ex')
+        ensure_path_exists(specpath)
+        ensure_path_exists(indexpath)
+        shutil.copy('hdata/dataset-ex.spec', specpath + '/dataset-ex.spec')
+        shutil.copy('hdata/config.yaml', mlgit_dir + '/config.yaml')
+        manifestpath = os.path.join(specpath, 'MANIFEST.yaml')
+        yaml_save({'zdj7WjdojNAZN53Wf29rPssZamfbC6MVerzcGwd9tNciMpsQh': {'imghires.jpg'}}, manifestpath)
+        idx = MultihashIndex(specpath, indexpath, objectpath)
+        idx.add('data-test-push/', manifestpath)
+        o = Objects(specpath, objectpath)
+        o.commit_index(indexpath, 'data-test-push')
+
+        c = yaml_load('hdata/config.yaml')
+        c['remote_packs'] = True
+        r = LocalRepository(c, objectpath)
+        pushed_objs = set(r.get_log())
+        # already in the store as a loose key
+        client = boto3.client('s3', region_name='us-east-1')
+        loose_obj = sorted(pushed_objs)[0]
+        client.upload_file(Filename=r.get_keypath(loose_obj), Bucket=testbucketname, Key=loose_obj)
+        self.assertEqual(r.push(objectpath, specpath + '/dataset-ex.spec'), 0)
+
+        keys = [obj['Key'] for obj in client.list_objects_v2(Bucket=testbucketname)['Contents']
+                if obj['Key'] not in hs and obj['Key'] != loose_obj]
+        self.assertEqual({os.path.splitext(key)[1] for key in keys}, {'.pack', '.idx'})
+        packed_objs = set()
+        for key in keys:
+            if key.endswith('.idx'):
+                packed_objs.update(json.loads(client.get_object(Bucket=testbucketname, Key=key)['Body'].read()))
+        self.assertEqual(packed_objs, pushed_objs - {loose_obj})
+        yaml_save(files_mock, manifestpath)
+
+        fetch_objectpath = os.path.join(mlgit_dir, 'objects-fetch')
+        r = LocalRepository(c, fetch_objectpath)
+        self.assertTrue(r.fetch(mdpath, 'vision-computing__images__dataset-ex__5', None))
+        fs = set()
+        for root, dirs, files in os.walk(fetch_objectpath):
+            fs.update(files)
+        self.assertEqual(fs, pushed_objs)
+
+        # objects already in a remote pack are not sent again
+        r = LocalRepository(c, objectpath)
+        self.assertEqual(r.push(objectpath, specpath + '/dataset-ex.spec'), 0)
+        self.assertEqual(len(client.list_objects_v2(Bucket=testbucketname)['Contents']), len(keys) + len(hs) + 1)
+
+    def test_list_remote_keys(self):
+        class ListingStore(object):
+            def __init__(self, keys, page_size):
+                self.keys = sorted(keys)
+                self.page_size = page_size
+                self.listed = []
+
+            def list_keys(self, prefix=''):
+                self.listed.append(prefix)
+                keys = [key for key in self.keys if key.startswith(prefix)]
+                for i in range(0, max(len(keys), 1), self.page_size):
+                    yield keys[i:i + self.page_size]
+
+        c = yaml_load('hdata/config.yaml')
+        c['listing_threshold'] = 4
+        r = LocalRepository(c, os.path.join(self.tmp_dir, 'objects-test'))
+        wanted = ['zdj7WmA1', 'zdj7WmA2', 'zdj7WmA3', 'zdj7WnB1']
+        self.assertIsNone(r._list_remote_keys(ListingStore([], 1000), wanted[:3]))
+
+        # only the prefix with more keys to check than pages is listed, the other key is left to a HEAD request
+        store = ListingStore(['zdj7WmA1', 'zdj7WmA3', 'zdj7WmA9', 'zdj7WnB1'], 1000)
+        self.assertEqual(r._list_remote_keys(store, wanted), ({'zdj7WmA1', 'zdj7WmA3'}, {'zdj7WmA2'}))
+        self.assertEqual(store.listed, ['zdj7WmA'])
+
+        # a listing with more pages than keys to check is given up
+        store = ListingStore(['zdj7WmA%03d' % i for i in range(10)], 1)
+        self.assertIsNone(r._list_remote_keys(store, wanted))
+
     def test_fetch(self):
         mdpath = os.path.join(self.tmp_dir, 'metadata-test')
         testbucketname = os.getenv('MLGIT_TEST_BUCKET', 'ml-git-datasets')
@@ -163,6 +244,30 @@ class LocalRepositoryTestCases(unittest.TestCase):
         self.assertTrue(os.path.exists(cache.get_keypath(key)))
         self.assertEqual(self.md5sum(HDATA_IMG_1), self.md5sum(cache.get_keypath(key)))
 
+    def test_fetch_blob_remote_once(self):
+        hfspath = os.path.join(self.tmp_dir, 'objectsfs')
+        c = get_sample_config_spec(testbucketname, testprofile, testregion)
+        r = LocalRepository(c, hfspath)
+        key = 'zdj7WdjnTVfz5AhTavcpsDT62WiQo4AeQy6s4UC1BSEZYx4NP'
+        downloads = []
+
+        class SlowStore(object):
+            def get(self, file_path, reference):
+                downloads.append(reference)
+                time.sleep(0.1)
+                shutil.copy(os.path.join('hdata', reference), file_path)
+                return True
+
+        # jobs missing the same object wait for the first download instead of downloading it again
+        threads = [threading.Thread(target=r._fetch_blob_remote, args=(SlowStore(), key, r.get_keypath(key)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([key], downloads)
+        self.assertTrue(filecmp.cmp(os.path.join('hdata', key), r.get_keypath(key), shallow=False))
+
     def test_get_update_links_wspace(self):
         wspath = os.path.join(self.tmp_dir, 'wspace')
 
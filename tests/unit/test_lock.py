@@ -0,0 +1,62 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import os
+import threading
+import time
+import unittest
+
+import pytest
+
+from ml_git.file_system.lock import LockManager, get_locks_path
+
+
+@pytest.mark.usefixtures('tmp_dir')
+class LockManagerTestCases(unittest.TestCase):
+
+    def test_get_locks_path(self):
+        self.assertEqual(os.path.join(self.tmp_dir, 'locks', 'objects'),
+                         get_locks_path(os.path.join(self.tmp_dir, 'objects') + os.sep))
+
+    def test_store_lock(self):
+        store_path = os.path.join(self.tmp_dir, 'objects')
+        with LockManager(store_path).shared():
+            # locks are held by open file, so a second manager behaves as another process
+            with LockManager(store_path).shared():
+                pass
+            with LockManager(store_path).exclusive(blocking=False) as acquired:
+                self.assertFalse(acquired)
+        with LockManager(store_path).exclusive(blocking=False) as acquired:
+            self.assertTrue(acquired)
+
+    def test_key_lock(self):
+        lm = LockManager(os.path.join(self.tmp_dir, 'cache'))
+        events = []
+
+        def write(key, i):
+            with lm.key(key):
+                events.append(('in', i))
+                time.sleep(0.05)
+                events.append(('out', i))
+
+        threads = [threading.Thread(target=write, args=('zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9A', i)) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(6, len(events))
+        for i in range(0, 6, 2):
+            self.assertEqual(events[i][1], events[i + 1][1])
+
+    def test_pin(self):
+        lm = LockManager(os.path.join(self.tmp_dir, 'objects'))
+        self.assertEqual(set(), lm.pinned())
+        lm.pin('dataset-ex__1', ['a', 'b'])
+        lm.pin('dataset-ex__2', ['b', 'c'])
+        self.assertEqual(['dataset-ex__1', 'dataset-ex__2'], lm.pins())
+        self.assertEqual({'a', 'b', 'c'}, lm.pinned())
+        self.assertTrue(lm.unpin('dataset-ex__1'))
+        self.assertFalse(lm.unpin('dataset-ex__1'))
+        self.assertEqual({'b', 'c'}, LockManager(os.path.join(self.tmp_dir, 'objects')).pinned())
@@ -8,7 +8,8 @@ import unittest
 
 import pytest
 
-from ml_git.manifest import Manifest
+from ml_git.manifest import Manifest, BinaryManifest, get_binary_manifest_path
+from ml_git.utils import yaml_load, yaml_save
 
 
 @pytest.mark.usefixtures('tmp_dir')
@@ -129,3 +130,81 @@ class ManifestTestCases(unittest.TestCase):
         mf_diff, _ = mf_1.get_diff(mf_2)
 
         self.assertEqual(mf_diff, {'zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u': {'data/think-hires.jpg'}})
+
+    def _get_metadata_manifest_path(self):
+        mfpath = os.path.join(self.tmp_dir, '.ml-git', 'dataset', 'metadata', 'dataset-ex', 'MANIFEST.yaml')
+        os.makedirs(os.path.dirname(mfpath))
+        return mfpath
+
+    def test_binary_manifest_lookup(self):
+        mfpath = self._get_metadata_manifest_path()
+
+        mf = Manifest(mfpath)
+        mf.add('zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2', 'data/image.jpg')
+        mf.add('zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u', 'data/think-hires.jpg')
+        mf.add('zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u', 'data/think-hires2.jpg')
+        mf.save()
+        binary_path = get_binary_manifest_path(mfpath)
+        self.assertTrue(os.path.exists(binary_path))
+        self.assertEqual(os.path.dirname(binary_path), os.path.join(self.tmp_dir, '.ml-git', 'dataset', 'binary_manifests'))
+        self.assertEqual(os.listdir(os.path.dirname(mfpath)), ['MANIFEST.yaml'])
+
+        mf = Manifest(mfpath)
+        self.assertIsNotNone(mf._binary)
+        self.assertEqual(len(mf), 2)
+        self.assertEqual(list(mf), ['zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2',
+                                    'zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u'])
+        self.assertTrue(mf.exists('zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2'))
+        self.assertFalse(mf.exists('zdj7WdjnTVfz5AhTavcpsDT62WiQo4AeQy6s4UC1BSEZYx4NP'))
+        self.assertEqual(mf['zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u'],
+                         {'data/think-hires.jpg', 'data/think-hires2.jpg'})
+        self.assertEqual(mf.search('data/think-hires2.jpg'), 'zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u')
+        self.assertIsNone(mf.search('data/missing.jpg'))
+        self.assertEqual(mf.load(), yaml_load(mfpath))
+
+    def test_binary_manifest_stale(self):
+        mfpath = self._get_metadata_manifest_path()
+
+        mf = Manifest(mfpath)
+        mf.add('zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2', 'data/image.jpg')
+        mf.save()
+        yaml_save({'zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u': {'data/think-hires.jpg'}}, mfpath)
+
+        self.assertIsNone(BinaryManifest.open(get_binary_manifest_path(mfpath), mfpath))
+        mf = Manifest(mfpath)
+        self.assertFalse(mf.exists('zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2'))
+        self.assertTrue(mf.exists_keyfile('zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u', 'data/think-hires.jpg'))
+
+    def test_binary_manifest_built_on_load(self):
+        mfpath = self._get_metadata_manifest_path()
+        # written without ml-git, e.g. by a clone or a pull
+        yaml_save({'zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2': {'data/image.jpg'}}, mfpath)
+
+        mf = Manifest(mfpath)
+        self.assertIsNone(mf._binary)
+        self.assertTrue(mf.exists('zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2'))
+        self.assertTrue(os.path.exists(get_binary_manifest_path(mfpath)))
+        self.assertEqual(os.listdir(os.path.dirname(mfpath)), ['MANIFEST.yaml'])
+
+        mf = Manifest(mfpath)
+        self.assertIsNotNone(mf._binary)
+        self.assertTrue(mf._is_lazy())
+        self.assertEqual(mf.search('data/image.jpg'), 'zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2')
+        self.assertTrue(mf._is_lazy())
+
+        # rebuilt once the manifest changes
+        yaml_save({'zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u': {'data/think-hires.jpg'}}, mfpath)
+        self.assertFalse(Manifest(mfpath).exists('zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2'))
+        mf = Manifest(mfpath)
+        self.assertIsNotNone(mf._binary)
+        self.assertTrue(mf.exists('zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u'))
+
+    def test_binary_manifest_outside_root(self):
+        mfpath = os.path.join(self.tmp_dir, 'MANIFEST.yaml')
+
+        mf = Manifest(mfpath)
+        mf.add('zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2', 'data/image.jpg')
+        mf.save()
+        self.assertIsNone(get_binary_manifest_path(mfpath))
+        self.assertEqual(os.listdir(self.tmp_dir), ['MANIFEST.yaml'])
+        self.assertTrue(Manifest(mfpath).exists('zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2'))
@@ -5,7 +5,13 @@ SPDX-License-Identifier: GPL-2.0-only
 
 import unittest
 
-from ml_git.pool import WorkerPool, process_futures
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError, ServiceRequestError, ServiceResponseError
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError, ConnectTimeoutError, ConnectionClosedError
+from googleapiclient.errors import HttpError
+from httplib2 import Response
+
+from ml_git.pool import WorkerPool, process_futures, ConcurrencyController, is_throttling_error, RetryPolicy, \
+    RetryBudget, is_permanent_error
 
 
 class Context(object):
@@ -29,6 +35,12 @@ def job_no_ctx(abc, bcd, exc=False):
     return abc * bcd
 
 
+def job_not_found(abc):
+    global nexc
+    nexc += 1
+    raise FileNotFoundError('file [%s] not found' % abc)
+
+
 def job_with_ctx(ctx, abc, bcd):
     abcd = job_no_ctx(abc, bcd)
     return '%s %d' % (ctx, abcd)
@@ -135,3 +147,150 @@ class PoolTestCases(unittest.TestCase):
 
         with self.assertRaises(Exception):
             process_futures(futs, wp)
+
+    def test_adaptive_multiple_jobs(self):
+        njobs = 10
+        ctxs = []
+
+        def ctx_factory():
+            ctxs.append(Context(len(ctxs)))
+            return ctxs[-1]
+
+        controller = ConcurrencyController(10, initial_limit=2)
+        wp = WorkerPool(nworkers=10, ctx_factory=ctx_factory, controller=controller)
+        for i in range(njobs):
+            wp.submit(job_with_ctx, 10 * i, 10 * i)
+
+        futs = wp.wait()
+        self.assertEqual(len(futs), njobs)
+        for fut in futs:
+            fut.result()
+        self.assertTrue(len(ctxs) <= 2)
+
+    def test_concurrency_controller(self):
+        controller = ConcurrencyController(8, initial_limit=4, window=0)
+        for _ in range(4):
+            controller.acquire()
+        for _ in range(4):
+            controller.release(0.1)
+        self.assertEqual(controller.limit, 5)
+
+        controller.acquire()
+        controller.release(0.1, throttled=True)
+        self.assertEqual(controller.limit, 2)
+
+    def test_is_throttling_error(self):
+        slow_down = ClientError({'Error': {'Code': 'SlowDown'}, 'ResponseMetadata': {'HTTPStatusCode': 503}}, 'put_object')
+        not_found = ClientError({'Error': {'Code': 'NoSuchKey'}, 'ResponseMetadata': {'HTTPStatusCode': 404}}, 'get_object')
+        self.assertTrue(is_throttling_error(slow_down))
+        self.assertFalse(is_throttling_error(not_found))
+        self.assertFalse(is_throttling_error(Exception('worker pool exception SlowDown')))
+
+        rate_limit = HttpError(Response({'status': 403}), b'{"error": {"errors": [{"reason": "userRateLimitExceeded"}]}}')
+        self.assertTrue(is_throttling_error(rate_limit))
+
+    def test_is_permanent_error(self):
+        def s3_error(code, status):
+            return ClientError({'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}, 'get_object')
+
+        self.assertFalse(is_permanent_error(s3_error('RequestTimeout', 400)))
+        self.assertFalse(is_permanent_error(s3_error('ExpiredToken', 400)))
+        self.assertFalse(is_permanent_error(s3_error('InternalError', 500)))
+        self.assertTrue(is_permanent_error(s3_error('InvalidArgument', 400)))
+        self.assertTrue(is_permanent_error(s3_error('NoSuchKey', 404)))
+        self.assertTrue(is_permanent_error(s3_error('AccessDenied', 403)))
+
+        azure_busy = HttpResponseError(message='busy')
+        azure_busy.status_code, azure_busy.error_code = 503, 'ServerBusy'
+        azure_not_found = ResourceNotFoundError(message='not found')
+        azure_not_found.status_code = 404
+        self.assertFalse(is_permanent_error(azure_busy))
+        self.assertTrue(is_permanent_error(azure_not_found))
+
+        gdrive_forbidden = HttpError(Response({'status': 403}), b'{"error": {"errors": [{"reason": "insufficientFilePermissions"}]}}')
+        gdrive_rate_limit = HttpError(Response({'status': 403}), b'{"error": {"errors": [{"reason": "rateLimitExceeded"}]}}')
+        self.assertTrue(is_permanent_error(gdrive_forbidden))
+        self.assertFalse(is_permanent_error(gdrive_rate_limit))
+
+        self.assertTrue(is_permanent_error(FileNotFoundError()))
+        self.assertFalse(is_permanent_error(Exception('worker pool exception')))
+
+    def test_is_permanent_error_client_status(self):
+        def s3_error(code, status):
+            return ClientError({'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}, 'get_object')
+
+        self.assertFalse(is_permanent_error(s3_error('Unknown', 408)))
+        self.assertFalse(is_permanent_error(s3_error('Unknown', 429)))
+        self.assertTrue(is_permanent_error(s3_error('Unknown', 400)))
+        self.assertTrue(is_permanent_error(s3_error('Unknown', 499)))
+
+    def test_is_permanent_error_server_status(self):
+        def s3_error(code, status):
+            return ClientError({'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}, 'get_object')
+
+        self.assertFalse(is_permanent_error(s3_error('Unknown', 500)))
+        self.assertFalse(is_permanent_error(s3_error('Unknown', 501)))
+        self.assertFalse(is_permanent_error(s3_error('Unknown', 503)))
+        self.assertFalse(is_permanent_error(ClientError({'Error': {'Code': 'Unknown'}}, 'get_object')))
+
+    def test_is_permanent_error_connection(self):
+        self.assertFalse(is_permanent_error(EndpointConnectionError(endpoint_url='http://localhost')))
+        self.assertFalse(is_permanent_error(ConnectTimeoutError(endpoint_url='http://localhost')))
+        self.assertFalse(is_permanent_error(ReadTimeoutError(endpoint_url='http://localhost')))
+        self.assertFalse(is_permanent_error(ConnectionClosedError(endpoint_url='http://localhost')))
+        self.assertFalse(is_permanent_error(ServiceRequestError('connection refused')))
+        self.assertFalse(is_permanent_error(ServiceResponseError('connection reset')))
+        self.assertFalse(is_permanent_error(ConnectionResetError()))
+        self.assertFalse(is_permanent_error(TimeoutError()))
+
+    def test_single_job_with_permanent_exception(self):
+        global nexc
+        nexc = 0
+
+        wp = WorkerPool(nworkers=1, retry=2)
+
+        wp.submit(job_not_found, 10)
+
+        futs = wp.wait()
+        for fut in futs:
+            self.assertRaises(FileNotFoundError, fut.result)
+        self.assertEqual(nexc, 1)
+
+    def test_retry_policy(self):
+        throttled = ClientError({'Error': {'Code': 'SlowDown'},
+                                 'ResponseMetadata': {'HTTPStatusCode': 503, 'HTTPHeaders': {'retry-after': '3'}}},
+                                'get_object')
+        policy = RetryPolicy(retry=2, base=1, cap=10)
+        self.assertTrue(policy.should_retry(throttled, 1))
+        self.assertFalse(policy.should_retry(throttled, 3))
+        self.assertEqual(policy.wait_time(throttled, 1), 3)
+        for attempt in range(1, 6):
+            self.assertTrue(0 <= policy.wait_time(Exception('worker pool exception'), attempt) <= min(10, 2 ** attempt))
+
+    def test_retry_budget(self):
+        policy = RetryPolicy(retry=2, budget=RetryBudget(capacity=2, refill=0.5))
+        error = Exception('worker pool exception')
+        self.assertTrue(policy.should_retry(error, 1))
+        self.assertTrue(policy.should_retry(error, 1))
+        self.assertFalse(policy.should_retry(error, 1))
+        policy.success()
+        policy.success()
+        self.assertTrue(policy.should_retry(error, 1))
+
+    def test_imap_unordered(self):
+        njobs = 100
+        submitted = []
+
+        def jobs():
+            for i in range(njobs):
+                submitted.append(i)
+                yield 10 * i, 10 * i
+
+        wp = WorkerPool(nworkers=4)
+        results = []
+        for fut in wp.imap_unordered(job_no_ctx, jobs(), window=8):
+            self.assertTrue(len(submitted) - len(results) <= 8)
+            results.append(fut.result())
+
+        self.assertEqual(sorted(results), [job_no_ctx(10 * i, 10 * i) for i in range(njobs)])
+        self.assertEqual(len(wp.wait()), 0)
@@ -0,0 +1,34 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import unittest
+
+from ml_git.file_system.reachable import BloomFilter, ReachableSet
+
+
+class ReachableSetTestCases(unittest.TestCase):
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000, 0.01)
+        keys = ['zdj7W%d' % i for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertEqual(1000, len(bloom))
+        self.assertTrue(all(key in bloom for key in keys))
+        false_positives = sum(1 for i in range(10000) if 'zdj7X%d' % i in bloom)
+        self.assertLess(false_positives, 300)
+
+    def test_reachable_set(self):
+        reachable = ReachableSet(max_keys=100, error_rate=0.01)
+        keys = ['zdj7W%d' % i for i in range(1000)]
+        reachable.update(keys[:50])
+        self.assertEqual([], reachable._filters)
+        # past max_keys, the keys move to bloom filters that grow as they get full
+        reachable.update(keys)
+        self.assertEqual(set(), reachable._keys)
+        self.assertEqual([200, 400, 800], [f.capacity for f in reachable._filters])
+        self.assertTrue(all(key in reachable for key in keys))
+        false_positives = sum(1 for i in range(10000) if 'zdj7X%d' % i in reachable)
+        self.assertLess(false_positives, 1000)
@@ -0,0 +1,96 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import os
+import unittest
+
+import pytest
+
+from ml_git.file_system.hashfs import MultihashFS
+from ml_git.file_system.refcount import RefCounts
+
+
+@pytest.mark.usefixtures('tmp_dir')
+class RefCountsTestCases(unittest.TestCase):
+
+    def _put(self, hfs, name, data):
+        file_path = os.path.join(self.tmp_dir, name)
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        key = hfs.put(file_path)
+        return key, [link['Hash'] for link in hfs.load(key)['Links']]
+
+    def test_update_roots(self):
+        hfs = MultihashFS(os.path.join(self.tmp_dir, 'objects'), reflink=False)
+        shared = os.urandom(256 * 1024)
+        key1, chunks1 = self._put(hfs, 'f1', shared + b'1')
+        key2, chunks2 = self._put(hfs, 'f2', shared + b'2')
+        self.assertEqual(chunks1[0], chunks2[0])
+
+        refcounts = RefCounts(os.path.join(self.tmp_dir, 'refcounts.db'))
+        self.assertFalse(refcounts.is_initialized())
+        refcounts.rebuild([('dataset/ds1', [key1], hfs), ('dataset/ds2', [key1, key2], hfs)])
+        self.assertTrue(refcounts.is_initialized())
+        self.assertEqual({'dataset/ds1', 'dataset/ds2'}, refcounts.owners())
+        self.assertEqual([], refcounts.candidates())
+
+        # key1 is still used by ds1
+        refcounts.update_roots('dataset/ds2', [key2], hfs)
+        self.assertEqual([], refcounts.candidates())
+        refcounts.update_roots('dataset/ds1', [], hfs)
+        self.assertEqual({key1, chunks1[1]}, set(refcounts.candidates()))
+
+        # used again before a gc
+        refcounts.update_roots('dataset/ds1', [key1], hfs)
+        self.assertEqual([], refcounts.candidates())
+        refcounts.update_roots('dataset/ds1', [], hfs)
+        refcounts.update_roots('dataset/ds2', [], hfs)
+        self.assertEqual({key1, key2} | set(chunks1) | set(chunks2), set(refcounts.candidates()))
+        refcounts.forget(refcounts.candidates())
+        self.assertEqual([], refcounts.candidates())
+        refcounts.close()
+
+    def test_pending_links(self):
+        hfs = MultihashFS(os.path.join(self.tmp_dir, 'objects'), reflink=False)
+        other = MultihashFS(os.path.join(self.tmp_dir, 'other'), reflink=False)
+        key1, chunks1 = self._put(hfs, 'f1', b'1')
+        key2, chunks2 = self._put(other, 'f2', b'2')
+
+        refcounts = RefCounts(os.path.join(self.tmp_dir, 'refcounts.db'))
+        refcounts.rebuild([('dataset/ds', [key1, key2], hfs)])
+        # key2 is not in hfs, its chunks are not counted
+        refcounts.update_roots('dataset/ds', [key1], hfs)
+        self.assertEqual({key2}, set(refcounts.candidates()))
+
+        # they are counted once it is found
+        refcounts.update_roots('dataset/ds', [key1, key2], hfs)
+        refcounts.count_pending([hfs, other])
+        refcounts.update_roots('dataset/ds', [key1], other)
+        self.assertEqual({key2} | set(chunks2), set(refcounts.candidates()))
+        refcounts.close()
+
+    def test_unrecorded(self):
+        hfs = MultihashFS(os.path.join(self.tmp_dir, 'objects'), reflink=False)
+        shared = os.urandom(256 * 1024)
+        key1, chunks1 = self._put(hfs, 'f1', shared + b'1')
+        refcounts = RefCounts(os.path.join(self.tmp_dir, 'refcounts.db'))
+        refcounts.rebuild([('dataset/ds', [key1], hfs)])
+
+        # fetched after the counts were built and never used by the index, sharing a chunk with key1
+        key2, chunks2 = self._put(hfs, 'f2', shared + b'2')
+        self.assertEqual(chunks1[0], chunks2[0])
+        refcounts.add_written([key1, key2])
+        self.assertEqual({key2, chunks2[1]}, set(refcounts.unrecorded([hfs])))
+
+        # written then used by an index
+        refcounts.update_roots('dataset/ds', [key1, key2], hfs)
+        self.assertEqual([], refcounts.unrecorded([hfs]))
+        refcounts.forget([])
+        self.assertEqual([], refcounts._db.fetchall('SELECT key FROM written'))
+
+        refcounts.add_written([key2])
+        refcounts.rebuild([('dataset/ds', [key1], hfs)])
+        self.assertEqual([], refcounts.unrecorded([hfs]))
+        refcounts.close()
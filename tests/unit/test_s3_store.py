@@ -15,7 +15,10 @@ from moto import mock_s3
 from ml_git.file_system.index import MultihashIndex, FullIndex
 from ml_git.file_system.objects import Objects
 from ml_git.file_system.local import LocalRepository
+from ml_git.storages.remote_key_cache import RemoteKeyCache
+from ml_git.storages.remote_pack import supports_remote_packs
 from ml_git.storages.s3store import S3MultihashStore, S3Store
+from ml_git.storages.store_utils import store_factory, clear_stores_cache
 from ml_git.utils import ensure_path_exists, yaml_save, yaml_load
 
 files_mock = {'zdj7Wm99FQsJ7a4udnx36ZQNTy7h4Pao3XmRSfjo4sAbt9g74': {'1.jpg'}}
@@ -67,6 +70,47 @@ class S3StoreTestCases(unittest.TestCase):
         self.assertEqual(s3store.put(k, f), k)
         self.assertTrue(s3store.key_exists(k))
 
+    def test_put_with_remote_keys(self):
+        s3store = S3MultihashStore(bucketname, bucket)
+        k = 'zdj7WjdojNAZN53Wf29rPssZamfbC6MVerzcGwd9tNciMpsQh'
+        f = 'hdata/zdj7WjdojNAZN53Wf29rPssZamfbC6MVerzcGwd9tNciMpsQh'
+        remote_keys = RemoteKeyCache(os.path.join(self.tmp_dir, 'remote_keys.db'), 's3h://' + bucketname)
+        s3store.set_remote_keys(remote_keys)
+
+        boto3.client('s3', region_name='us-east-1').upload_file(Filename=f, Bucket=bucketname, Key=k)
+        self.assertTrue(s3store.remote_key_exists(k))
+        self.assertTrue(remote_keys.exists(k))
+
+        other_key = 'zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2'
+        remote_keys.add(other_key)
+        s3store.set_remote_keys(remote_keys, no_head=True)
+        self.assertTrue(s3store.put(other_key, f))
+        self.assertFalse(s3store.key_exists(other_key))
+        remote_keys.close()
+
+    def test_list_keys(self):
+        s3store = S3MultihashStore(bucketname, bucket)
+        k = 'zdj7WjdojNAZN53Wf29rPssZamfbC6MVerzcGwd9tNciMpsQh'
+        f = 'hdata/zdj7WjdojNAZN53Wf29rPssZamfbC6MVerzcGwd9tNciMpsQh'
+        self.assertEqual([key for page in s3store.list_keys() for key in page], [])
+
+        boto3.client('s3', region_name='us-east-1').upload_file(Filename=f, Bucket=bucketname, Key=k)
+        listed_keys = {key for page in s3store.list_keys(prefix='zdj7Wj') for key in page}
+        self.assertEqual(listed_keys, {k})
+        self.assertEqual([key for page in s3store.list_keys(prefix='zdj7Wm') for key in page], [])
+
+        remote_keys = RemoteKeyCache(os.path.join(self.tmp_dir, 'remote_keys.db'), 's3h://' + bucketname)
+        stale_key = 'zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2'
+        remote_keys.add(stale_key)
+        remote_keys.update(listed_keys, {stale_key})
+        self.assertIn(k, remote_keys)
+        self.assertNotIn(stale_key, remote_keys)
+        remote_keys.close()
+
+        s3store.set_remote_keys(listed_keys, missing_keys={stale_key})
+        self.assertTrue(s3store.put(k, f))
+        self.assertFalse(s3store.remote_key_exists(stale_key))
+
     def test_get(self):
         s3store = S3MultihashStore(bucketname, bucket)
         k = 'zdj7WjdojNAZN53Wf29rPssZamfbC6MVerzcGwd9tNciMpsQh'
@@ -78,6 +122,43 @@ class S3StoreTestCases(unittest.TestCase):
         self.assertTrue(s3store.get(fpath, k))
         self.assertEqual(self.md5sum(fpath), self.md5sum(f))
 
+    def test_store_factory_shared_client(self):
+        config = yaml_load('hdata/config.yaml')
+        s3store = store_factory(config, 's3h://' + bucketname_2, nworkers=4)
+        other_s3store = store_factory(config, 's3h://' + bucketname_2, nworkers=4)
+        self.assertIsNot(s3store, other_s3store)
+        self.assertIs(s3store._client, other_s3store._client)
+        self.assertEqual(s3store._client.meta.config.max_pool_connections, 4)
+        self.assertIsNot(store_factory(config, 's3://' + bucketname_2, nworkers=4)._client, s3store._client)
+
+        remote_keys = {'zdj7WjdojNAZN53Wf29rPssZamfbC6MVerzcGwd9tNciMpsQh'}
+        s3store.set_remote_keys(remote_keys, no_head=True)
+        self.assertIsNone(other_s3store._remote_keys)
+        self.assertIsNone(store_factory(config, 's3h://' + bucketname_2, nworkers=4)._remote_keys)
+        clear_stores_cache()
+
+    def test_ranged_get(self):
+        s3store = S3Store(bucketname, bucket)
+        s3store._download_part_size = 100
+        k = 'path/zdj7WjdojNAZN53Wf29rPssZamfbC6MVerzcGwd9tNciMpsQh'
+        f = 'hdata/zdj7WjdojNAZN53Wf29rPssZamfbC6MVerzcGwd9tNciMpsQh'
+        self.assertTrue(os.path.getsize(f) > 2 * s3store._download_part_size)
+        boto3.client('s3', region_name='us-east-1').upload_file(Filename=f, Bucket=bucketname, Key=k)
+        fpath = os.path.join(self.tmp_dir, 's3.dat')
+        self.assertTrue(s3store.get(fpath, k))
+        self.assertEqual(self.md5sum(fpath), self.md5sum(f))
+        self.assertFalse(supports_remote_packs(s3store))
+
+        # a corrupted download leaves no file
+        s3store._md5_etag = lambda head: '0' * 32
+        corrupted_path = os.path.join(self.tmp_dir, 'corrupted.dat')
+        self.assertFalse(s3store.get(corrupted_path, k))
+        self.assertFalse([file for file in os.listdir(self.tmp_dir) if file.startswith('corrupted.dat')])
+        s3store._download_part_size = 8 * 1024 * 1024
+        self.assertFalse(s3store.get(corrupted_path, k))
+        self.assertFalse([file for file in os.listdir(self.tmp_dir) if file.startswith('corrupted.dat')])
+        self.assertTrue(supports_remote_packs(S3MultihashStore(bucketname, bucket)))
+
     def test_push(self):
         indexpath = os.path.join(self.tmp_dir, 'index-test')
         mdpath = os.path.join(self.tmp_dir, 'metadata-test')
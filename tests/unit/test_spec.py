@@ -11,7 +11,7 @@ import os
 
 from ml_git.spec import yaml_load, incr_version, is_valid_version, search_spec_file, SearchSpecException, spec_parse, \
     get_spec_file_dir, increment_version_in_spec, get_root_path, get_version, update_store_spec, validate_bucket_name, \
-    set_version_in_spec
+    set_version_in_spec, get_chunking
 from ml_git.utils import yaml_save
 
 testdir = 'specdata'
@@ -118,6 +118,18 @@ class SpecTestCases(unittest.TestCase):
         file = os.path.join(testdir, 'invalid2.spec')
         self.assertTrue(get_version(file) < 0)
 
+    def test_get_chunking(self):
+        tmpfile = os.path.join(self.tmp_dir, 'sample.spec')
+        spec_hash = yaml_load(os.path.join(testdir, 'valid.spec'))
+        yaml_save(spec_hash, tmpfile)
+        self.assertEqual(get_chunking(tmpfile), 'fixed')
+        spec_hash['dataset']['chunking'] = 'cdc'
+        yaml_save(spec_hash, tmpfile)
+        self.assertEqual(get_chunking(tmpfile), 'cdc')
+        spec_hash['dataset']['chunking'] = 'rabin'
+        yaml_save(spec_hash, tmpfile)
+        self.assertIsNone(get_chunking(tmpfile))
+
     def test_update_store_spec(self):
         spec_path = os.path.join(os.getcwd(), os.sep.join(['dataset', 'dataex', 'dataex.spec']))
 
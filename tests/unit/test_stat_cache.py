@@ -0,0 +1,109 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import os
+import unittest
+from unittest import mock
+
+import pytest
+
+from ml_git.file_system.hashfs import MultihashFS
+from ml_git.file_system.stat_cache import StatCache
+
+
+@pytest.mark.usefixtures('tmp_dir')
+class StatCacheTestCases(unittest.TestCase):
+
+    def _create_workspace(self):
+        path = os.path.join(self.tmp_dir, 'data')
+        os.makedirs(os.path.join(path, 'sub'))
+        for file in ['f1', 'f2', os.path.join('sub', 'f3')]:
+            with open(os.path.join(path, file), 'w') as f:
+                f.write(file)
+        return path
+
+    @mock.patch('ml_git.file_system.stat_cache.RACY_DELAY_NS', 0)
+    def test_walk(self):
+        path = self._create_workspace()
+        db_path = os.path.join(self.tmp_dir, 'metadata', 'STAT_CACHE.db')
+        stat_cache = StatCache(db_path)
+        entries = {rel_dir: sorted(files) for rel_dir, files in stat_cache.walk(path)}
+        self.assertEqual({'': ['f1', 'f2'], 'sub': ['f3']}, entries)
+        self.assertEqual([('sub', ['f3'])], list(stat_cache.walk(path, 'sub')))
+        stat_cache.close()
+
+        # a directory with the same mtime is not listed again
+        st = os.stat(path)
+        with open(os.path.join(path, 'f4'), 'w') as f:
+            f.write('f4')
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        stat_cache = StatCache(db_path)
+        entries = {rel_dir: sorted(files) for rel_dir, files in stat_cache.walk(path)}
+        self.assertEqual(['f1', 'f2'], entries[''])
+
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        entries = {rel_dir: sorted(files) for rel_dir, files in stat_cache.walk(path)}
+        self.assertEqual(['f1', 'f2', 'f4'], entries[''])
+        stat_cache.close()
+
+    def test_parallel_walk(self):
+        path = os.path.join(self.tmp_dir, 'data')
+        expected = {}
+        for i in range(5):
+            for j in range(4):
+                rel_dir = 'd%d/e%d' % (i, j)
+                os.makedirs(os.path.join(path, rel_dir, 'empty'))
+                expected[rel_dir] = ['f%d' % k for k in range(3)]
+                expected[rel_dir + '/empty'] = []
+                for file in expected[rel_dir]:
+                    open(os.path.join(path, rel_dir, file), 'w').close()
+            expected['d%d' % i] = []
+        expected[''] = []
+        stat_cache = StatCache(os.path.join(self.tmp_dir, 'STAT_CACHE.db'))
+        for nworkers in [1, 4]:
+            entries = {rel_dir: sorted(files) for rel_dir, files in stat_cache.walk(path, nworkers=nworkers)}
+            self.assertEqual(expected, entries)
+        entries = {rel_dir: sorted(files) for rel_dir, files in stat_cache.walk(path, 'd1', nworkers=4)}
+        self.assertEqual({rel_dir: files for rel_dir, files in expected.items() if rel_dir.startswith('d1')}, entries)
+        stat_cache.close()
+
+    @mock.patch('ml_git.file_system.stat_cache.RACY_DELAY_NS', 0)
+    def test_get_scid(self):
+        path = self._create_workspace()
+        db_path = os.path.join(self.tmp_dir, 'metadata', 'STAT_CACHE.db')
+        hfs = MultihashFS(os.path.join(self.tmp_dir, 'objects'))
+        full_path = os.path.join(path, 'sub', 'f3')
+        scid = hfs.get_scid(full_path)
+
+        stat_cache = StatCache(db_path)
+        self.assertIsNone(stat_cache.get('sub/f3', os.stat(full_path)))
+        self.assertEqual(scid, stat_cache.get_scid('sub/f3', full_path, hfs))
+        stat_cache.close()
+
+        stat_cache = StatCache(db_path)
+        self.assertEqual(scid, stat_cache.get('sub/f3', os.stat(full_path)))
+        with mock.patch.object(hfs, 'get_scid') as get_scid:
+            self.assertEqual(scid, stat_cache.get_scid('sub/f3', full_path, hfs))
+            get_scid.assert_not_called()
+
+        with open(full_path, 'w') as f:
+            f.write('changed')
+        self.assertIsNone(stat_cache.get('sub/f3', os.stat(full_path)))
+        self.assertEqual(hfs.get_scid(full_path), stat_cache.get_scid('sub/f3', full_path, hfs))
+        stat_cache.close()
+
+        # hashes are dropped when the chunking changes
+        stat_cache = StatCache(db_path, chunking='cdc')
+        self.assertIsNone(stat_cache.get('sub/f3', os.stat(full_path)))
+        stat_cache.close()
+
+    def test_racy_files_are_not_cached(self):
+        path = self._create_workspace()
+        stat_cache = StatCache(os.path.join(self.tmp_dir, 'STAT_CACHE.db'))
+        full_path = os.path.join(path, 'f1')
+        st = os.stat(full_path)
+        stat_cache.update('f1', st, 'zdj7W')
+        self.assertIsNone(stat_cache.get('f1', st))
+        stat_cache.close()
@@ -187,6 +187,20 @@ class UtilsTestCases(unittest.TestCase):
         expected_reclaimed_space = humanize.naturalsize(12860387)
         self.assertEqual(humanize.naturalsize(total_reclaimed_space), expected_reclaimed_space)
 
+    def test_remove_unnecessary_files_dry_run(self):
+        for shard in ['ab', 'cd', 'log']:
+            os.makedirs(os.path.join(self.tmp_dir, 'hashfs', shard))
+            for file in ['zdj7Wa', 'zdj7Wb']:
+                with open(os.path.join(self.tmp_dir, 'hashfs', shard, shard + file), 'w') as f:
+                    f.write('0' * 10)
+        path = os.path.join(self.tmp_dir, 'hashfs')
+        used = {'abzdj7Wa', 'cdzdj7Wb'}
+        self.assertEqual((2, 20), remove_unnecessary_files(used, path, dry_run=True, exclude=['log']))
+        self.assertTrue(os.path.exists(os.path.join(path, 'ab', 'abzdj7Wb')))
+        self.assertEqual((2, 20), remove_unnecessary_files(used, path, exclude=['log']))
+        self.assertFalse(os.path.exists(os.path.join(path, 'ab', 'abzdj7Wb')))
+        self.assertTrue(os.path.exists(os.path.join(path, 'log', 'logzdj7Wa')))
+
     def test_remove_other_files(self):
         file1 = os.path.join(self.tmp_dir, 'image1.jpg')
         file2 = os.path.join(self.tmp_dir, 'image2.jpg')
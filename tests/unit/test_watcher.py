@@ -0,0 +1,89 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import os
+import time
+import unittest
+from unittest import mock
+
+import pytest
+
+from ml_git.file_system.stat_cache import StatCache, CachedStat
+from ml_git.file_system.watcher import Journal, inotify_supported, start_watcher, stop_watcher
+
+
+@pytest.mark.usefixtures('tmp_dir')
+@unittest.skipIf(not inotify_supported(), 'requires inotify')
+class WatcherTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(self.tmp_dir, 'data')
+        os.makedirs(os.path.join(self.path, 'sub'))
+        for file in ['f1', os.path.join('sub', 'f2')]:
+            with open(os.path.join(self.path, file), 'w') as f:
+                f.write(file)
+        self.watch_path = os.path.join(self.tmp_dir, 'watch')
+        self.db_path = os.path.join(self.tmp_dir, 'STAT_CACHE.db')
+        start_watcher(self.path, self.watch_path)
+
+    def tearDown(self):
+        stop_watcher(self.watch_path)
+
+    def _scan(self):
+        stat_cache = StatCache(self.db_path, watch_path=self.watch_path)
+        stats = {}
+        for rel_dir, files in stat_cache.walk(self.path):
+            for file in files:
+                rel_path = rel_dir + '/' + file if rel_dir else file
+                stats[rel_path] = stat_cache.stat(rel_path, os.path.join(self.path, rel_path))
+        stat_cache.close()
+        return stats
+
+    def test_journal(self):
+        journal = Journal(self.watch_path)
+        self.assertTrue(journal.is_running())
+        token, paths = journal.changes()
+        self.assertIsNone(paths)
+
+        with open(os.path.join(self.path, 'f1'), 'a') as f:
+            f.write('changed')
+        os.makedirs(os.path.join(self.path, 'new', 'dir'))
+        token, paths = journal.changes(token)
+        # new/dir/ is reported too when it is created after new is watched
+        self.assertIn(paths, [{'f1', 'new/'}, {'f1', 'new/', 'new/dir/'}])
+
+        with open(os.path.join(self.path, 'new', 'dir', 'f3'), 'w') as f:
+            f.write('f3')
+        token, paths = journal.changes(token)
+        self.assertEqual({'new/dir/f3'}, paths)
+        self.assertEqual(set(), journal.changes(token)[1])
+
+    @mock.patch('ml_git.file_system.stat_cache.RACY_DELAY_NS', 0)
+    def test_stat_cache_watched(self):
+        stats = self._scan()
+        self.assertEqual(['f1', 'sub/f2'], sorted(stats))
+        self.assertNotIsInstance(stats['f1'], CachedStat)
+
+        stats = self._scan()
+        self.assertIsInstance(stats['f1'], CachedStat)
+        st = os.stat(os.path.join(self.path, 'f1'))
+        self.assertEqual((st.st_mtime, st.st_ctime), (stats['f1'].st_mtime, stats['f1'].st_ctime))
+
+        with open(os.path.join(self.path, 'sub', 'f2'), 'a') as f:
+            f.write('changed')
+        with open(os.path.join(self.path, 'sub', 'f3'), 'w') as f:
+            f.write('f3')
+        stats = self._scan()
+        self.assertEqual(['f1', 'sub/f2', 'sub/f3'], sorted(stats))
+        self.assertIsInstance(stats['f1'], CachedStat)
+        self.assertEqual(len('sub/f2changed'), stats['sub/f2'].st_size)
+
+        stop_watcher(self.watch_path)
+        for _ in range(100):
+            if not Journal(self.watch_path).is_running():
+                break
+            time.sleep(0.05)
+        stats = self._scan()
+        self.assertNotIsInstance(stats['f1'], CachedStat)